@@ -1,172 +1,331 @@
+import functools
+import os
+import sys
 import pandas as pd
 import numpy as np
 import altair as alt
-import geopandas as gpd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from nyc_collisions import density, geometry
+from nyc_collisions.aggregates import DailyAggregates
+from nyc_collisions.choropleth import ZipDensity
+from nyc_collisions.geometry import basemap
+from nyc_collisions.loader import load_collisions
+from nyc_collisions.profiling import profiled, stage
+from nyc_collisions.registry import ChartRegistry
+from nyc_collisions.schema import apply_schema
+from nyc_collisions.service import aggregate_url, data_url
+from nyc_collisions.weather import WeatherStore
+
+'''
+Every chart is registered as a factory and only built the first time it is requested with
+charts.get(name, data...) (or chart(name) for the default data). Built charts are memoized
+on a fingerprint of their inputs, so reruns of the Streamlit app reuse them.
+The data preparation and the pandas part of every chart are timed as stages
+(see nyc_collisions/profiling.py).
+'''
+
+COLLISIONS_PATH = "../data/preprocessed-collisions.csv"
+WEATHER_PATH = "../data/weather.csv"
+MAP_PATH = "../data/ny_city_map.geojson"
+EXPORT_DIR = "../data/.cache/exports" # static renders, see nyc_collisions/export.py
+
+charts = ChartRegistry(maxsize=16)
+
+# ------------------------------ Data ------------------------------- #
+
+@profiled('prepare collisions')
+def prepare_collisions(collisions):
+    collisions = collisions.drop(columns=['CRASH_TIME'])
+    collisions['DAY_WEEK'] = collisions['CRASH_DATETIME'].dt.day_name()
+    collisions['TYPE_DAY'] = collisions['DAY_WEEK'].apply(lambda day: 'Weekend' if day in ['Saturday', 'Sunday'] else 'Weekday')
+    collisions = apply_schema(collisions) # repeated strings as categoricals, see nyc_collisions/schema.py
+    return collisions[['CRASH_DATETIME', 'CRASH_DATE', 'DAY_WEEK', 'TYPE_DAY', 'BOROUGH', 'ZIP_CODE', 'LATITUDE', 'LONGITUDE', 'VEHICLE_TYPE_CODE1', 'VEHICLE_TYPE_CODE2','TOTAL_KILLED', 'PEDESTRIANS_KILLED', 'CYCLIST_KILLED', 'MOTORIST_KILLED' ]]
+
+@functools.lru_cache(maxsize=1)
+def default_collisions():
+    return prepare_collisions(load_collisions(COLLISIONS_PATH)) # CRASH_DATETIME is parsed once and cached
+
+@functools.lru_cache(maxsize=1)
+def default_weather():
+    # columnar, indexed by day: joined to the collisions without a merge
+    return WeatherStore.from_csv(WEATHER_PATH, columns=['datetime', 'temp', 'precip', 'windspeed',
+                                                        'humidity', 'cloudcover', 'conditions', 'visibility'])
+
+# Visualizations 1, 3 and 5 are rolled up from per-day, per-hour aggregates materialized
+# in data/.cache/daily; on startup only the days whose rows changed are recomputed, year
+# by year in a process pool for large datasets (see nyc_collisions/aggregates.py).
+AGGREGATES_DIR = "../data/.cache/daily"
+
+# years shown side by side by every chart, e.g. range(2012, 2024); None for all the years in the data
+YEARS = None
+
+# one color per year: the original orange and purple, then the rest of category20
+YEAR_COLORS = ['#ff7f0e', '#9467bd', '#1f77b4', '#2ca02c', '#d62728', '#8c564b', '#e377c2', '#7f7f7f', '#bcbd22', '#17becf',
+               '#ffbb78', '#c5b0d5', '#aec7e8', '#98df8a', '#ff9896', '#c49c94', '#f7b6d2', '#c7c7c7', '#dbdb8d', '#9edae5']
+
+def year_colors(years):
+    return [YEAR_COLORS[i % len(YEAR_COLORS)] for i in range(len(years))]
+
+@profiled('prepare daily')
+def prepare_daily(daily):
+    daily = daily.copy()
+    daily['year'] = daily['date'].dt.year
+    daily['DAY_WEEK'] = daily['date'].dt.day_name()
+    daily['TYPE_DAY'] = np.where(daily['DAY_WEEK'].isin(['Saturday', 'Sunday']), 'Weekend', 'Weekday')
+    return daily
+
+@functools.lru_cache(maxsize=1)
+def default_daily():
+    store = DailyAggregates(AGGREGATES_DIR)
+    collisions = default_collisions()
+    with stage('refresh daily aggregates'):
+        store.refresh(collisions)
+        daily = store.table(years=YEARS)
+    return prepare_daily(daily)
+
+@functools.lru_cache(maxsize=1)
+def shown_collisions():
+    collisions = default_collisions()
+    if YEARS is None:
+        return collisions
+    return collisions[collisions['CRASH_DATETIME'].dt.year.isin(list(YEARS)).to_numpy()]
+
+def chart_inputs(name, collisions, weather, daily):
+    if name in ('c1', 'c3'):
+        return (daily,)
+    if name == 'c5':
+        return (daily, weather)
+    return (collisions,)
+
+def default_inputs(name):
+    if name == 'c3':
+        return (default_daily(), data_url())
+    if name in ('c1', 'c5'):
+        return chart_inputs(name, None, default_weather(), default_daily())
+    return chart_inputs(name, shown_collisions(), None, None)
+
+def chart(name):
+    '''Chart `name` built from the default data files.'''
+    return charts.get(name, *default_inputs(name))
+
+def __getattr__(name):
+    # keeps `altair_visualizations.c1` working, built on first access
+    if name in charts:
+        return chart(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # ----------------------- Visualization 1 --------------------------- #
 
-collisions = pd.read_csv("../data/preprocessed-collisions.csv", dtype={'ZIP_CODE': str})
-collisions['CRASH_DATETIME'] = pd.to_datetime(collisions['CRASH_DATE'] + ' ' + collisions['CRASH_TIME'], format='%m/%d/%Y %H:%M')
-collisions = collisions.drop(columns=['CRASH_TIME'])
-collisions['DAY_WEEK'] = collisions['CRASH_DATETIME'].dt.day_name()
-collisions['TYPE_DAY'] = collisions['DAY_WEEK'].apply(lambda day: 'Weekend' if day in ['Saturday', 'Sunday'] else 'Weekday')
-collisions = collisions[['CRASH_DATETIME', 'CRASH_DATE', 'DAY_WEEK', 'TYPE_DAY', 'BOROUGH', 'ZIP_CODE', 'LATITUDE', 'LONGITUDE', 'VEHICLE_TYPE_CODE1', 'VEHICLE_TYPE_CODE2','TOTAL_KILLED', 'PEDESTRIANS_KILLED', 'CYCLIST_KILLED', 'MOTORIST_KILLED' ]]
-
-paired_bar_chart = alt.Chart(collisions[['CRASH_DATETIME', 'DAY_WEEK' ]]).mark_bar().encode(
-  x = alt.X('year:O', title = 'Type of day', axis=alt.Axis(title=None, labels=False, ticks=False)),
-  y = alt.Y('count:Q', title = 'Number of collisions', axis=alt.Axis(offset=6)),
-  color= alt.Color('year:O', scale = alt.Scale(range=['#ff7f0e', '#9467bd'])),
-  column = alt.Column('DAY_WEEK:N', title='Day of the Week',
-                      sort=['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'],
-                      header=alt.Header(titleOrient='bottom', labelOrient='bottom', labelPadding=4))
-).transform_calculate(
-  year = 'year(datum.CRASH_DATETIME)',
-).transform_aggregate(
-  count='count()',
-  groupby=['year', 'DAY_WEEK']
-).properties(
-  width=35
-)
+@charts.register('c1')
+def build_c1(daily):
+    with stage('transform c1'):
+        weekdays = daily.groupby(['year', 'DAY_WEEK', 'TYPE_DAY'], as_index=False)['collisions'].sum()
+        years = sorted(weekdays['year'].unique())
+
+    paired_bar_chart = alt.Chart(weekdays).mark_bar().encode(
+      x = alt.X('year:O', title = 'Type of day', axis=alt.Axis(title=None, labels=False, ticks=False)),
+      y = alt.Y('count:Q', title = 'Number of collisions', axis=alt.Axis(offset=6)),
+      color= alt.Color('year:O', scale = alt.Scale(range=year_colors(years))),
+      column = alt.Column('DAY_WEEK:N', title='Day of the Week',
+                          sort=['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'],
+                          header=alt.Header(titleOrient='bottom', labelOrient='bottom', labelPadding=4))
+    ).transform_aggregate(
+      count='sum(collisions)',
+      groupby=['year', 'DAY_WEEK']
+    ).properties(
+      width=max(35, 17.5 * len(years))
+    )
 
-slope_chart = alt.Chart(collisions[['CRASH_DATETIME', 'DAY_WEEK', 'TYPE_DAY']]).mark_line(point=True).encode(
-  x=alt.X('TYPE_DAY:O', title = 'Type of day'),
-  y=alt.Y('avg_collisions:Q', title = 'Average number of collisions'),
-  color=alt.Color('year:O', scale = alt.Scale(range=['#ff7f0e', '#9467bd']), legend=alt.Legend(title='Year')),
-).transform_calculate(
-  year='year(datum.CRASH_DATETIME)'
-).transform_aggregate(
-  count='count()',
-  groupby=['year', 'DAY_WEEK', 'TYPE_DAY']
-).transform_aggregate(
-  avg_collisions = 'mean(count)',
-  groupby=['year', 'TYPE_DAY']
-)
+    slope_chart = alt.Chart(weekdays).mark_line(point=True).encode(
+      x=alt.X('TYPE_DAY:O', title = 'Type of day'),
+      y=alt.Y('avg_collisions:Q', title = 'Average number of collisions'),
+      color=alt.Color('year:O', scale = alt.Scale(range=year_colors(years)), legend=alt.Legend(title='Year')),
+    ).transform_aggregate(
+      count='sum(collisions)',
+      groupby=['year', 'DAY_WEEK', 'TYPE_DAY']
+    ).transform_aggregate(
+      avg_collisions = 'mean(count)',
+      groupby=['year', 'TYPE_DAY']
+    )
 
-c1 = (paired_bar_chart | slope_chart).properties(
-     title='Number of collisions by day of the week and year'
-).configure_title(
-  anchor='middle', offset=25, fontSize=18, fontStyle='normal', fontWeight='normal'
-).configure_view(
-  stroke='transparent'
-).resolve_scale(
-  y='shared'
-)
+    return (paired_bar_chart | slope_chart).properties(
+         title='Number of collisions by day of the week and year'
+    ).configure_title(
+      anchor='middle', offset=25, fontSize=18, fontStyle='normal', fontWeight='normal'
+    ).configure_view(
+      stroke='transparent'
+    ).resolve_scale(
+      y='shared'
+    )
 
 # ----------------------- Visualization 2 --------------------------- #
 
-vehicle_type = pd.DataFrame({'vehicle_type': list(collisions['VEHICLE_TYPE_CODE1'].values) + list(collisions['VEHICLE_TYPE_CODE2'].values)})
-vehicle_type = vehicle_type.groupby('vehicle_type').size().reset_index(name='n_accidents')
-most_collisioned = list(vehicle_type.sort_values(by='n_accidents', ascending=False).head(10)['vehicle_type'])
-vehicle_type['vehicle_type'] = vehicle_type['vehicle_type'].apply(lambda x: x if x in most_collisioned else 'Others')
-vehicle_type = vehicle_type.groupby('vehicle_type').sum('counts').reset_index()
-vehicle_type = vehicle_type.sort_values(by='n_accidents', ascending=False)
-vehicle_type['percentage'] = round(vehicle_type['n_accidents'] / vehicle_type['n_accidents'].sum() * 100, 1)
-
-percentatge_bar_chart = alt.Chart(vehicle_type).mark_bar().encode(
-    x=alt.X('percentage:Q', title='Percentage of collisions'),
-    y=alt.Y('vehicle_type:N', 
-            sort=list(vehicle_type.loc[vehicle_type['vehicle_type'] != 'Others', 'vehicle_type']) + ['Others'], 
-            title='Vehicle Type'),
-    color=alt.condition(
-            alt.datum.vehicle_type == 'Others', 
-            alt.value('grey'),
-            alt.value('steelblue')
-        )
-)
+@charts.register('c2')
+def build_c2(collisions):
+    with stage('transform c2'):
+        vehicle_type = pd.DataFrame({'vehicle_type': list(collisions['VEHICLE_TYPE_CODE1'].values) + list(collisions['VEHICLE_TYPE_CODE2'].values)})
+        vehicle_type = vehicle_type.groupby('vehicle_type').size().reset_index(name='n_accidents')
+        most_collisioned = list(vehicle_type.sort_values(by='n_accidents', ascending=False).head(10)['vehicle_type'])
+        vehicle_type['vehicle_type'] = vehicle_type['vehicle_type'].apply(lambda x: x if x in most_collisioned else 'Others')
+        vehicle_type = vehicle_type.groupby('vehicle_type').sum('counts').reset_index()
+        vehicle_type = vehicle_type.sort_values(by='n_accidents', ascending=False)
+        vehicle_type['percentage'] = round(vehicle_type['n_accidents'] / vehicle_type['n_accidents'].sum() * 100, 1)
+
+    percentatge_bar_chart = alt.Chart(vehicle_type).mark_bar().encode(
+        x=alt.X('percentage:Q', title='Percentage of collisions'),
+        y=alt.Y('vehicle_type:N',
+                sort=list(vehicle_type.loc[vehicle_type['vehicle_type'] != 'Others', 'vehicle_type']) + ['Others'],
+                title='Vehicle Type'),
+        color=alt.condition(
+                alt.datum.vehicle_type == 'Others',
+                alt.value('grey'),
+                alt.value('steelblue')
+            )
+    )
 
-percentatge_text = alt.Chart(vehicle_type).mark_text(align='left', dx=2, color='black', size=10).encode(
-        x=alt.X('percentage:Q'),
-        y=alt.Y('vehicle_type:N', 
-            sort=list(vehicle_type.loc[vehicle_type['vehicle_type'] != 'Others', 'vehicle_type']) + ['Others']),
-        text='percentage:Q'
-)
+    percentatge_text = alt.Chart(vehicle_type).mark_text(align='left', dx=2, color='black', size=10).encode(
+            x=alt.X('percentage:Q'),
+            y=alt.Y('vehicle_type:N',
+                sort=list(vehicle_type.loc[vehicle_type['vehicle_type'] != 'Others', 'vehicle_type']) + ['Others']),
+            text='percentage:Q'
+    )
 
-c2 = (percentatge_bar_chart + percentatge_text).properties(
-        title='Percentage of the total collisions by vehicle type'
-).configure_title(
-        anchor='middle', fontSize=16, fontStyle='normal', fontWeight='normal', offset=20
-).properties(
-        width=500, 
-        height=400
-)
+    return (percentatge_bar_chart + percentatge_text).properties(
+            title='Percentage of the total collisions by vehicle type'
+    ).configure_title(
+            anchor='middle', fontSize=16, fontStyle='normal', fontWeight='normal', offset=20
+    ).properties(
+            width=500,
+            height=400
+    )
 
 
 # ----------------------- Visualization 3 --------------------------- #
 
-error_bar = alt.Chart(collisions).mark_errorbar(ticks=True).encode(
-    x=alt.X('hours:Q'),
-    y=alt.Y('count:Q', title='Average number of collisions'),
-    color = alt.Color('year:O', scale = alt.Scale(scheme='tableau10'))
-).transform_calculate(
-  year = 'year(datum.CRASH_DATETIME)',
-  hours = 'hours(datum.CRASH_DATETIME)'
-).transform_aggregate(
-   count='count()',
-   groupby=['year', 'hours', 'CRASH_DATE']
-)
+# With the data service running (see nyc_collisions/service.py) the averages per year and hour
+# are loaded from its aggregate endpoint, which computes them next to the data, instead of
+# being averaged in the browser from the rows of every day and hour.
 
-avg_deaths_line = alt.Chart(collisions[['CRASH_DATETIME', 'CRASH_DATE','TOTAL_KILLED']]).mark_trail().encode(
-    x = alt.X('hours:Q', title='Time of day'),
-    y = alt.Y('avg_collisions:Q', title='Average number of collisions'),
-    color = alt.Color('year:O', scale = alt.Scale(range=['#ff7f0e', '#9467bd']), title='Year'),
-    size = alt.Size('avg_killed:Q', title='Average deaths')
-).transform_calculate(
-  year = 'year(datum.CRASH_DATETIME)',
-  hours = 'hours(datum.CRASH_DATETIME)'
-).transform_aggregate(
-  count_collisions='count()',
-  count_killed='sum(TOTAL_KILLED)',
-  groupby=['year', 'hours', 'CRASH_DATE']
-).transform_aggregate(
-  avg_collisions='mean(count_collisions)',
-  avg_killed='mean(count_killed)',
-  groupby=['year', 'hours']
-)
+def hourly_averages(base_url):
+    url = aggregate_url('daily', base_url, groupby=['year', 'hour'], mean=['collisions', 'TOTAL_KILLED'], year=YEARS)
+    return alt.Chart(alt.Data(url=url, format=alt.DataFormat(type='json'))).transform_calculate(
+      hours='datum.hour', avg_collisions='datum.mean_collisions', avg_killed='datum.mean_TOTAL_KILLED'
+    )
 
-c3 = (avg_deaths_line + error_bar).properties(
-    title='Average collisions and deaths over time',
-    width=600,
-    height=400
-    ).configure_title(
-      anchor='middle', offset=25, fontSize=18, fontStyle='normal', fontWeight='normal'
+@charts.register('c3')
+def build_c3(daily, base_url=None):
+    # one row per day and hour: the collisions and deaths of every (year, hours, day)
+    daily = daily[['year', 'HOUR', 'collisions', 'TOTAL_KILLED']].rename(columns={'HOUR': 'hours'})
+    years = sorted(daily['year'].unique())
+
+    if base_url is None:
+        averages = alt.Chart(daily).transform_aggregate(
+          avg_collisions='mean(collisions)',
+          avg_killed='mean(TOTAL_KILLED)',
+          groupby=['year', 'hours']
+        )
+    else:
+        averages = hourly_averages(base_url)
+
+    error_bar = alt.Chart(daily).mark_errorbar(ticks=True).encode(
+        x=alt.X('hours:Q'),
+        y=alt.Y('collisions:Q', title='Average number of collisions'),
+        color = alt.Color('year:O', scale = alt.Scale(scheme='tableau10'))
+    )
+
+    avg_deaths_line = averages.mark_trail().encode(
+        x = alt.X('hours:Q', title='Time of day'),
+        y = alt.Y('avg_collisions:Q', title='Average number of collisions'),
+        color = alt.Color('year:O', scale = alt.Scale(range=year_colors(years)), title='Year'),
+        size = alt.Size('avg_killed:Q', title='Average deaths')
     )
 
+    return (avg_deaths_line + error_bar).properties(
+        title='Average collisions and deaths over time',
+        width=600,
+        height=400
+        ).configure_title(
+          anchor='middle', offset=25, fontSize=18, fontStyle='normal', fontWeight='normal'
+        )
+
 # ----------------------- Visualization 4 --------------------------- #
 
-'''
-Given the various issues we've encountered in displaying this visualization on Streamlit, 
-we have decided to save the image beforehand to directly showcase it in the application.
-'''
+# Collisions are joined to the ZIP code polygons (grid index) and divided by their cached
+# areas, so the choropleth is rebuilt in well under a second for any year or filter.
+
+@functools.lru_cache(maxsize=1)
+def zip_density():
+    return ZipDensity(MAP_PATH)
+
+@charts.register('c4')
+def build_c4(collisions, year=None):
+    if year is not None:
+        collisions = collisions[collisions['CRASH_DATETIME'].dt.year == year]
+    density_model = zip_density()
+    with stage('transform c4'):
+        polygons = density_model.join(collisions['LATITUDE'], collisions['LONGITUDE'])
+        zip_table = density_model.zip_table(polygons)
+        borough_table = density_model.borough_table(polygons)
+
+        # borough labels at the mean position of their collisions
+        found = polygons >= 0
+        labels = pd.DataFrame({
+            'BOROUGH': density_model.geocoder.boroughs[polygons[found]],
+            'LATITUDE': collisions['LATITUDE'].to_numpy()[found],
+            'LONGITUDE': collisions['LONGITUDE'].to_numpy()[found],
+        }).groupby('BOROUGH', as_index=False).mean()
+
+    with stage('basemap'):
+        ny_city_map = alt.InlineData(values=basemap(MAP_PATH),
+                                     format=alt.TopoDataFormat(type='topojson', feature=geometry.OBJECT_NAME))
+
+    choropleth = alt.Chart(ny_city_map).mark_geoshape(stroke='white', strokeWidth=0.5).transform_lookup(
+        lookup='properties.postalCode',
+        from_=alt.LookupData(zip_table, 'postalCode', ['density'])
+    ).encode(
+        color=alt.Color('density:Q', title='Number of accidents per km2', scale=alt.Scale(scheme='lighttealblue')),
+        tooltip=alt.Tooltip('density:Q', title='Number of accidents per km2', format='.1f'),
+    ).properties(
+        width=400,
+        height=350
+    )
 
-# ----------------------- Visualization 5 --------------------------- #
+    borough_names = alt.Chart(labels).mark_text(fontWeight='bold', fontSize=10).encode(
+        latitude='LATITUDE:Q',
+        longitude='LONGITUDE:Q',
+        text='BOROUGH:N',
+    )
 
-weather_original = pd.read_csv("../data/weather.csv")
-weather = weather_original[['datetime', 'temp', 'precip', 'windspeed', 
-                            'humidity', 'cloudcover', 'conditions', 'visibility']]
-weather['datetime'] = pd.to_datetime(weather['datetime'])
-coll_weather = pd.DataFrame({'datetime': collisions["CRASH_DATE"]})
-coll_weather['datetime'] = pd.to_datetime(coll_weather['datetime'])
-coll_weather = coll_weather.groupby(['datetime']).size().reset_index(name='collisions')
-coll_weather = pd.merge(coll_weather, weather, on='datetime')
-coll_weather['year'] = coll_weather['datetime'].dt.year
-coll_weather['conditions'] = coll_weather['conditions'].apply(lambda x: 'Rain, Overcast' if x=='Overcast' else x)
+    boroughs = alt.Chart(borough_table).mark_bar().encode(
+        x=alt.X('BOROUGH:N', title='Borough', sort='-y'),
+        y=alt.Y('density:Q', title='Number of Accidents per km2'),
+        tooltip=[alt.Tooltip('BOROUGH:N', title='Borough'), alt.Tooltip('density:Q', title='Number of Accidents per km2', format='.1f')],
+    ).properties(
+        width=150,
+        height=350
+    )
 
-coll_weather_2018 = coll_weather[coll_weather['year']==2018]
-coll_weather_2020 = coll_weather[coll_weather['year']==2020]
+    return alt.hconcat(choropleth + borough_names, boroughs).properties(
+        title='Number of Collisions by Postal Code and Borough'
+    ).configure_title(
+        anchor='middle', offset=25, fontSize=16, fontStyle='normal', fontWeight='normal'
+    ).configure_view(
+        stroke=None
+    )
+
+# ----------------------- Visualization 5 --------------------------- #
+
+# Densities, quartiles and whiskers are precomputed with nyc_collisions.density (same
+# bandwidth rule and quartiles as Vega-Lite), so the chart only draws the curve points
+# and the boxes instead of estimating them in the browser for every facet.
 
 width = 80
+box_size = 14
+extent = [0, 1000]
 
-boxplot = alt.Chart().mark_boxplot(color='black').encode(
-    alt.Y(f'collisions:Q')
-).properties(width=width)
-
-violin = alt.Chart().transform_density(
-    'collisions',
-    as_=['collisions', 'density'],
-    extent=[0, 1000],
-    groupby=['conditions']
-).mark_area(orient='horizontal').encode(
-    y='collisions:Q',
+violin = alt.Chart().transform_filter(alt.datum.layer == 'density').mark_area(orient='horizontal').encode(
+    y=alt.Y('collisions:Q', scale=alt.Scale(domain=extent)),
     color=alt.Color('conditions:N', legend=None, scale=alt.Scale(scheme='set2')),
     x=alt.X(
         'density:Q',
@@ -181,58 +340,97 @@ violin = alt.Chart().transform_density(
     height=300
 )
 
-facet = lambda coll_weather, title: alt.layer(violin, boxplot, data=coll_weather).facet(column='conditions:N').\
-    resolve_scale(x=alt.ResolveMode("independent")).properties(title=alt.TitleParams(text=title, anchor="middle", align="center"))
+boxes = alt.Chart().transform_filter(alt.datum.layer == 'box')
 
-c5 = alt.hconcat(facet(coll_weather_2018, "Summer 2018"),facet(coll_weather_2020, "Sumer 2020")).configure_facet(
-    spacing=0,
-).configure_header(
-    titleOrient='bottom',
-    labelOrient='bottom'
-).configure_view(
-    stroke=None
-).properties(
-    title='Collisions distribution for weather conditions',
-).configure_title(
-      anchor='middle', offset=25, fontSize=18, fontStyle='normal', fontWeight='normal'
+whiskers = boxes.mark_rule(color='black').encode(
+    y=alt.Y('lower:Q', title='collisions'), y2='upper:Q', x=alt.value(width / 2)
 )
 
-# ----------------------- Visualization 6 --------------------------- #
+box = boxes.mark_bar(color='black').encode(
+    y=alt.Y('q1:Q', title='collisions'), y2='q3:Q',
+    x=alt.value(width / 2 - box_size / 2), x2=alt.value(width / 2 + box_size / 2)
+)
 
-deadly_accidents = collisions[['CRASH_DATE', 'TOTAL_KILLED', 'PEDESTRIANS_KILLED', 'CYCLIST_KILLED', 'MOTORIST_KILLED']]
+median = boxes.mark_tick(color='white', size=box_size).encode(
+    y=alt.Y('median:Q', title='collisions'), x=alt.value(width / 2)
+)
 
-deadly_accidents = deadly_accidents[deadly_accidents['TOTAL_KILLED'] == deadly_accidents['PEDESTRIANS_KILLED'] + \
-                                                                        deadly_accidents['CYCLIST_KILLED'] + \
-                                                                        deadly_accidents['MOTORIST_KILLED']]
+outliers = alt.Chart().transform_filter(alt.datum.layer == 'outlier').mark_point(color='black').encode(
+    y=alt.Y('collisions:Q', title='collisions'), x=alt.value(width / 2)
+)
 
-deadly_accidents = deadly_accidents.drop(columns=['TOTAL_KILLED'])
-deadly_accidents['CRASH_DATE'] = pd.to_datetime(deadly_accidents['CRASH_DATE'])
-deadly_accidents['year'] = deadly_accidents['CRASH_DATE'].dt.year
-deadly_accidents = deadly_accidents.groupby('year').sum(['PEDESTRIANS_KILLED', 'CYCLIST_KILLED', 'MOTORIST_KILLED']).reset_index()
+boxplot = whiskers + box + median + outliers
 
-deadly_accidents_melted = deadly_accidents.melt('year', var_name='type', value_name='killed')
-deadly_accidents_melted['type'] = deadly_accidents_melted['type'].apply(lambda x: x.split('_')[0].lower())
-deadly_accidents_melted = deadly_accidents_melted.sort_values(by=['year', 'killed'], ascending=False).reset_index(drop=True)
+facet = lambda coll_weather, title: alt.layer(violin, boxplot, data=coll_weather).facet(column='conditions:N').\
+    resolve_scale(x=alt.ResolveMode("independent")).properties(title=alt.TitleParams(text=title, anchor="middle", align="center"))
 
-mortal_collisions = alt.Chart(deadly_accidents_melted).mark_bar().encode(
-    x=alt.X('year:O', title='Year'),
-    y=alt.Y('sum(killed):Q', title='Number of deaths'),
-    color=alt.Color('type:N', scale=alt.Scale(scheme='accent'), legend=alt.Legend(title='Type of user')),
-    order=alt.Order('type', sort='ascending'),
-).properties(
-    height=500
-)
+@charts.register('c5')
+def build_c5(daily, weather, bandwidth=None, steps=density.STEPS):
+    with stage('transform c5'):
+        coll_weather = daily.groupby('date', as_index=False)['collisions'].sum().rename(columns={'date': 'datetime'})
+        coll_weather = weather.join(coll_weather, on='datetime', columns=['conditions'], how='inner')
+        coll_weather['year'] = coll_weather['datetime'].dt.year
+        coll_weather['conditions'] = np.where(coll_weather['conditions'] == 'Overcast', 'Rain, Overcast', coll_weather['conditions'])
+
+    with stage('violin densities'):
+        coll_weather = density.violin_table(coll_weather, 'collisions', ['year', 'conditions'],
+                                            extent=extent, steps=steps, bandwidth=bandwidth)
+
+    years = sorted(coll_weather['year'].unique())
+
+    return alt.hconcat(*[facet(coll_weather[coll_weather['year'] == year], f"Summer {year}") for year in years]).configure_facet(
+        spacing=0,
+    ).configure_header(
+        titleOrient='bottom',
+        labelOrient='bottom'
+    ).configure_view(
+        stroke=None
+    ).properties(
+        title='Collisions distribution for weather conditions',
+    ).configure_title(
+          anchor='middle', offset=25, fontSize=18, fontStyle='normal', fontWeight='normal'
+    )
 
-deadly_accidents_melted['position'] = [61+15, 61+38+15, 15, 43+5, 43+40+5, 5]
+# ----------------------- Visualization 6 --------------------------- #
 
-number_of_deaths = alt.Chart(deadly_accidents_melted).mark_text(color='black', dy=7).encode(
-    x=alt.X('year:O', title='Year'),
-    y=alt.Y('position:Q', title='Number of deaths'),
-    text=alt.Text('killed:Q', format='.0f')
-)
+@charts.register('c6')
+def build_c6(collisions):
+    with stage('transform c6'):
+        deadly_accidents = collisions[['CRASH_DATETIME', 'TOTAL_KILLED', 'PEDESTRIANS_KILLED', 'CYCLIST_KILLED', 'MOTORIST_KILLED']]
+
+        deadly_accidents = deadly_accidents[deadly_accidents['TOTAL_KILLED'] == deadly_accidents['PEDESTRIANS_KILLED'] + \
+                                                                                deadly_accidents['CYCLIST_KILLED'] + \
+                                                                                deadly_accidents['MOTORIST_KILLED']]
+
+        deadly_accidents = deadly_accidents.drop(columns=['TOTAL_KILLED'])
+        deadly_accidents['year'] = deadly_accidents['CRASH_DATETIME'].dt.year
+        deadly_accidents = deadly_accidents.drop(columns=['CRASH_DATETIME'])
+        deadly_accidents = deadly_accidents.groupby('year').sum(['PEDESTRIANS_KILLED', 'CYCLIST_KILLED', 'MOTORIST_KILLED']).reset_index()
+
+        deadly_accidents_melted = deadly_accidents.melt('year', var_name='type', value_name='killed')
+        deadly_accidents_melted['type'] = deadly_accidents_melted['type'].str.split('_').str[0].str.lower()
+
+        # labels in the middle of their segment: bars are stacked by type, ascending from the bottom
+        deadly_accidents_melted = deadly_accidents_melted.sort_values(by=['year', 'type']).reset_index(drop=True)
+        deadly_accidents_melted['position'] = deadly_accidents_melted.groupby('year')['killed'].cumsum() - deadly_accidents_melted['killed'] / 2
+
+    mortal_collisions = alt.Chart(deadly_accidents_melted).mark_bar().encode(
+        x=alt.X('year:O', title='Year'),
+        y=alt.Y('sum(killed):Q', title='Number of deaths'),
+        color=alt.Color('type:N', scale=alt.Scale(scheme='accent'), legend=alt.Legend(title='Type of user')),
+        order=alt.Order('type', sort='ascending'),
+    ).properties(
+        height=500
+    )
 
-c6 = (mortal_collisions + number_of_deaths).properties(
-     title='Number of deaths by type of user and year'
-).configure_title(
-  anchor='middle', offset=25, fontSize=16, fontStyle='normal', fontWeight='normal'
-)
\ No newline at end of file
+    number_of_deaths = alt.Chart(deadly_accidents_melted[deadly_accidents_melted['killed'] > 0]).mark_text(color='black').encode(
+        x=alt.X('year:O', title='Year'),
+        y=alt.Y('position:Q', title='Number of deaths'),
+        text=alt.Text('killed:Q', format='.0f')
+    )
+
+    return (mortal_collisions + number_of_deaths).properties(
+         title='Number of deaths by type of user and year'
+    ).configure_title(
+      anchor='middle', offset=25, fontSize=16, fontStyle='normal', fontWeight='normal'
+    )
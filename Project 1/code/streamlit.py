@@ -1,7 +1,16 @@
+import os
+import sys
 import streamlit as st
-from streamlit.components.v1 import html
-import base64
-from altair_visualizations import *
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from nyc_collisions.profiling import profiler, stage, streamlit_panel
+from nyc_collisions.warmup import streamlit_warmup
+
+run = profiler.begin_run('project1') # every rerun is timed, see the Diagnostics panel
+
+# pandas, Altair and the data are loaded on a thread pool once per server process: the page is
+# laid out first and every chart fills its placeholder when it is ready (see nyc_collisions/warmup.py)
+warmup = streamlit_warmup('altair_visualizations')
 
 st.set_page_config(layout="wide")
 
@@ -25,38 +34,45 @@ with st.sidebar:
         """
     )
 
-# make surt c4.svg is in a folder called data one level below the code folder
-with open ("../data/c4.svg", "r") as f:
-    c4 = f.read()
+    static = st.sidebar.checkbox('Static images', value=st.query_params.get('static') == '1',
+                                 help='Show pre-rendered charts without interactivity (faster on slow connections).')
+    diagnostics = st.sidebar.checkbox('Diagnostics', value=st.query_params.get('diagnostics') == '1',
+                                      help='Time of every stage of the last rerun.')
+
+names = ['c1', 'c4', 'c3', 'c2', 'c6', 'c5'] # in reading order, the first ones are ready first
+# static images are pre-rendered by python -m nyc_collisions.export
+futures = {name: warmup.image(name) if static else warmup.spec(name) for name in names}
+
+def placeholder():
+    slot = st.empty()
+    slot.caption('⏳ Loading chart...')
+    return slot
+
+slots = {}
 
 with st.container():
     col1, col2 = st.columns([1.1, 1])
 
     with col1:
-        st.altair_chart(c1, use_container_width=True)
+        slots['c1'] = placeholder()
     with col2:  
-        
-        b64 = base64.b64encode(c4.encode("utf-8")).decode("utf-8")
-        html = f'<img src="data:image/svg+xml;base64,{b64}" style="width: {"100%"}; height: {"auto"};"/>'
-        st.write(html, unsafe_allow_html=True, use_container_width=True)
-            
-        # st.image("c4.svg", use_column_width=True)
+        slots['c4'] = placeholder()
         
 with st.container():  
     col1, col2 = st.columns([1, 1])
     
     with col1:
-        st.altair_chart(c3, use_container_width=True)
+        slots['c3'] = placeholder()
     with col2:
-        st.altair_chart(c2, use_container_width=True)
+        slots['c2'] = placeholder()
 
 with st.container():
     col1, col2 = st.columns([1, 3])
     
     with col1: 
-        col1.altair_chart(c6, use_container_width=True)
+        slots['c6'] = placeholder()
     with col2:
-        col2.altair_chart(c5, use_container_width=True)
+        slots['c5'] = placeholder()
 
 st.markdown("---")
 
@@ -79,3 +95,14 @@ st.write("In the bottom, we can see two violin plots juxtaposed, one for each ye
 
 st.write("### What is the annual fatality count in accidents in New York, and how does that total break down by user type, including pedestrians, cyclists, and motorists?")
 st.write("In the bottom-left chart, we can observe the number of fatalities in accidents depending on the year (summer). Looking at the length of the first bar, we can see that in 2018 (summer), there were 88 fatal accidents, and in 2020, there were 114, an increase of 26. We notice that fatal accidents constitute a very small percentage of the total accidents, indicating that typically, there are few accidents resulting in fatalities. This is surprising, as shown in the top-left chart, where there are many more accidents in 2018 than in 2020, yet in 2020, they are more lethal. Examining the numbers within each color of the bar chart allows us to compare the number of fatalities each year based on the type of user. We observe that the most significant difference is in the number of motorist deaths, which has increased by 18.")
+
+for name, chart in warmup.completed(futures):
+    with stage(f'deliver {name}'):
+        if static:
+            slots[name].markdown(chart, unsafe_allow_html=True)
+        else:
+            slots[name].vega_lite_chart(chart, use_container_width=True)
+
+run = profiler.end_run()
+if diagnostics:
+    streamlit_panel(run)
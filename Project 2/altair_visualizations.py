@@ -1,8 +1,77 @@
-import pandas as pd
+import functools
+import os
+import sys
 import numpy as np
 import altair as alt
 
-collisions = pd.read_csv('data/preprocessed-collisions-final.csv') 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from nyc_collisions.crossfilter import Crossfilter
+from nyc_collisions.cube import Cube
+from nyc_collisions import geometry
+from nyc_collisions.geocoder import flat_rings, read_polygons
+from nyc_collisions.geometry import basemap
+from nyc_collisions.loader import load_collisions
+from nyc_collisions.profiling import profiled, stage
+from nyc_collisions.registry import ChartRegistry
+from nyc_collisions.schema import encoded_chart, map_expression
+from nyc_collisions import spatial_bins
+from nyc_collisions.spatial_index import GridIndex
+
+'''
+Every chart is registered as a factory and only built the first time it is requested with
+charts.get(name, data...) (or chart(name) for the default data). Built charts are memoized
+on a fingerprint of their inputs, so reruns of the Streamlit app reuse them.
+The data preparation and the aggregation of the map are timed as stages
+(see nyc_collisions/profiling.py).
+'''
+
+COLLISIONS_PATH = 'data/preprocessed-collisions-final.csv'
+MAP_PATH = '../Project 1/data/ny_city_map.geojson'
+EXPORT_DIR = 'data/.cache/exports' # static renders, see nyc_collisions/export.py
+
+charts = ChartRegistry(maxsize=32)
+
+# ------------------------------- Data -------------------------------------
+
+# Every view except the map only needs collision counts, so the group-by they used to run 
+# in the browser is computed once here and the charts are fed the occupied cells.
+# Categorical columns are sent as integer codes that each view decodes first
+# (nyc_collisions.schema.encoded_chart), so the labels are not repeated in every row,
+# and the emojis are mapped in the spec so that all the views share one dataset.
+cube_dims = ['MONTH', 'DAY_WEEK', 'BOROUGH', 'VEHICLE_TYPE_CODE1', 'HOUR', 'icon', 'DAY', 'CASUALTIES']
+
+@profiled('build counts')
+def build_counts(collisions):
+    return Cube.from_frame(collisions, cube_dims).to_frame('count')
+
+@functools.lru_cache(maxsize=1)
+def default_collisions():
+    collisions = load_collisions(COLLISIONS_PATH)
+    with stage('prepare collisions'):
+        return collisions.drop(columns=['YEAR'])
+
+@functools.lru_cache(maxsize=1)
+def default_counts():
+    return build_counts(default_collisions())
+
+def default_inputs(name):
+    if name == 'ny_city':
+        return (MAP_PATH,)
+    if name == 'c4':
+        return (default_collisions(),)
+    if name == 'final_chart':
+        return (default_collisions(), default_counts())
+    return (default_counts(),)
+
+def chart(name):
+    '''Chart `name` built from the default data files.'''
+    return charts.get(name, *default_inputs(name))
+
+def __getattr__(name):
+    # keeps `altair_visualizations.final_chart` working, built on first access
+    if name in charts:
+        return chart(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 options_month = ['June', 'July', 'August', 'September']
 input_dropdown_month = alt.binding_select(options=options_month + [None], labels=options_month + ['All'], name='Month:  ')
@@ -17,34 +86,31 @@ weather_icon_to_emoji = {
     'cloudy': '☁️'
 }
 
-collisions['weather_emoji'] = collisions['icon'].map(weather_icon_to_emoji)
-
 selection_weather = alt.selection_point(encodings=['x'])
 
-base = alt.Chart(collisions).encode(
-  x=alt.X('icon:N', title='Weather', sort='-y', axis=alt.Axis(labelAngle=0)),
-  y=alt.Y('sum(count):Q', title='Number of Accidents'),
-  tooltip=['icon:N', 'sum(count):Q']
-).transform_aggregate(
-  count = 'count()',
-  groupby=['MONTH', 'DAY_WEEK', 'BOROUGH', 'VEHICLE_TYPE_CODE1', 'HOUR', 'icon', 'DAY', 'CASUALTIES', 'weather_emoji']
-).add_params( 
-  selection_month, selection_weather
-).transform_filter(
-  selection_month
-).properties(
-    title='Number of collisions by type of weather',
-    height=300, 
-    width=275
-)
-
-color = alt.condition(selection_weather, 
-                      alt.Color('CASUALTIES:N', scale=alt.Scale(range=['teal', 'orange'])), 
-                      alt.value('lightgray'))
-
-c1 = base.mark_bar().encode(color=color) + base.mark_text(dy=-11, size=30).encode(text='weather_emoji:N')
-
-collisions = collisions.drop(columns=['weather_emoji'])
+@charts.register('c1')
+def build_c1(counts):
+    base = encoded_chart(counts).transform_calculate(
+      weather_emoji=map_expression('icon', weather_icon_to_emoji)
+    ).encode(
+      x=alt.X('icon:N', title='Weather', sort='-y', axis=alt.Axis(labelAngle=0)),
+      y=alt.Y('sum(count):Q', title='Number of Accidents'),
+      tooltip=['icon:N', 'sum(count):Q']
+    ).add_params( 
+      selection_month, selection_weather
+    ).transform_filter(
+      selection_month
+    ).properties(
+        title='Number of collisions by type of weather',
+        height=300, 
+        width=275
+    )
+
+    color = alt.condition(selection_weather, 
+                          alt.Color('CASUALTIES:N', scale=alt.Scale(range=['teal', 'orange'])), 
+                          alt.value('lightgray'))
+
+    return base.mark_bar().encode(color=color) + base.mark_text(dy=-11, size=30).encode(text='weather_emoji:N')
 
 # -------------------------------  c2  -------------------------------------
 
@@ -56,174 +122,324 @@ vehicle_type_to_emoji = {
     'Fire truck': '🚒'
 } 
 
-collisions['vehicle_emoji'] = collisions['VEHICLE_TYPE_CODE1'].map(vehicle_type_to_emoji)
-
-base = alt.Chart(collisions).encode(
-  x=alt.X('VEHICLE_TYPE_CODE1:N', title='Weather', sort='-y', axis=alt.Axis(labelAngle=0)),
-  y=alt.Y('sum(count):Q', title='Number of Accidents'), 
-  tooltip=['VEHICLE_TYPE_CODE1:N', 'sum(count):Q']
-).transform_aggregate(
-  count = 'count()',
-  groupby=['MONTH', 'DAY_WEEK', 'BOROUGH', 'VEHICLE_TYPE_CODE1', 'HOUR', 'icon', 'DAY', 'CASUALTIES', 'vehicle_emoji']
-).add_params( 
-  selection_month, selection_vehicle
-).transform_filter(
-  selection_month
-).properties(
-    title='Number of collisions by type of weather',
-    width=200,
-    height=300,
-)
-
-color = alt.condition(selection_vehicle, 
-                      alt.Color('CASUALTIES:N', scale=alt.Scale(range=['teal', 'orange'])), 
-                      alt.value('lightgray'))
-
-c2 = base.mark_bar().encode(color=color) + base.mark_text(dy=-13, size=30).encode(text='vehicle_emoji:N')
-
-collisions = collisions.drop(columns=['vehicle_emoji'])
+@charts.register('c2')
+def build_c2(counts):
+    base = encoded_chart(counts).transform_calculate(
+      vehicle_emoji=map_expression('VEHICLE_TYPE_CODE1', vehicle_type_to_emoji)
+    ).encode(
+      x=alt.X('VEHICLE_TYPE_CODE1:N', title='Weather', sort='-y', axis=alt.Axis(labelAngle=0)),
+      y=alt.Y('sum(count):Q', title='Number of Accidents'), 
+      tooltip=['VEHICLE_TYPE_CODE1:N', 'sum(count):Q']
+    ).add_params( 
+      selection_month, selection_vehicle
+    ).transform_filter(
+      selection_month
+    ).properties(
+        title='Number of collisions by type of weather',
+        width=200,
+        height=300,
+    )
+
+    color = alt.condition(selection_vehicle, 
+                          alt.Color('CASUALTIES:N', scale=alt.Scale(range=['teal', 'orange'])), 
+                          alt.value('lightgray'))
+
+    return base.mark_bar().encode(color=color) + base.mark_text(dy=-13, size=30).encode(text='vehicle_emoji:N')
 
 # -------------------------------  c3  -------------------------------------
 
 selection_day = alt.selection_interval(encodings=['x'])
 
-base = alt.Chart(collisions).encode(
-    x=alt.X('DAY:O', title='Day of the month', scale=alt.Scale(domain=np.arange(1, 32)), axis=alt.Axis(labelAngle=0)),
-    y=alt.Y('MONTH:N', title='Month', scale=alt.Scale(domain=options_month)),
-    tooltip=['DAY:O', 'MONTH:N', 'sum(count):Q'],
-).transform_aggregate(
-    count = 'count()',
-    groupby=['MONTH', 'DAY_WEEK', 'BOROUGH', 'VEHICLE_TYPE_CODE1', 'HOUR', 'icon', 'DAY']
-).add_params(
-    selection_month, selection_day
-).transform_filter(
-    selection_month 
-).properties(
-    title='Number of collisions by day of the month',
-)
-
-heatmap = base.mark_rect().encode(
-    color = alt.condition(selection_day, 
-                          alt.Color('sum(count):Q', scale=alt.Scale(scheme='lightgreyred'), legend=None),
-                          alt.value('lightgray'), legend=None),
-).properties(
-    width=550,
-    height=175
-)
-
-c3 = heatmap + base.mark_text(baseline='middle').encode(
-    text='sum(count):Q', 
-    color = alt.condition(selection_day, 
-                          alt.value('black'), 
-                          alt.value('lightgray')))
+@charts.register('c3')
+def build_c3(counts):
+    base = encoded_chart(counts).encode(
+        x=alt.X('DAY:O', title='Day of the month', scale=alt.Scale(domain=np.arange(1, 32)), axis=alt.Axis(labelAngle=0)),
+        y=alt.Y('MONTH:N', title='Month', scale=alt.Scale(domain=options_month)),
+        tooltip=['DAY:O', 'MONTH:N', 'sum(count):Q'],
+    ).add_params(
+        selection_month, selection_day
+    ).transform_filter(
+        selection_month 
+    ).properties(
+        title='Number of collisions by day of the month',
+    )
+
+    heatmap = base.mark_rect().encode(
+        color = alt.condition(selection_day, 
+                              alt.Color('sum(count):Q', scale=alt.Scale(scheme='lightgreyred'), legend=None),
+                              alt.value('lightgray'), legend=None),
+    ).properties(
+        width=550,
+        height=175
+    )
+
+    return heatmap + base.mark_text(baseline='middle').encode(
+        text='sum(count):Q', 
+        color = alt.condition(selection_day, 
+                              alt.value('black'), 
+                              alt.value('lightgray')))
 
 # -------------------------------  c4  -------------------------------------
 
-raw_github_url = 'https://raw.githubusercontent.com/benetraco/ny_map/main/ny_city_map.geojson'
-ny_city_map = alt.Data(url=raw_github_url, format=alt.DataFormat(property='features'))
-ny_city = alt.Chart(ny_city_map).mark_geoshape(fill='lightgray', stroke='white', strokeWidth=1.3, opacity=0.4).encode(tooltip=alt.value(None)) 
+@charts.register('ny_city')
+def build_ny_city(map_path, level='medium'):
+    # Basemap served from the local geojson as simplified, quantized TopoJSON (cached in data/.cache)
+    ny_city_map = alt.InlineData(values=basemap(map_path, level=level),
+                                 format=alt.TopoDataFormat(type='topojson', feature=geometry.OBJECT_NAME))
+    return alt.Chart(ny_city_map).mark_geoshape(fill='lightgray', stroke='white', strokeWidth=1.3, opacity=0.4).encode(tooltip=alt.value(None)) 
 
 brush_map = alt.selection_interval()
 
-c4 = alt.Chart(collisions).mark_point(size=3, opacity=0.7, filled=True).encode(
-    latitude='LATITUDE:Q',
-    longitude='LONGITUDE:Q',
+# Fields of the selections that filter the map; aggregated cells keep them so that
+# crossfiltering still works on the binned map
+c4_fields = ['BOROUGH', 'MONTH', 'icon', 'VEHICLE_TYPE_CODE1', 'DAY_WEEK', 'HOUR', 'DAY']
+c4_width, c4_height = 350, 400
+
+@charts.register('c4')
+def build_c4(collisions, mode='auto', zoom=1.0, map_path=MAP_PATH):
+    '''Collisions map: one point per collision ('points'), aggregated 'hexbin' or 'grid'
+    cells, or a 'raster' image. 'auto' switches from points to hexbins above
+    spatial_bins.POINTS_LIMIT collisions; zoom > 1 makes the cells smaller.'''
+    if mode == 'auto':
+        mode = 'points' if len(collisions) <= spatial_bins.POINTS_LIMIT else 'hexbin'
+    if mode == 'raster':
+        return build_c4_raster(collisions, map_path)
+
     color = alt.condition(brush_map, 
                           alt.Color('BOROUGH:N', legend=None, scale=alt.Scale(scheme='dark2')), 
-                          alt.value('lightgray')),
-    tooltip=['BOROUGH:N', 'VEHICLE_TYPE_CODE1:N', 'icon:N', 'HOUR:O', 'MONTH:N', 'DAY_WEEK:N', 'DAY:O'],
-).add_params(
-    selection_month, brush_map
-).transform_filter(
-    selection_month 
-).properties(
-    title='Number of collisions by borough',
-).properties(
-    height=400, 
-    width=350
-)
+                          alt.value('lightgray'))
+
+    if mode == 'points':
+        chart = encoded_chart(collisions[['LATITUDE', 'LONGITUDE'] + c4_fields]).mark_point(size=3, opacity=0.7, filled=True).encode(
+            latitude='LATITUDE:Q',
+            longitude='LONGITUDE:Q',
+            color = color,
+            tooltip=['BOROUGH:N', 'VEHICLE_TYPE_CODE1:N', 'icon:N', 'HOUR:O', 'MONTH:N', 'DAY_WEEK:N', 'DAY:O'],
+        )
+    else:
+        with stage('transform c4', mode=mode):
+            bounds = spatial_bins.extent(collisions['LATITUDE'].dropna(), collisions['LONGITUDE'].dropna())
+            size = spatial_bins.cell_size(bounds, c4_width, c4_height, zoom)
+            cells = spatial_bins.aggregate(collisions, mode, size, keep=c4_fields)
+        # symbol size is the area of the square the [-1, 1] shape is scaled to
+        pixels = size / spatial_bins.cell_size(bounds, c4_width, c4_height, cell_pixels=1)
+        symbol = (2 * pixels / np.sqrt(3)) ** 2 if mode == 'hexbin' else pixels ** 2
+        chart = encoded_chart(cells).mark_point(shape=spatial_bins.SHAPES[mode], size=symbol, filled=True).encode(
+            latitude='LATITUDE:Q',
+            longitude='LONGITUDE:Q',
+            color = color,
+            opacity=alt.Opacity('sum(count):Q', legend=None, scale=alt.Scale(type='log', range=[0.35, 1])),
+            tooltip=['BOROUGH:N', alt.Tooltip('sum(count):Q', title='Collisions')],
+        )
+
+    return chart.add_params(
+        selection_month, brush_map
+    ).transform_filter(
+        selection_month 
+    ).properties(
+        title='Number of collisions by borough',
+    ).properties(
+        height=c4_height, 
+        width=c4_width
+    )
+
+def build_c4_raster(collisions, map_path=MAP_PATH):
+    # Static image of the points (colored by borough): the browser only gets one PNG, but
+    # the other selections cannot filter it. The brush is still available to the other views.
+    # The image covers the whole view, with the bounds the basemap projection is fitted to.
+    rings = np.concatenate([ring for _, parts in read_polygons(map_path) for ring in flat_rings(parts)])
+    bounds = spatial_bins.extent(rings[:, 1], rings[:, 0])
+    with stage('transform c4', mode='raster'):
+        image = spatial_bins.raster_frame(collisions, 'BOROUGH', bounds, width=c4_width, height=c4_height)
+    return alt.Chart(image).mark_image(width=c4_width, height=c4_height, align='left', baseline='top').encode(
+        url='url:N', x=alt.value(0), y=alt.value(0)
+    ).add_params(
+        brush_map
+    ).properties(
+        title='Number of collisions by borough',
+    ).properties(
+        height=c4_height, 
+        width=c4_width
+    )
 
 # -------------------------------  c41  ------------------------------------
 
 selection_borough = alt.selection_point(fields=['BOROUGH'])
 
-c41 = alt.Chart(collisions).mark_bar().encode(
-  x=alt.X('sum(count):Q', title='Number of Collisions'),
-  y=alt.Y('BOROUGH:N', title='Borough', sort='-x', axis=alt.Axis(labelAngle=0)),
-  color=alt.condition(selection_borough, alt.Color('BOROUGH:N'), alt.value('lightgray')),
-  tooltip=['BOROUGH:N', 'sum(count):Q'],
-).transform_aggregate(
-    count = 'count()',
-    groupby=['MONTH', 'DAY_WEEK', 'BOROUGH', 'VEHICLE_TYPE_CODE1', 'HOUR', 'icon', 'DAY']
-).add_params(
-    selection_month, selection_borough
-).transform_filter(
-    selection_month & brush_map
-).properties(
-    width=500,
-    height=175
-)
+@charts.register('c41')
+def build_c41(counts):
+    return encoded_chart(counts).mark_bar().encode(
+      x=alt.X('sum(count):Q', title='Number of Collisions'),
+      y=alt.Y('BOROUGH:N', title='Borough', sort='-x', axis=alt.Axis(labelAngle=0)),
+      color=alt.condition(selection_borough, alt.Color('BOROUGH:N'), alt.value('lightgray')),
+      tooltip=['BOROUGH:N', 'sum(count):Q'],
+    ).add_params(
+        selection_month, selection_borough
+    ).transform_filter(
+        selection_month & brush_map
+    ).properties(
+        width=500,
+        height=175
+    )
 
 # -------------------------------- c5 ------------------------------------
 
 selection_hour = alt.selection_interval(encodings=['x'])
 selection_hour_point = alt.selection_point(encodings=['x'])
 
-c5  = alt.Chart(collisions).mark_line(point=True).encode(
-    x=alt.X('HOUR:O', title='Hour of Day', scale=alt.Scale(domain=np.arange(1, 24)), axis=alt.Axis(labelAngle=0)),
-    y=alt.Y('sum(count):Q', title='Number of Collisions'),
-    color=alt.condition(selection_hour & selection_hour_point, alt.value('steelblue'), alt.value('lightgray')),
-    tooltip=['HOUR:O', 'sum(count):Q'],
-).transform_aggregate(
-    count = 'count()',
-    groupby=['MONTH', 'DAY_WEEK', 'BOROUGH', 'VEHICLE_TYPE_CODE1', 'HOUR', 'icon', 'DAY']
-).add_params(
-    selection_month, selection_hour, selection_hour_point
-).transform_filter(
-    selection_month 
-).properties(
-    title='Number of collisions by hour of day',
-    width=550,
-    height=175
-)
+@charts.register('c5')
+def build_c5(counts):
+    return encoded_chart(counts).mark_line(point=True).encode(
+        x=alt.X('HOUR:O', title='Hour of Day', scale=alt.Scale(domain=np.arange(1, 24)), axis=alt.Axis(labelAngle=0)),
+        y=alt.Y('sum(count):Q', title='Number of Collisions'),
+        color=alt.condition(selection_hour & selection_hour_point, alt.value('steelblue'), alt.value('lightgray')),
+        tooltip=['HOUR:O', 'sum(count):Q'],
+    ).add_params(
+        selection_month, selection_hour, selection_hour_point
+    ).transform_filter(
+        selection_month 
+    ).properties(
+        title='Number of collisions by hour of day',
+        width=550,
+        height=175
+    )
 
 # -------------------------------  c6 ------------------------------------
 
 selection_dayweek = alt.selection_point(encodings=['y'])
 days_week = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
 
-base = alt.Chart(collisions).encode(
-    y=alt.Y('DAY_WEEK:N', title='Day of Week', 
-            sort='-x'),
-    x=alt.X('sum(count):Q', title='Number of Collisions'),
-    color=alt.condition(selection_dayweek, alt.value('steelblue'), alt.value('lightgray')),
-    tooltip=['DAY_WEEK:N', 'sum(count):Q'],
-).transform_aggregate(
-    count = 'count()',
-    groupby=['MONTH', 'DAY_WEEK', 'BOROUGH', 'VEHICLE_TYPE_CODE1', 'HOUR', 'icon', 'DAY']
-).add_params(
-    selection_month, selection_dayweek, 
-).transform_filter(
-    selection_month
-).properties(
-    title='Number of collisions by day of week',
-    width=500,
-    height=175
-)
-
-c6 = base.mark_point(filled=True) + base.mark_rule()
+@charts.register('c6')
+def build_c6(counts):
+    base = encoded_chart(counts).encode(
+        y=alt.Y('DAY_WEEK:N', title='Day of Week', 
+                sort='-x'),
+        x=alt.X('sum(count):Q', title='Number of Collisions'),
+        color=alt.condition(selection_dayweek, alt.value('steelblue'), alt.value('lightgray')),
+        tooltip=['DAY_WEEK:N', 'sum(count):Q'],
+    ).add_params(
+        selection_month, selection_dayweek, 
+    ).transform_filter(
+        selection_month
+    ).properties(
+        title='Number of collisions by day of week',
+        width=500,
+        height=175
+    )
+
+    return base.mark_point(filled=True) + base.mark_rule()
 
 
 # Interactions
 
-c1 = c1.transform_filter(selection_vehicle & selection_borough & selection_dayweek & selection_hour & brush_map & selection_day & selection_hour_point)
-c2 = c2.transform_filter(selection_weather & selection_borough & selection_dayweek & selection_hour & brush_map & selection_day & selection_hour_point)
-c3 = c3.transform_filter(selection_vehicle & selection_weather & selection_dayweek & selection_hour & brush_map & selection_weather & selection_hour_point)
-c4 = c4.transform_filter(selection_vehicle & selection_borough & selection_dayweek & selection_hour & selection_day & selection_weather & selection_hour_point)
-c41 = c41.transform_filter(selection_vehicle & selection_dayweek & selection_hour & selection_day & selection_weather & brush_map & selection_hour_point)
-c5 = c5.transform_filter(selection_vehicle & selection_borough & selection_dayweek & selection_day & selection_weather & brush_map)
-c6 = c6.transform_filter(selection_vehicle & selection_borough & selection_hour & selection_day & selection_weather & brush_map & selection_hour_point)
-
-# Final chart
-
-final_chart = (((((ny_city + c4) & c41) & c6) | ((c1 | c2) & c3 & c5)).configure_title(anchor='middle'))
\ No newline at end of file
+@charts.register('final_chart')
+def build_final_chart(collisions, counts, map_path=MAP_PATH):
+    ny_city = charts.get('ny_city', map_path)
+    c1, c2, c3, c41, c5, c6 = (charts.get(name, counts) for name in ['c1', 'c2', 'c3', 'c41', 'c5', 'c6'])
+    c4 = charts.get('c4', collisions)
+
+    c1 = c1.transform_filter(selection_vehicle & selection_borough & selection_dayweek & selection_hour & brush_map & selection_day & selection_hour_point)
+    c2 = c2.transform_filter(selection_weather & selection_borough & selection_dayweek & selection_hour & brush_map & selection_day & selection_hour_point)
+    c3 = c3.transform_filter(selection_vehicle & selection_weather & selection_dayweek & selection_hour & brush_map & selection_weather & selection_hour_point)
+    c4 = c4.transform_filter(selection_vehicle & selection_borough & selection_dayweek & selection_hour & selection_day & selection_weather & selection_hour_point)
+    c41 = c41.transform_filter(selection_vehicle & selection_dayweek & selection_hour & selection_day & selection_weather & brush_map & selection_hour_point)
+    c5 = c5.transform_filter(selection_vehicle & selection_borough & selection_dayweek & selection_day & selection_weather & brush_map)
+    c6 = c6.transform_filter(selection_vehicle & selection_borough & selection_hour & selection_day & selection_weather & brush_map & selection_hour_point)
+
+    # Final chart
+
+    return (((((ny_city + c4) & c41) & c6) | ((c1 | c2) & c3 & c5)).configure_title(anchor='middle'))
+
+# ------------------------- Server-side crossfilter -------------------------
+
+# Shared index for the Streamlit app; each session works on its own copy(). It is built
+# over the collisions, not the cube, so that the map brush can filter it (see brush_crossfilter)
+@functools.lru_cache(maxsize=1)
+def default_crossfilter():
+    return Crossfilter(default_collisions(), cube_dims)
+
+@functools.lru_cache(maxsize=1)
+def default_spatial_index():
+    collisions = default_collisions()
+    return GridIndex(collisions['LATITUDE'], collisions['LONGITUDE'])
+
+crossfilter_views = [
+    ('MONTH', 'Month', options_month),
+    ('icon', 'Weather', '-x'),
+    ('VEHICLE_TYPE_CODE1', 'Vehicle type', '-x'),
+    ('BOROUGH', 'Borough', '-x'),
+    ('DAY_WEEK', 'Day of Week', days_week),
+    ('CASUALTIES', 'Casualties', '-x'),
+]
+
+# On the x/y scales of the server-side map, so that its value is the longitude and latitude ranges
+brush_map_server = alt.selection_interval(name='map_brush', encodings=['x', 'y'])
+
+def brush_crossfilter(crossfilter, brush=None, index=None):
+    '''Filter `crossfilter` by a map brush, {'LONGITUDE': [lo, hi], 'LATITUDE': [lo, hi]}
+    (None or {} clears it). The rows under it come from the spatial index, which only reads
+    the grid cells the rectangle touches, instead of a scan of every collision.'''
+    if not brush:
+        return crossfilter.filter_mask('map', None)
+    if index is None:
+        index = default_spatial_index()
+    with stage('brush map'):
+        (lon0, lon1), (lat0, lat1) = brush['LONGITUDE'], brush['LATITUDE']
+        return crossfilter.filter_mask('map', index.mask(index.bbox(lat0, lon0, lat1, lon1)))
+
+def crossfilter_map(collisions, rows):
+    '''Brushable map of the collisions in `rows` (a mask), in grid cells above spatial_bins.POINTS_LIMIT.
+    The scales cover all the collisions, so the map does not move as the other filters change.'''
+    lat, lon = collisions['LATITUDE'].dropna(), collisions['LONGITUDE'].dropna()
+    # equirectangular view: a degree of longitude is cos(latitude) degrees of latitude wide
+    aspect = np.cos(np.radians(lat.mean()))
+    x0, y0, x1, y1 = spatial_bins.fit_bounds((lon.min() * aspect, lat.min(), lon.max() * aspect, lat.max()),
+                                             c4_width, c4_height)
+    points = collisions.loc[rows, ['LATITUDE', 'LONGITUDE', 'BOROUGH']]
+    if len(points) > spatial_bins.POINTS_LIMIT:
+        with stage('transform crossfilter map'):
+            points = spatial_bins.aggregate(points, 'grid', keep=['BOROUGH'], width=c4_width, height=c4_height)
+        chart = alt.Chart(points).mark_square(size=spatial_bins.CELL_PIXELS ** 2)
+    else:
+        chart = alt.Chart(points.assign(count=1)).mark_point(size=3, opacity=0.7, filled=True)
+
+    return chart.encode(
+        x=alt.X('LONGITUDE:Q', title=None, axis=None, scale=alt.Scale(domain=[x0 / aspect, x1 / aspect], nice=False, zero=False)),
+        y=alt.Y('LATITUDE:Q', title=None, axis=None, scale=alt.Scale(domain=[y0, y1], nice=False, zero=False)),
+        color=alt.Color('BOROUGH:N', legend=None, scale=alt.Scale(scheme='dark2')),
+        tooltip=['BOROUGH:N', alt.Tooltip('count:Q', title='Collisions')],
+    ).add_params(
+        brush_map_server
+    ).properties(
+        title='Drag on the map to filter by area',
+        width=c4_width,
+        height=c4_height
+    )
+
+def crossfilter_chart(crossfilter, collisions=None):
+    '''Bar charts of every dimension under all the other active filters, next to the brushable
+    map of `collisions` (the rows of the crossfilter) if given.'''
+    bars = []
+    for dim, title, sort in crossfilter_views:
+        with stage('crossfilter group', dim=dim):
+            group = crossfilter.group(dim).rename_axis(dim).reset_index()
+        bars.append(alt.Chart(group).mark_bar(color='steelblue').encode(
+            x=alt.X('count:Q', title='Number of Collisions'),
+            y=alt.Y(f'{dim}:N', title=title, sort=sort),
+            tooltip=[f'{dim}:N', 'count:Q'],
+        ).properties(width=250, height=150))
+
+    hours = crossfilter.group('HOUR').rename_axis('HOUR').reset_index()
+    line = alt.Chart(hours).mark_line(point=True).encode(
+        x=alt.X('HOUR:O', title='Hour of Day', axis=alt.Axis(labelAngle=0)),
+        y=alt.Y('count:Q', title='Number of Collisions'),
+        tooltip=['HOUR:O', 'count:Q'],
+    ).properties(width=850, height=175)
+
+    views = alt.vconcat(alt.hconcat(*bars[:3]), alt.hconcat(*bars[3:]), line)
+    if collisions is not None:
+        # the map shows the rows of every filter but its own brush
+        views = alt.hconcat(crossfilter_map(collisions, crossfilter.selected('map')), views)
+    return views.properties(
+        title=f'{crossfilter.total()} collisions selected'
+    ).configure_title(anchor='middle')
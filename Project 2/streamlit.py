@@ -1,5 +1,16 @@
+import os
+import sys
 import streamlit as st
-from altair_visualizations import *
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from nyc_collisions.profiling import profiler, stage, streamlit_panel
+from nyc_collisions.warmup import streamlit_warmup
+
+run = profiler.begin_run('project2') # every rerun is timed, see the Diagnostics panel
+
+# pandas, Altair and the data are loaded on a thread pool once per server process: the page is
+# laid out first and the dashboard fills its placeholder when it is ready (see nyc_collisions/warmup.py)
+warmup = streamlit_warmup('altair_visualizations')
 
 st.set_page_config(layout="wide")
 
@@ -23,4 +34,51 @@ with st.sidebar:
         """
     )
 
-st.altair_chart(final_chart)
\ No newline at end of file
+    server_side = st.sidebar.checkbox('Server-side filtering', 
+                                      help='Filter on the server with the bitset crossfilter instead of in the browser.')
+    static = st.sidebar.checkbox('Static image', value=st.query_params.get('static') == '1',
+                                 help='Show the pre-rendered dashboard without interactivity (faster on slow connections).')
+    diagnostics = st.sidebar.checkbox('Diagnostics', value=st.query_params.get('diagnostics') == '1',
+                                      help='Time of every stage of the last rerun.')
+
+slot = st.empty()
+slot.caption('⏳ Loading dashboard...')
+
+if server_side:
+    if 'crossfilter' not in st.session_state:
+        st.session_state['crossfilter'] = warmup.data('default_crossfilter').result().copy()
+    session_crossfilter = st.session_state['crossfilter']
+    av = warmup.module()
+
+    with st.sidebar:
+        st.sidebar.title("🔎 Filters")
+        for dim, title, _ in av.crossfilter_views:
+            values = st.sidebar.multiselect(title, list(session_crossfilter.levels(dim)))
+            session_crossfilter.filter(dim, values or None)
+
+        hours = st.sidebar.slider('Hour of Day', 0, 23, (0, 23))
+        if hours == (0, 23):
+            session_crossfilter.filter('HOUR', None)
+        else:
+            session_crossfilter.filter_range('HOUR', *hours)
+
+    # the brush drawn on the map on the previous run, answered from the spatial index
+    brush = st.session_state.get('crossfilter_chart', {}).get('selection', {}).get('map_brush')
+    av.brush_crossfilter(session_crossfilter, brush)
+
+    chart = av.crossfilter_chart(session_crossfilter, av.default_collisions())
+    with stage('deliver crossfilter'):
+        slot.altair_chart(chart, on_select='rerun', key='crossfilter_chart')
+else:
+    # static images are pre-rendered by python -m nyc_collisions.export
+    future = warmup.image('final_chart') if static else warmup.spec('final_chart')
+    chart = future.result()
+    with stage('deliver final_chart'):
+        if static:
+            slot.markdown(chart, unsafe_allow_html=True)
+        else:
+            slot.vega_lite_chart(chart)
+
+run = profiler.end_run()
+if diagnostics:
+    streamlit_panel(run)
@@ -0,0 +1,189 @@
+"""Benchmark of every chart of both projects on scaled synthetic data.
+
+For each scale factor the datasets are generated with :mod:`synthetic` (once,
+under ``benchmarks/data/<factor>x``) and, for Project 1 charts c1-c6 and the
+Project 2 ``final_chart``, the harness times
+
+* ``load``: parsing the CSVs (cold, the ingest cache is cleared first),
+* ``transform``: the data preparation shared by the charts of the project,
+* ``build``: the chart factory (with an empty chart registry),
+* ``to_dict`` and ``json``: Vega-Lite spec generation and serialization,
+* ``compile``: :func:`nyc_collisions.spec.compile_spec`,
+
+and records the spec size before and after compilation.  Every stage keeps
+its best time over ``--repeat`` runs.  Results are written as JSON, tagged
+with the git commit, so two runs can be compared with ``--compare``::
+
+    python benchmarks/run.py --scales 1 10 100
+    python benchmarks/run.py --compare before.json after.json
+"""
+
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, '..')
+sys.path.append(ROOT)
+sys.path.append(HERE)
+
+import synthetic
+from nyc_collisions.aggregates import aggregate_years
+from nyc_collisions.loader import CACHE_DIR_NAME, load_collisions, load_weather
+from nyc_collisions.projects import PROJECTS, import_charts, working_directory
+from nyc_collisions.spec import _dumps, chart_to_dict, compile_spec
+from nyc_collisions.weather import WeatherStore
+
+STAGES = ['load', 'transform', 'build', 'to_dict', 'json', 'compile']
+DATA_DIR = os.path.join(HERE, 'data')
+RESULTS_DIR = os.path.join(HERE, 'results')
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def dataset(factor, seed=0):
+    '''Directory of the synthetic data of a scale factor, generated on first use.'''
+    out_dir = os.path.join(DATA_DIR, f'{factor:g}x')
+    if not os.path.exists(os.path.join(out_dir, synthetic.PROJECT2_COLLISIONS)):
+        synthetic.generate(out_dir, factor, seed)
+    return out_dir
+
+
+def load(project, data_dir):
+    '''Cold load (ingest cache removed) of the inputs of a project.'''
+    for sub in ('project1', 'project2'):
+        shutil.rmtree(os.path.join(data_dir, sub, CACHE_DIR_NAME), ignore_errors=True)
+    if project == 'project1':
+        return (load_collisions(os.path.join(data_dir, synthetic.PROJECT1_COLLISIONS)),
+                load_weather(os.path.join(data_dir, synthetic.PROJECT1_WEATHER)))
+    return (load_collisions(os.path.join(data_dir, synthetic.PROJECT2_COLLISIONS)),)
+
+
+def transform(module, project, loaded):
+    '''The data preparation of the project: inputs of every chart by name.'''
+    if project == 'project1':
+        collisions, weather = loaded
+        collisions = module.prepare_collisions(collisions)
+        weather = WeatherStore(weather, columns=['temp', 'precip', 'windspeed', 'humidity', 'cloudcover', 'conditions', 'visibility'])
+        daily = module.prepare_daily(aggregate_years(collisions))
+        return lambda name: module.chart_inputs(name, collisions, weather, daily)
+    collisions = loaded[0].drop(columns=['YEAR'])
+    counts = module.build_counts(collisions)
+    return lambda name: (collisions, counts)
+
+
+def run_chart(module, name, inputs):
+    module.charts.clear()
+    chart, build = timed(module.charts.factories[name], *inputs)
+    spec, to_dict = timed(chart_to_dict, chart)
+    text, serialize = timed(_dumps, spec)
+    (_, report), compile_time = timed(compile_spec, spec)
+    return {
+        'build': build, 'to_dict': to_dict, 'json': serialize, 'compile': compile_time,
+        'spec_bytes': len(text.encode()), 'compiled_bytes': report['bytes_after'],
+    }
+
+
+def benchmark(scales, repeat=1, projects=None, charts=None, seed=0, verbose=True):
+    records = []
+    for factor in scales:
+        data_dir = dataset(factor, seed)
+        for project in projects or PROJECTS:
+            directory, names = PROJECTS[project]
+            module = import_charts(project)
+            best = {}
+            with working_directory(directory):
+                for _ in range(repeat):
+                    loaded, load_time = timed(load, project, data_dir)
+                    inputs, transform_time = timed(transform, module, project, loaded)
+                    for name in names:
+                        if charts and name not in charts:
+                            continue
+                        result = dict(run_chart(module, name, inputs(name)), load=load_time, transform=transform_time)
+                        previous = best.setdefault(name, result)
+                        for stage in STAGES:
+                            previous[stage] = min(previous[stage], result[stage])
+
+            for name, result in best.items():
+                record = {'project': project, 'chart': name, 'scale': factor, 'rows': len(loaded[0]), **result}
+                records.append(record)
+                if verbose:
+                    stages = ' '.join(f'{stage}={record[stage]:.3f}s' for stage in STAGES)
+                    print(f"{project} {name:>11} {factor:>6g}x {record['rows']:>9} rows  {stages}  "
+                          f"spec={record['spec_bytes'] / 1024:.0f} KB -> {record['compiled_bytes'] / 1024:.0f} KB")
+    return records
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(records, path=None):
+    commit = git_commit()
+    now = datetime.datetime.now()
+    path = path or os.path.join(RESULTS_DIR, f"{now:%Y%m%d-%H%M%S}-{commit or 'nogit'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({
+            'commit': commit,
+            'timestamp': now.isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'results': records,
+        }, f, indent=2)
+    return path
+
+
+def compare(base_path, new_path, threshold=1.2):
+    '''Print the ratio new/base of every stage; ratios above ``threshold`` are flagged.'''
+    with open(base_path) as f:
+        base = {(r['project'], r['chart'], r['scale']): r for r in json.load(f)['results']}
+    with open(new_path) as f:
+        new = json.load(f)['results']
+
+    regressions = 0
+    for record in new:
+        key = (record['project'], record['chart'], record['scale'])
+        if key not in base:
+            continue
+        cells = []
+        for stage in STAGES + ['spec_bytes']:
+            ratio = record[stage] / base[key][stage] if base[key][stage] else float('inf')
+            flag = '!' if ratio > threshold else ' '
+            regressions += ratio > threshold
+            cells.append(f'{stage}={ratio:.2f}{flag}')
+        print(f'{key[0]} {key[1]:>11} {key[2]:>6g}x  ' + ' '.join(cells))
+    return regressions
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmark the charts on scaled synthetic data.')
+    parser.add_argument('--scales', type=float, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--projects', nargs='+', choices=list(PROJECTS))
+    parser.add_argument('--charts', nargs='+')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='results file (default: benchmarks/results/<date>-<commit>.json)')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'))
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(*args.compare) else 0)
+
+    records = benchmark(args.scales, args.repeat, args.projects, args.charts, args.seed)
+    print(f'results written to {write_results(records, args.output)}')
@@ -0,0 +1,97 @@
+"""Synthetic, scaled copies of the project datasets.
+
+The collisions of both projects are bootstrapped from the real files: rows
+are drawn with replacement, the coordinates are jittered by a few hundred
+metres and the crash minute is redrawn (the hour is kept, so every derived
+column stays consistent).  The schemas, the categories and their joint
+distributions are therefore those of the real data, ``factor`` times larger.
+Weather is per day, so it is copied unchanged.
+
+    python benchmarks/synthetic.py 100 benchmarks/data/100x
+"""
+
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+PROJECT1_DATA = os.path.join(ROOT, 'Project 1', 'data')
+PROJECT2_DATA = os.path.join(ROOT, 'Project 2', 'data')
+
+# files written by generate(), relative to its output directory
+PROJECT1_COLLISIONS = os.path.join('project1', 'preprocessed-collisions.csv')
+PROJECT1_WEATHER = os.path.join('project1', 'weather.csv')
+PROJECT2_COLLISIONS = os.path.join('project2', 'preprocessed-collisions-final.csv')
+
+JITTER_DEGREES = 0.002
+
+
+def _jitter(frame, rng):
+    for column in ('LATITUDE', 'LONGITUDE'):
+        frame[column] = (pd.to_numeric(frame[column], errors='coerce') + rng.normal(0, JITTER_DEGREES, len(frame))).round(5)
+
+
+def _minutes(rng, n):
+    return pd.Series(rng.integers(0, 60, n)).map('{:02d}'.format).to_numpy()
+
+
+def sample_project1(base, n, rng):
+    """``n`` bootstrapped rows of ``preprocessed-collisions.csv``."""
+    frame = base.iloc[rng.integers(0, len(base), n)].reset_index(drop=True)
+    _jitter(frame, rng)
+    hours = frame['CRASH_TIME'].str.split(':').str[0]
+    frame['CRASH_TIME'] = hours + ':' + _minutes(rng, n)
+    return frame
+
+
+def sample_project2(base, n, rng):
+    """``n`` bootstrapped rows of ``preprocessed-collisions-final.csv``."""
+    frame = base.iloc[rng.integers(0, len(base), n)].reset_index(drop=True)
+    _jitter(frame, rng)
+    # 'YYYY-MM-DD HH:MM:SS': keep the hour, redraw the minute
+    datetimes = frame['CRASH_DATETIME']
+    frame['CRASH_DATETIME'] = datetimes.str[:14] + _minutes(rng, n) + datetimes.str[16:]
+    return frame
+
+
+def _write_scaled(source, target, sample, factor, rng):
+    """Write ``factor`` times the rows of ``source`` to ``target``, one base-sized block at a time."""
+    base = pd.read_csv(source, dtype=str, keep_default_na=False)
+    total = int(round(len(base) * factor))
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    written = 0
+    while written < total:
+        block = sample(base, min(len(base), total - written), rng)
+        block.to_csv(target, mode='w' if written == 0 else 'a', header=written == 0, index=False)
+        written += len(block)
+    return total
+
+
+def generate(out_dir, factor, seed=0):
+    """Write the scaled datasets of both projects under ``out_dir``.
+
+    Returns the number of collision rows written per project.
+    """
+    rng = np.random.default_rng(seed)
+    rows = {
+        'project1': _write_scaled(os.path.join(PROJECT1_DATA, 'preprocessed-collisions.csv'),
+                                  os.path.join(out_dir, PROJECT1_COLLISIONS), sample_project1, factor, rng),
+        'project2': _write_scaled(os.path.join(PROJECT2_DATA, 'preprocessed-collisions-final.csv'),
+                                  os.path.join(out_dir, PROJECT2_COLLISIONS), sample_project2, factor, rng),
+    }
+    shutil.copyfile(os.path.join(PROJECT1_DATA, 'weather.csv'), os.path.join(out_dir, PROJECT1_WEATHER))
+    return rows
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Generate scaled synthetic collision datasets.')
+    parser.add_argument('factor', type=float, help='scale factor, 1 to 1000')
+    parser.add_argument('out_dir')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print(generate(args.out_dir, args.factor, args.seed))
@@ -0,0 +1,5 @@
+"""Shared data layer for the New York collisions visualizations.
+
+Both projects add the repository root to ``sys.path`` and import the modules
+of this package directly (e.g. ``from nyc_collisions.loader import load_collisions``).
+"""
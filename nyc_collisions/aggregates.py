@@ -0,0 +1,254 @@
+"""Materialized per-day, per-hour collision aggregates, updated incrementally.
+
+Every time series of Project 1 (counts per weekday and year, per hour and day,
+per day for the weather join) can be rolled up from one table: the number of
+collisions and the sum of a few measures per ``(date, HOUR)``.  This module
+keeps that table on disk partitioned by month (``month=YYYY-MM``), so that a
+new day of the feed or a correction to a past day only rewrites the month it
+falls in.
+
+A manifest stores, per day, the number of rows and an order-independent hash
+of them (the wrapping sum of the row hashes).  Hashes are additive, so
+:meth:`DailyAggregates.append` can keep them up to date without the rest of
+the day, and :meth:`DailyAggregates.refresh` detects the days of a full frame
+that changed.  :meth:`DailyAggregates.verify` compares the store with a full
+rebuild.
+
+Days never straddle years, so the aggregates and hashes of a frame are
+computed year by year and concatenated (:func:`map_years`); for large frames
+the years run in a process pool, one year per task.
+"""
+
+import glob
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from nyc_collisions.loader import pq
+
+MANIFEST_FILE = '_manifest.json'
+KEYS = ['date', 'HOUR']
+# below this many rows starting the worker processes (~0.7 s) and sending them the
+# rows (~0.2 s per million) costs more than hashing and aggregating them (~0.5 s per million)
+PARALLEL_MIN_ROWS = 3_000_000
+
+
+def aggregate_days(frame, datetime='CRASH_DATETIME', sums=('TOTAL_KILLED',)):
+    """``date, HOUR, collisions`` and the sum of every ``sums`` column per day and hour."""
+    crash = frame[datetime]
+    keyed = pd.DataFrame({'date': crash.dt.normalize(), 'HOUR': crash.dt.hour.astype('int8'),
+                          'collisions': np.ones(len(frame), dtype=np.int64)}, index=frame.index)
+    for column in sums:
+        keyed[column] = frame[column]
+    table = keyed.groupby(KEYS, as_index=False, sort=True).sum()
+    return table
+
+
+def day_hashes(frame, datetime='CRASH_DATETIME'):
+    """``{day: (rows, hash)}`` of a frame of collisions."""
+    rows = pd.util.hash_pandas_object(frame, index=False).to_numpy()
+    days, codes = np.unique(frame[datetime].dt.normalize().to_numpy(), return_inverse=True)
+    hashes = np.zeros(len(days), dtype=np.uint64)
+    np.add.at(hashes, codes, rows)  # uint64 addition wraps, which keeps it order independent
+    counts = np.bincount(codes, minlength=len(days))
+    return {_day(day): (int(count), int(value)) for day, count, value in zip(days, counts, hashes)}
+
+
+def _day(value):
+    return pd.Timestamp(value).strftime('%Y-%m-%d')
+
+
+def year_partitions(frame, datetime='CRASH_DATETIME', years=None):
+    """``{year: rows}`` of ``frame``, in year order; only ``years`` if given."""
+    year = frame[datetime].dt.year
+    if years is not None:
+        keep = year.isin(list(years)).to_numpy()
+        frame, year = frame[keep], year[keep]
+    return {int(y): rows for y, rows in frame.groupby(year, sort=True)}
+
+
+def map_years(function, frame, args=(), datetime='CRASH_DATETIME', years=None, workers=None):
+    """``{year: function(rows, *args)}`` for the rows of every year of ``frame``.
+
+    Frames of at least :data:`PARALLEL_MIN_ROWS` rows are split over a pool of
+    ``workers`` processes (by default one per core), one year per task.
+    """
+    parts = year_partitions(frame, datetime, years)
+    workers = min(workers or os.cpu_count() or 1, len(parts))
+    if workers <= 1 or sum(map(len, parts.values())) < PARALLEL_MIN_ROWS:
+        return {year: function(rows, *args) for year, rows in parts.items()}
+    # spawn: the caller may be a thread of the Streamlit server
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = {year: pool.submit(function, rows, *args) for year, rows in parts.items()}
+        return {year: future.result() for year, future in futures.items()}
+
+
+def aggregate_years(frame, datetime='CRASH_DATETIME', sums=('TOTAL_KILLED',), years=None, workers=None):
+    """:func:`aggregate_days` of ``frame`` (only ``years`` if given), computed year by year."""
+    tables = map_years(aggregate_days, frame, (datetime, sums), datetime, years, workers)
+    if not tables:
+        return aggregate_days(frame.iloc[:0], datetime, sums)
+    return pd.concat(tables.values(), ignore_index=True)
+
+
+class DailyAggregates:
+    """Month-partitioned store of :func:`aggregate_days` with incremental updates."""
+
+    def __init__(self, directory, datetime='CRASH_DATETIME', sums=('TOTAL_KILLED',), workers=None):
+        self.directory = directory
+        self.datetime = datetime
+        self.sums = list(sums)
+        self.workers = workers  # processes of map_years
+        self.manifest = self._read_manifest()
+
+    # ---------------------------- storage ---------------------------- #
+
+    def _read_manifest(self):
+        path = os.path.join(self.directory, MANIFEST_FILE)
+        if os.path.exists(path):
+            with open(path) as f:
+                manifest = json.load(f)
+            if manifest.get('datetime') == self.datetime and manifest.get('sums') == self.sums:
+                return manifest
+        return {'datetime': self.datetime, 'sums': self.sums, 'days': {}}
+
+    def _write_manifest(self):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, MANIFEST_FILE)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.manifest, f, indent=1, sort_keys=True)
+        os.replace(path + '.tmp', path)
+
+    def _partition_path(self, month):
+        return os.path.join(self.directory, f"month={month}.{'parquet' if pq is not None else 'csv'}")
+
+    def _read_partition(self, month):
+        path = self._partition_path(month)
+        if not os.path.exists(path):
+            return None
+        if pq is not None:
+            return pd.read_parquet(path)
+        return pd.read_csv(path, parse_dates=['date'], dtype={'HOUR': 'int8'})
+
+    def _write_partition(self, month, table):
+        path = self._partition_path(month)
+        if table is None or table.empty:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = path + '.tmp'
+        if pq is not None:
+            table.to_parquet(tmp, index=False)
+        else:
+            table.to_csv(tmp, index=False)
+        os.replace(tmp, path)
+
+    def months(self, years=None):
+        paths = glob.glob(os.path.join(self.directory, 'month=*'))
+        months = sorted(os.path.basename(p).split('=')[1].split('.')[0] for p in paths if not p.endswith('.tmp'))
+        if years is not None:
+            years = {int(year) for year in years}
+            months = [month for month in months if int(month[:4]) in years]
+        return months
+
+    def _day_hashes(self, frame):
+        hashes = {}
+        for year_hashes in map_years(day_hashes, frame, (self.datetime,), self.datetime, workers=self.workers).values():
+            hashes.update(year_hashes)
+        return hashes
+
+    # ---------------------------- updates ---------------------------- #
+
+    def _update(self, rows, replace_days=()):
+        """Merge the aggregates of ``rows`` into the store.
+
+        The days in ``replace_days`` are dropped first; the other days of
+        ``rows`` are added to what is stored.  Only the months touched are
+        rewritten.
+        """
+        replace_days = set(replace_days)
+        new = aggregate_years(rows, self.datetime, self.sums, workers=self.workers)
+        touched = set(new['date'].dt.strftime('%Y-%m')) | {day[:7] for day in replace_days}
+
+        for month in sorted(touched):
+            table = self._read_partition(month)
+            if table is not None and replace_days:
+                table = table[~table['date'].dt.strftime('%Y-%m-%d').isin(replace_days)]
+            month_rows = new[new['date'].dt.strftime('%Y-%m') == month]
+            parts = [t for t in (table, month_rows) if t is not None and not t.empty]
+            merged = pd.concat(parts).groupby(KEYS, as_index=False, sort=True).sum() if parts else None
+            if merged is not None:
+                merged['HOUR'] = merged['HOUR'].astype('int8')
+            self._write_partition(month, merged)
+
+        days = self.manifest['days']
+        for day in replace_days:
+            days.pop(day, None)
+        for day, (count, value) in self._day_hashes(rows).items():
+            old_count, old_value = days.get(day, (0, 0))
+            days[day] = [old_count + count, (old_value + value) % (1 << 64)]
+        self._write_manifest()
+        return sorted(touched)
+
+    def append(self, rows):
+        """Add new collision rows (a new day, or late rows of known days)."""
+        return self._update(rows)
+
+    def replace(self, rows, days=None):
+        """Replace ``days`` (by default the days of ``rows``) with the aggregates of ``rows``.
+
+        A correction passes every row of the corrected days; days listed in
+        ``days`` without rows are removed.
+        """
+        days = {_day(d) for d in days} if days is not None else set(self._day_hashes(rows))
+        return self._update(rows, replace_days=days)
+
+    def changed_days(self, frame):
+        """Days whose rows in ``frame`` differ from the store, and days no longer in ``frame``."""
+        current = self._day_hashes(frame)
+        stored = self.manifest['days']
+        changed = {day for day, value in current.items() if list(value) != list(stored.get(day, ()))}
+        return changed | (set(stored) - set(current))
+
+    def refresh(self, frame):
+        """Bring the store in line with the full ``frame``, updating only the changed days."""
+        changed = self.changed_days(frame)
+        if not changed:
+            return []
+        days = frame[self.datetime].dt.normalize()
+        return self.replace(frame[days.isin(pd.to_datetime(sorted(changed))).to_numpy()], days=changed)
+
+    def rebuild(self, frame):
+        """Drop the store and materialize ``frame`` from scratch."""
+        for month in self.months():
+            self._write_partition(month, None)
+        self.manifest['days'] = {}
+        return self._update(frame)
+
+    # ---------------------------- reading ---------------------------- #
+
+    def table(self, years=None):
+        """The aggregate table (only the months of ``years`` if given), sorted by date and hour."""
+        parts = [self._read_partition(month) for month in self.months(years)]
+        if not parts:
+            return pd.DataFrame({'date': pd.Series(dtype='datetime64[ns]'), 'HOUR': pd.Series(dtype='int8'),
+                                 'collisions': pd.Series(dtype='int64'),
+                                 **{c: pd.Series(dtype='float64') for c in self.sums}})
+        return pd.concat(parts, ignore_index=True)
+
+    def verify(self, frame):
+        """Days where the store differs from a full rebuild from ``frame`` (empty when consistent)."""
+        expected = aggregate_years(frame, self.datetime, self.sums, workers=self.workers)
+        stored = self.table()
+        merged = expected.merge(stored, on=KEYS, how='outer', suffixes=('', '_stored'), indicator=True)
+        columns = ['collisions'] + self.sums
+        differs = merged['_merge'] != 'both'
+        for column in columns:
+            differs |= ~np.isclose(merged[column].astype(float), merged[column + '_stored'].astype(float),
+                                   equal_nan=True)
+        return sorted(set(merged.loc[differs, 'date'].dt.strftime('%Y-%m-%d')))
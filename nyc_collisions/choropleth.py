@@ -0,0 +1,91 @@
+"""Collisions per km² by ZIP code and borough.
+
+Collision points are joined to the ZIP polygons of ``ny_city_map.geojson``
+with the grid index of :class:`nyc_collisions.geocoder.ZipGeocoder`, and the
+counts are divided by the polygon areas.  Areas are computed on the sphere
+with a cylindrical equal-area projection and cached in ``.cache/`` next to the
+GeoJSON, like the TopoJSON basemaps of :mod:`nyc_collisions.geometry`.
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from nyc_collisions.geocoder import ZipGeocoder, read_polygons
+from nyc_collisions.loader import CACHE_DIR_NAME, is_fresh, write_manifest
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def ring_area_km2(ring):
+    """Area of a lon/lat ring in km² (shoelace in the Lambert cylindrical equal-area plane)."""
+    x = np.radians(ring[:, 0]) * EARTH_RADIUS_KM
+    y = np.sin(np.radians(ring[:, 1])) * EARTH_RADIUS_KM
+    return abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1))) / 2
+
+
+def polygon_area_km2(parts):
+    """Area of a feature given as ``[outer, *holes]`` parts (see :func:`read_polygons`): the
+    outer rings minus their holes, summed over the parts of a MultiPolygon."""
+    return sum(ring_area_km2(part[0]) - sum(ring_area_km2(ring) for ring in part[1:]) for part in parts)
+
+
+def polygon_areas(path, cache_dir=None):
+    """Area in km² of every feature of ``path``, cached until the file changes."""
+    source = os.path.abspath(path)
+    cache_dir = cache_dir or os.path.join(os.path.dirname(source), CACHE_DIR_NAME)
+    stem = os.path.splitext(os.path.basename(source))[0]
+    data_path = os.path.join(cache_dir, f'{stem}.areas.json')
+    manifest_path = os.path.join(cache_dir, f'{stem}.areas.manifest.json')
+
+    if is_fresh(source, data_path, manifest_path, 'areas-km2-parts'):
+        with open(data_path) as f:
+            return np.array(json.load(f))
+
+    areas = np.array([polygon_area_km2(parts) for _, parts in read_polygons(source)])
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(data_path + '.tmp', 'w') as f:
+        json.dump(areas.tolist(), f)
+    os.replace(data_path + '.tmp', data_path)
+    write_manifest(manifest_path, source, 'areas-km2-parts')
+    return areas
+
+
+class ZipDensity:
+    """Spatial join of collisions to ZIP polygons and their density tables."""
+
+    def __init__(self, path, cache_dir=None):
+        self.geocoder = ZipGeocoder(path)
+        self.areas = polygon_areas(path, cache_dir)
+        self.polygons = pd.DataFrame({
+            'postalCode': self.geocoder.zip_codes,
+            'BOROUGH': self.geocoder.boroughs,
+            'area_km2': self.areas,
+        })
+
+    def join(self, latitude, longitude):
+        """Index of the polygon of every point, ``-1`` outside all of them."""
+        return self.geocoder.locate(latitude, longitude)
+
+    def _counts(self, polygons, weights=None):
+        found = polygons >= 0
+        return np.bincount(polygons[found], weights=None if weights is None else np.asarray(weights)[found],
+                           minlength=len(self.areas))
+
+    def zip_table(self, polygons, weights=None):
+        """``postalCode, BOROUGH, collisions, area_km2, density`` for every ZIP code.
+
+        ZIP codes split into several polygons are summed; ZIP codes without
+        collisions are kept with a density of 0.
+        """
+        table = self.polygons.assign(collisions=self._counts(polygons, weights))
+        table = table.groupby(['postalCode', 'BOROUGH'], as_index=False)[['collisions', 'area_km2']].sum()
+        return table.assign(density=table['collisions'] / table['area_km2'])
+
+    def borough_table(self, polygons, weights=None):
+        """``BOROUGH, collisions, area_km2, density`` over the whole area of each borough."""
+        table = self.polygons.assign(collisions=self._counts(polygons, weights))
+        table = table.groupby('BOROUGH', as_index=False)[['collisions', 'area_km2']].sum()
+        return table.assign(density=table['collisions'] / table['area_km2'])
@@ -0,0 +1,213 @@
+"""Server-side crossfilter over a collisions (or cube) frame.
+
+Every dimension is dictionary-encoded once and gets one packed bitmap per
+value.  Each row also carries a ``uint32`` word with one bit per dimension
+that currently filters it out.  Changing a single filter
+
+1. ORs the bitmaps of the selected values into the new pass set,
+2. XORs it with the previous one to find the rows whose bit flips, and
+3. updates the per-value totals of every *other* dimension only for those rows.
+
+So the cost of an interaction is proportional to the rows that enter or leave
+the selection, not to the size of the table, and :meth:`Crossfilter.group`
+(the aggregate of a dimension under all the *other* active filters, which is
+what a linked view shows) is a plain read.
+
+Filters computed elsewhere, e.g. the rows under a map brush found with
+:class:`nyc_collisions.spatial_index.GridIndex`, come in as row masks with
+:meth:`Crossfilter.filter_mask` and take a bit of their own.
+"""
+
+import numpy as np
+import pandas as pd
+
+MAX_DIMENSIONS = 32
+
+
+class _Index:
+    """Immutable part of a crossfilter, shared between copies."""
+
+    def __init__(self, frame, dims, weight):
+        if len(dims) > MAX_DIMENSIONS:
+            raise ValueError(f'A crossfilter supports at most {MAX_DIMENSIONS} dimensions')
+
+        self.n = len(frame)
+        self.dims = list(dims)
+        self.weights = frame[weight].to_numpy() if weight is not None else np.ones(self.n, dtype=np.int64)
+        self.codes, self.levels, self.bitmaps = {}, {}, {}
+        for dim in self.dims:
+            codes, uniques = pd.factorize(frame[dim], sort=True, use_na_sentinel=False)
+            self.codes[dim] = codes.astype(np.min_scalar_type(max(len(uniques) - 1, 0)))
+            self.levels[dim] = pd.Index(uniques, name=dim)
+            self.bitmaps[dim] = np.stack([np.packbits(codes == i) for i in range(len(uniques))])
+
+
+class Crossfilter:
+    """Incremental multi-dimensional filter with per-dimension group totals.
+
+    ``frame`` can hold raw rows or pre-aggregated cells; in the latter case
+    pass the count column as ``weight``.
+    """
+
+    def __init__(self, frame, dims, weight=None):
+        self._index = _Index(frame, dims, weight)
+        self._reset()
+
+    def _reset(self):
+        index = self._index
+        self._excluded = np.zeros(index.n, dtype=np.uint32)
+        self._passing = {dim: np.packbits(np.ones(index.n, dtype=bool)) for dim in index.dims}
+        self._filters = {}
+        self._masks = {}
+        self._groups = {dim: np.bincount(index.codes[dim], weights=index.weights,
+                                         minlength=len(index.levels[dim]))
+                        for dim in index.dims}
+
+    def copy(self):
+        """A crossfilter with the same index and filters but independent state."""
+        other = Crossfilter.__new__(Crossfilter)
+        other._index = self._index
+        other._excluded = self._excluded.copy()
+        other._passing = dict(self._passing)
+        other._filters = dict(self._filters)
+        other._masks = dict(self._masks)
+        other._groups = {dim: counts.copy() for dim, counts in self._groups.items()}
+        return other
+
+    @property
+    def dims(self):
+        return list(self._index.dims)
+
+    @property
+    def filters(self):
+        """Active filters as ``{dim: [allowed values]}``."""
+        return {dim: list(self._index.levels[dim].take(codes)) for dim, codes in self._filters.items()}
+
+    def levels(self, dim):
+        return self._index.levels[dim]
+
+    # ---------------------------- filtering ---------------------------- #
+
+    def filter(self, dim, values=None):
+        """Keep only the rows whose ``dim`` is in ``values`` (``None`` clears it).
+
+        A ``None`` among the values selects the missing ones, like ``NaN``.
+        """
+        index = self._index
+        if values is None:
+            return self._apply(dim, None)
+        if np.ndim(values) == 0:
+            values = [values]
+        codes = index.levels[dim].get_indexer([np.nan if value is None else value for value in values])
+        return self._apply(dim, np.unique(codes[codes >= 0]))
+
+    def filter_range(self, dim, lo=None, hi=None):
+        """Keep the rows with ``lo <= dim <= hi`` (either bound may be ``None``)."""
+        levels = self._index.levels[dim]
+        keep = np.ones(len(levels), dtype=bool)
+        if lo is not None:
+            keep &= np.asarray(levels >= lo)
+        if hi is not None:
+            keep &= np.asarray(levels <= hi)
+        return self._apply(dim, np.flatnonzero(keep))
+
+    def filter_mask(self, name, mask=None):
+        """Keep only the rows where ``mask`` is true, as the filter ``name`` (``None`` clears it).
+
+        ``name`` is not a dimension: it has no group, but it filters the
+        groups of every dimension.
+        """
+        index = self._index
+        if name in index.dims:
+            raise ValueError(f'{name!r} is a dimension, filter it with filter()')
+        if mask is not None and np.shape(mask) != (index.n,):
+            raise ValueError(f'The mask of {name!r} must have one value per row ({index.n})')
+        if name not in self._masks:
+            if mask is None:
+                return self
+            bit = len(index.dims) + len(self._masks)
+            if bit >= MAX_DIMENSIONS:
+                raise ValueError(f'A crossfilter supports at most {MAX_DIMENSIONS} dimensions and masks')
+            self._masks[name] = bit
+            self._passing[name] = np.packbits(np.ones(index.n, dtype=bool))
+        keep = np.ones(index.n, dtype=bool) if mask is None else np.asarray(mask, dtype=bool)
+        self._set_passing(name, np.packbits(keep))
+        return self
+
+    def clear(self, dim=None):
+        """Clear the filter on ``dim`` (or mask), or every filter."""
+        if dim in self._masks:
+            return self.filter_mask(dim, None)
+        if dim is not None:
+            return self._apply(dim, None)
+        self._reset()
+        return self
+
+    def _apply(self, dim, codes):
+        index = self._index
+        old = self._filters.get(dim)
+        if (old is None and codes is None) or (old is not None and codes is not None and np.array_equal(old, codes)):
+            return self
+
+        if codes is None:
+            passing = np.packbits(np.ones(index.n, dtype=bool))
+            self._filters.pop(dim, None)
+        else:
+            passing = np.bitwise_or.reduce(index.bitmaps[dim][codes], axis=0) if len(codes) else \
+                np.zeros_like(self._passing[dim])
+            self._filters[dim] = codes
+        self._set_passing(dim, passing)
+        return self
+
+    def _set_passing(self, dim, passing):
+        changed = np.flatnonzero(np.unpackbits(self._passing[dim] ^ passing, count=self._index.n))
+        self._passing[dim] = passing
+        if len(changed):
+            self._update(dim, changed)
+
+    def _bit(self, dim):
+        return self._masks[dim] if dim in self._masks else self._index.dims.index(dim)
+
+    def _update(self, dim, rows):
+        index = self._index
+        bit = np.uint32(1 << self._bit(dim))
+        before = self._excluded[rows]
+        after = before ^ bit
+        self._excluded[rows] = after
+
+        weights = index.weights[rows]
+        for other in index.dims:
+            if other == dim:
+                continue
+            # a row counts for `other` when no dimension except `other` excludes it
+            mask = ~np.uint32(1 << index.dims.index(other))
+            was_in = (before & mask) == 0
+            is_in = (after & mask) == 0
+            n_levels = len(index.levels[other])
+            codes = index.codes[other][rows]
+            self._groups[other] = self._groups[other] \
+                + np.bincount(codes[is_in & ~was_in], weights=weights[is_in & ~was_in], minlength=n_levels) \
+                - np.bincount(codes[was_in & ~is_in], weights=weights[was_in & ~is_in], minlength=n_levels)
+
+    # ---------------------------- queries ---------------------------- #
+
+    def group(self, dim):
+        """Weighted totals per value of ``dim`` under all the *other* filters."""
+        counts = self._groups[dim]
+        if np.issubdtype(self._index.weights.dtype, np.integer):
+            counts = np.rint(counts).astype(np.int64)
+        return pd.Series(counts, index=self._index.levels[dim], name='count')
+
+    def groups(self):
+        return {dim: self.group(dim) for dim in self._index.dims}
+
+    def selected(self, dim=None):
+        """Boolean mask of the rows passing every active filter, but the one of ``dim`` if given
+        (the rows a view of ``dim`` shows).  A mask that was never set filters nothing."""
+        if dim is None or (dim not in self._masks and dim not in self._index.dims):
+            return self._excluded == 0
+        return (self._excluded & ~np.uint32(1 << self._bit(dim))) == 0
+
+    def total(self):
+        """Weighted total of the rows passing every active filter."""
+        return self._index.weights[self.selected()].sum()
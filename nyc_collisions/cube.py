@@ -0,0 +1,120 @@
+"""Pre-aggregated count cube for the cross-filter dashboard.
+
+The cube stores one row per *occupied* cell of the group-by over ``dims``:
+a small-int code array per dimension plus a count (or weight) array.  It is
+built with a single vectorized pass (factorize, ravel the codes into one flat
+key, ``np.unique``) and can then be rolled up to fewer dimensions or sliced
+to a subset of values without going back to the raw rows.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def _code_dtype(n_levels):
+    return np.min_scalar_type(max(n_levels - 1, 0))
+
+
+def _group(codes, shape, weights=None):
+    """Group the rows given by ``codes`` (one array per dim) into occupied cells."""
+    if np.prod(shape, dtype=float) >= 2 ** 63:
+        raise ValueError('Cube is too large to index with a flat int64 key')
+
+    flat = np.ravel_multi_index([c.astype(np.int64) for c in codes], shape)
+    keys, inverse = np.unique(flat, return_inverse=True)
+    if weights is None:
+        counts = np.bincount(inverse.ravel(), minlength=len(keys))
+    else:
+        counts = np.bincount(inverse.ravel(), weights=weights, minlength=len(keys))
+
+    cell_codes = np.unravel_index(keys, shape)
+    cell_codes = [c.astype(_code_dtype(n)) for c, n in zip(cell_codes, shape)]
+    return cell_codes, counts
+
+
+class Cube:
+    """Sparse, array-backed group-by counts over a fixed set of dimensions."""
+
+    def __init__(self, dims, levels, codes, counts):
+        self.dims = list(dims)
+        self.levels = dict(levels)
+        self.codes = dict(zip(self.dims, codes)) if not isinstance(codes, dict) else dict(codes)
+        self.counts = np.asarray(counts)
+
+    @classmethod
+    def from_frame(cls, frame, dims, weight=None):
+        """Build the cube of ``frame`` grouped by ``dims``.
+
+        Each row counts as one unless ``weight`` names a column to sum instead.
+        Missing values form their own level, as in a Vega-Lite ``groupby``.
+        """
+        levels, codes = {}, []
+        for dim in dims:
+            dim_codes, uniques = pd.factorize(frame[dim], sort=True, use_na_sentinel=False)
+            levels[dim] = pd.Index(uniques, name=dim)
+            codes.append(dim_codes)
+
+        weights = frame[weight].to_numpy(dtype=float) if weight is not None else None
+        shape = tuple(len(levels[dim]) for dim in dims)
+        cell_codes, counts = _group(codes, shape, weights)
+        return cls(dims, levels, cell_codes, counts)
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __repr__(self):
+        return f'Cube(dims={self.dims}, cells={len(self)}, total={self.total()})'
+
+    @property
+    def shape(self):
+        return tuple(len(self.levels[dim]) for dim in self.dims)
+
+    @property
+    def nbytes(self):
+        return self.counts.nbytes + sum(c.nbytes for c in self.codes.values())
+
+    def total(self):
+        return self.counts.sum()
+
+    def rollup(self, dims):
+        """Aggregate the cube down to ``dims`` (a subset of its dimensions)."""
+        dims = list(dims)
+        missing = set(dims) - set(self.dims)
+        if missing:
+            raise KeyError(f'Unknown cube dimensions: {sorted(missing)}')
+
+        if not dims:
+            return Cube([], {}, {}, np.array([self.total()]))
+
+        shape = tuple(len(self.levels[dim]) for dim in dims)
+        cell_codes, counts = _group([self.codes[dim] for dim in dims], shape, self.counts)
+        if self.counts.dtype.kind != 'f':
+            counts = np.rint(counts).astype(self.counts.dtype)
+        return Cube(dims, {dim: self.levels[dim] for dim in dims}, cell_codes, counts)
+
+    def mask(self, **selections):
+        """Boolean mask over the cells matching ``dim=value`` / ``dim=[values]``.
+
+        ``None`` among the values selects the missing level, like ``NaN``.
+        """
+        mask = np.ones(len(self), dtype=bool)
+        for dim, values in selections.items():
+            if dim not in self.codes:
+                raise KeyError(f'Unknown cube dimension: {dim}')
+            if np.ndim(values) == 0:
+                values = [values]
+            wanted = self.levels[dim].get_indexer([np.nan if value is None else value for value in values])
+            mask &= np.isin(self.codes[dim], wanted[wanted >= 0])
+        return mask
+
+    def slice(self, **selections):
+        """Keep only the cells whose dimensions take the selected values."""
+        mask = self.mask(**selections)
+        return Cube(self.dims, self.levels, {dim: codes[mask] for dim, codes in self.codes.items()},
+                    self.counts[mask])
+
+    def to_frame(self, name='count'):
+        """Decode the cube into a DataFrame with one column per dim plus ``name``."""
+        data = {dim: self.levels[dim].take(self.codes[dim]) for dim in self.dims}
+        data[name] = self.counts
+        return pd.DataFrame(data)
@@ -0,0 +1,161 @@
+"""Vectorized kernel density estimates and box plot statistics per group.
+
+Precomputes, with NumPy, what ``transform_density`` and ``mark_boxplot`` would
+otherwise compute in the browser on every render, so the charts only receive
+the points they draw.  Bandwidth selection, the Gaussian kernel and the
+quartiles (linear interpolation) follow vega-statistics, so the curves are the
+same as Vega-Lite's for the same bandwidth.
+"""
+
+import numpy as np
+import pandas as pd
+
+STEPS = 200
+# rows of the (rows, steps) kernel matrix evaluated at once
+CHUNK_ROWS = 4096
+# box plot whiskers reach the last value within WHISKER_IQR * IQR of the box
+WHISKER_IQR = 1.5
+
+
+def _groups(frame, groupby):
+    """Group codes of every row (sorted groups) and the frame of group keys."""
+    if not groupby:
+        return np.zeros(len(frame), dtype=np.int64), pd.DataFrame(index=[0])
+    keys = frame[groupby].drop_duplicates().sort_values(groupby).reset_index(drop=True)
+    codes = pd.MultiIndex.from_frame(keys).get_indexer(pd.MultiIndex.from_frame(frame[groupby]))
+    return codes, keys
+
+
+def _sorted_groups(values, codes, n_groups):
+    order = np.lexsort((values, codes))
+    counts = np.bincount(codes, minlength=n_groups)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    return values[order], counts, starts
+
+
+def _quantiles(sorted_values, counts, starts, p):
+    """Quantile ``p`` of every group (linear interpolation, as numpy/Vega)."""
+    position = starts + (counts - 1) * p
+    lo = np.floor(position).astype(np.int64)
+    hi = np.minimum(lo + 1, starts + counts - 1)
+    frac = position - lo
+    return sorted_values[lo] * (1 - frac) + sorted_values[hi] * frac
+
+
+def scott_bandwidth(values, codes=None, n_groups=None):
+    """Vega's bandwidth estimate ``1.06 * min(std, IQR / 1.34) * n ** -0.2`` per group."""
+    values = np.asarray(values, dtype=float)
+    if codes is None:
+        codes, n_groups = np.zeros(len(values), dtype=np.int64), 1
+    sorted_values, counts, starts = _sorted_groups(values, codes, n_groups)
+
+    sums = np.bincount(codes, weights=values, minlength=n_groups)
+    squares = np.bincount(codes, weights=values ** 2, minlength=n_groups)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        std = np.sqrt(np.maximum(squares - sums ** 2 / counts, 0) / (counts - 1))
+    q1 = _quantiles(sorted_values, counts, starts, 0.25)
+    q3 = _quantiles(sorted_values, counts, starts, 0.75)
+
+    spread = np.fmin(std, (q3 - q1) / 1.34)
+    # fall back as Vega does when the spread is 0 or undefined
+    spread = np.where(spread > 0, spread, np.where(std > 0, std, np.where(q1 != 0, np.abs(q1), 1.0)))
+    return 1.06 * spread * counts.astype(float) ** -0.2
+
+
+def kde(values, grid, bandwidth, codes=None, n_groups=None):
+    """Gaussian KDE of every group evaluated on ``grid``, shape ``(groups, steps)``."""
+    values = np.asarray(values, dtype=float)
+    grid = np.asarray(grid, dtype=float)
+    if codes is None:
+        codes, n_groups = np.zeros(len(values), dtype=np.int64), 1
+    bandwidth = np.broadcast_to(np.asarray(bandwidth, dtype=float), (n_groups,))
+    counts = np.bincount(codes, minlength=n_groups)
+
+    density = np.zeros((n_groups, len(grid)))
+    for start in range(0, len(values), CHUNK_ROWS):
+        chunk = slice(start, start + CHUNK_ROWS)
+        h = bandwidth[codes[chunk]][:, None]
+        z = (grid[None, :] - values[chunk, None]) / h
+        kernel = np.exp(-0.5 * z * z) / (h * np.sqrt(2 * np.pi))
+        # sum the kernels of each group: one-hot (groups, rows) @ (rows, steps)
+        onehot = np.zeros((n_groups, kernel.shape[0]))
+        onehot[codes[chunk], np.arange(kernel.shape[0])] = 1
+        density += onehot @ kernel
+    return density / np.maximum(counts, 1)[:, None]
+
+
+def density_table(frame, value, groupby=(), extent=None, steps=STEPS, bandwidth=None, cutoff=1e-3):
+    """Long frame ``groupby + [value, 'density']`` with the KDE curve of every group.
+
+    The curves are sampled as ``transform_density(steps=steps)`` samples them,
+    on ``steps + 1`` points spanning ``extent``.  ``bandwidth`` is a number or
+    ``None`` for :func:`scott_bandwidth` per group.
+    Grid points at the ends of a curve with a density below ``cutoff`` times its
+    maximum are dropped; interior points are always kept.
+    """
+    groupby = list(groupby)
+    frame = frame.dropna(subset=[value])
+    codes, keys = _groups(frame, groupby)
+    values = frame[value].to_numpy(dtype=float)
+    lo, hi = extent if extent is not None else (values.min(), values.max())
+    # the uniform grid of Vega's sampleCurve: steps + 1 points, the last one exactly hi
+    grid = np.append(lo + np.arange(steps) / steps * (hi - lo), hi)
+
+    if bandwidth is None:
+        bandwidth = scott_bandwidth(values, codes, len(keys))
+    density = kde(values, grid, bandwidth, codes, len(keys))
+
+    above = density >= cutoff * density.max(axis=1, keepdims=True)
+    first = np.argmax(above, axis=1)
+    last = len(grid) - 1 - np.argmax(above[:, ::-1], axis=1)
+    columns = np.arange(len(grid))
+    keep = (columns >= first[:, None]) & (columns <= last[:, None])
+
+    group_index, step_index = np.nonzero(keep)
+    table = keys.iloc[group_index].reset_index(drop=True)
+    table[value] = grid[step_index]
+    table['density'] = density[group_index, step_index]
+    return table
+
+
+def box_table(frame, value, groupby=()):
+    """Box plot statistics of every group and the outliers beyond the whiskers.
+
+    Returns ``(boxes, outliers)``: ``boxes`` has ``lower, q1, median, q3,
+    upper`` per group, ``outliers`` the rows of ``groupby + [value]`` outside
+    ``[lower, upper]``.
+    """
+    groupby = list(groupby)
+    frame = frame.dropna(subset=[value])
+    codes, keys = _groups(frame, groupby)
+    values = frame[value].to_numpy(dtype=float)
+    sorted_values, counts, starts = _sorted_groups(values, codes, len(keys))
+
+    q1, median, q3 = (_quantiles(sorted_values, counts, starts, p) for p in (0.25, 0.5, 0.75))
+    iqr = q3 - q1
+    sorted_codes = np.repeat(np.arange(len(keys)), counts)
+    inside = (sorted_values >= (q1 - WHISKER_IQR * iqr)[sorted_codes]) & \
+             (sorted_values <= (q3 + WHISKER_IQR * iqr)[sorted_codes])
+    # the box always contains the quartiles, so no group is empty here
+    lower = np.minimum.reduceat(np.where(inside, sorted_values, np.inf), starts)
+    upper = np.maximum.reduceat(np.where(inside, sorted_values, -np.inf), starts)
+
+    boxes = keys.assign(lower=lower, q1=q1, median=median, q3=q3, upper=upper)
+    outliers = keys.iloc[sorted_codes[~inside]].reset_index(drop=True)
+    outliers[value] = sorted_values[~inside]
+    return boxes, outliers
+
+
+def violin_table(frame, value, groupby=(), extent=None, steps=STEPS, bandwidth=None):
+    """Density curves, boxes and outliers in one frame, told apart by ``layer``.
+
+    Faceted charts need a single dataset, so every layer filters its rows
+    (``density``, ``box`` or ``outlier``) with ``transform_filter``.
+    """
+    curves = density_table(frame, value, groupby, extent, steps, bandwidth)
+    boxes, outliers = box_table(frame, value, groupby)
+    return pd.concat([
+        curves.assign(layer='density'),
+        boxes.assign(layer='box'),
+        outliers.assign(layer='outlier'),
+    ], ignore_index=True)
@@ -0,0 +1,194 @@
+"""Static export of the charts with an on-disk render cache.
+
+Compiled Vega-Lite specs (data included) are rendered to SVG, PNG or
+standalone HTML with ``vl-convert``, a headless Vega runtime that needs no
+browser or network.  Artifacts are stored as ``<sha1>.<format>`` where the
+hash covers the spec, its inline data, the format, the scale and the renderer
+version, so a chart is only rendered again when one of them changes.  Renders
+run in a process pool, one chart and format per task.
+
+An ``index.json`` maps every exported chart name to its last artifacts.  The
+Streamlit apps still compile the current spec and only serve an artifact whose
+hash matches it, so a change of the data files is never hidden by an old
+export; exporting ahead of time spares them the render::
+
+    python -m nyc_collisions.export --formats svg png --workers 8
+"""
+
+import base64
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from nyc_collisions.spec import _dumps, compile_spec
+
+FORMATS = ('svg', 'png', 'html')
+INDEX_FILE = 'index.json'
+MIME_TYPES = {'svg': 'image/svg+xml', 'png': 'image/png'}
+
+
+def _renderer_version():
+    import vl_convert
+
+    return getattr(vl_convert, '__version__', 'unknown')
+
+
+def artifact_key(spec, fmt, scale=1):
+    digest = hashlib.sha1()
+    digest.update(f'{fmt}:{scale}:{_renderer_version()}:'.encode())
+    digest.update(_dumps(spec).encode())
+    return digest.hexdigest()
+
+
+def render(spec, fmt, scale=1):
+    """Render a Vega-Lite spec, returning bytes."""
+    import vl_convert
+
+    if fmt == 'svg':
+        return vl_convert.vegalite_to_svg(spec).encode()
+    if fmt == 'png':
+        return vl_convert.vegalite_to_png(spec, scale=scale)
+    if fmt == 'html':
+        # bundled so that the page works offline
+        return vl_convert.vegalite_to_html(spec, bundle=True).encode()
+    raise ValueError(f'unknown format {fmt!r}, expected one of {FORMATS}')
+
+
+class RenderCache:
+    """Content-addressed directory of rendered charts."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, key, fmt):
+        return os.path.join(self.directory, f'{key}.{fmt}')
+
+    def lookup(self, spec, fmt, scale=1):
+        """Path of the artifact of ``spec`` if it was already rendered, else ``None``."""
+        path = self.path(artifact_key(spec, fmt, scale), fmt)
+        return path if os.path.exists(path) else None
+
+    def render(self, spec, fmt, scale=1):
+        """Path of the artifact of ``spec``, rendering it on a cache miss."""
+        path = self.path(artifact_key(spec, fmt, scale), fmt)
+        if not os.path.exists(path):
+            os.makedirs(self.directory, exist_ok=True)
+            tmp = f'{path}.{os.getpid()}.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(render(spec, fmt, scale))
+            os.replace(tmp, path)
+        return path
+
+    def read_index(self):
+        path = os.path.join(self.directory, INDEX_FILE)
+        if not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            return json.load(f)
+
+    def write_index(self, entries):
+        """Merge ``{name: {format: path}}`` into the index (paths stored relative)."""
+        index = self.read_index()
+        for name, artifacts in entries.items():
+            index.setdefault(name, {}).update({fmt: os.path.basename(p) for fmt, p in artifacts.items()})
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, INDEX_FILE)
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(index, f, indent=2, sort_keys=True)
+        os.replace(tmp, path)
+
+    def artifact(self, name, spec, fmt='svg', scale=1):
+        """Path of the ``fmt`` artifact of chart ``name`` for its current ``spec``.
+
+        The index is only a hint: an entry exported before the spec or its data
+        changed is not served, the chart is rendered again and the index updated.
+        """
+        key = artifact_key(spec, fmt, scale)
+        if self.read_index().get(name, {}).get(fmt) == f'{key}.{fmt}' and os.path.exists(self.path(key, fmt)):
+            return self.path(key, fmt)
+        path = self.lookup(spec, fmt, scale) or self.render(spec, fmt, scale)
+        self.write_index({name: {fmt: path}})
+        return path
+
+
+def _render_job(directory, spec, fmt, scale):
+    return RenderCache(directory).render(spec, fmt, scale)
+
+
+def export_specs(specs, directory, formats=('svg',), workers=None, scale=1):
+    """Render ``{name: spec}`` in every format, in parallel; cached artifacts are reused.
+
+    Returns ``{name: {format: path}}`` and records it in the index.
+    """
+    cache = RenderCache(directory)
+    results = {name: {} for name in specs}
+    jobs = []
+    for name, spec in specs.items():
+        for fmt in formats:
+            path = cache.lookup(spec, fmt, scale)
+            if path:
+                results[name][fmt] = path
+            else:
+                jobs.append((name, fmt, spec))
+
+    if jobs:
+        workers = min(workers or os.cpu_count() or 1, len(jobs))
+        if workers == 1:
+            for name, fmt, spec in jobs:
+                results[name][fmt] = cache.render(spec, fmt, scale)
+        else:
+            # spawn: the renderer runtime is not fork safe
+            with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+                futures = {(name, fmt): pool.submit(_render_job, directory, spec, fmt, scale)
+                           for name, fmt, spec in jobs}
+                for (name, fmt), future in futures.items():
+                    results[name][fmt] = future.result()
+
+    cache.write_index(results)
+    return results
+
+
+def export_project(project, formats=('svg',), workers=None, scale=1):
+    """Build, compile and render every chart of ``project`` into its ``EXPORT_DIR``."""
+    from nyc_collisions.projects import PROJECTS, import_charts, working_directory
+
+    directory, names = PROJECTS[project]
+    module = import_charts(project)
+    with working_directory(directory):
+        specs = {name: compile_spec(module.chart(name))[0] for name in names}
+        export_dir = os.path.abspath(module.EXPORT_DIR)
+    return export_specs(specs, export_dir, formats, workers, scale)
+
+
+def image_html(path):
+    """``<img>`` tag embedding an SVG or PNG artifact, scaled to its container."""
+    fmt = os.path.splitext(path)[1][1:]
+    with open(path, 'rb') as f:
+        data = base64.b64encode(f.read()).decode()
+    return f'<img src="data:{MIME_TYPES[fmt]};base64,{data}" style="width: 100%; height: auto;"/>'
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    from nyc_collisions.projects import PROJECTS
+
+    parser = argparse.ArgumentParser(description='Render every chart to static files.')
+    parser.add_argument('--projects', nargs='+', choices=list(PROJECTS), default=list(PROJECTS))
+    parser.add_argument('--formats', nargs='+', choices=FORMATS, default=['svg'])
+    parser.add_argument('--workers', type=int, help='render processes (default: one per core)')
+    parser.add_argument('--scale', type=float, default=1, help='PNG scale factor')
+    args = parser.parse_args()
+
+    for project in args.projects:
+        start = time.perf_counter()
+        exported = export_project(project, args.formats, args.workers, args.scale)
+        print(f'{project}: {sum(len(a) for a in exported.values())} artifacts in {time.perf_counter() - start:.1f}s')
+        for name, artifacts in exported.items():
+            for fmt, path in sorted(artifacts.items()):
+                print(f'  {name:>11} {fmt:>4} {os.path.getsize(path) / 1024:8.1f} KB  {path}')
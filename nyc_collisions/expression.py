@@ -0,0 +1,618 @@
+"""Vectorized evaluation of Vega expressions over a DataFrame.
+
+Covers the subset of the expression language used by ``calculate`` and
+``filter`` transforms in practice: ``datum`` fields, literals (arrays and
+objects included, e.g. the decoding lookups of :mod:`nyc_collisions.schema`),
+arithmetic, comparisons, logical and conditional operators and the common
+math, string and date functions::
+
+    evaluate('datum.hours < 12 ? "morning" : "afternoon"', frame)
+
+Values follow JavaScript semantics.  Whatever the engine cannot evaluate
+exactly raises :class:`Unsupported`, so the caller can leave it to the
+browser: signals and selections (any name other than ``datum``), operations
+on null values that reach the result (null and undefined are not
+distinguishable after JSON; ``isValid(x) ? x * 2 : 0`` is fine),
+coercions between strings and numbers, and local-time functions of values
+whose time zone is that of the browser.
+"""
+
+import functools
+import json
+import math
+import re
+
+import numpy as np
+import pandas as pd
+
+
+class Unsupported(Exception):
+    """An expression or transform that has to be evaluated in the browser."""
+
+
+# ------------------------------- parsing -------------------------------- #
+
+_TOKEN = re.compile(r'''\s*(?:
+    (?P<number>0[xX][0-9a-fA-F]+|(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+  | (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+  | (?P<name>[A-Za-z_$][\w$]*)
+  | (?P<op>===|!==|==|!=|<=|>=|&&|\|\||[-+*/%<>!?:.,()\[\]{}])
+)''', re.VERBOSE)
+
+_BINARY = {'||': 1, '&&': 2, '==': 3, '!=': 3, '===': 3, '!==': 3,
+           '<': 4, '<=': 4, '>': 4, '>=': 4, '+': 5, '-': 5, '*': 6, '/': 6, '%': 6}
+
+
+def _tokens(source):
+    tokens, position = [], 0
+    source = source.rstrip()
+    while position < len(source):
+        match = _TOKEN.match(source, position)
+        if match is None or match.end() == position:
+            raise Unsupported(f'cannot parse {source[position:position + 20]!r}')
+        kind = match.lastgroup
+        text = match.group(kind)
+        if kind == 'number':
+            tokens.append(('lit', float(int(text, 16)) if text[:2].lower() == '0x' else float(text)))
+        elif kind == 'string':
+            tokens.append(('lit', _string(text)))
+        else:
+            tokens.append((kind, text))
+        position = match.end()
+    return tokens
+
+
+def _string(text):
+    body = text[1:-1]
+    if text[0] == "'":
+        # as a JSON string: \' unescaped, " escaped
+        body = re.sub(r'\\.|"', lambda m: {"\\'": "'", '"': '\\"'}.get(m.group(0), m.group(0)), body)
+    try:
+        return json.loads(f'"{body}"')
+    except ValueError:
+        raise Unsupported(f'string literal {text}') from None
+
+
+class _Parser:
+    def __init__(self, source):
+        self.tokens = _tokens(source)
+        self.position = 0
+
+    def peek(self, *ops):
+        token = self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+        return token if not ops or (token[0] == 'op' and token[1] in ops) else None
+
+    def take(self, op=None):
+        token = self.peek()
+        if token[0] is None or (op is not None and token != ('op', op)):
+            raise Unsupported(f'expected {op or "a token"}, got {token[1]!r}')
+        self.position += 1
+        return token
+
+    def parse(self):
+        node = self.expression()
+        if self.position != len(self.tokens):
+            raise Unsupported(f'unexpected {self.tokens[self.position][1]!r}')
+        return node
+
+    def expression(self):
+        node = self.binary(1)
+        if self.peek('?'):
+            self.take('?')
+            then = self.expression()
+            self.take(':')
+            return ('?', node, then, self.expression())
+        return node
+
+    def binary(self, precedence):
+        node = self.unary()
+        while True:
+            token = self.peek()
+            if token[0] != 'op' or _BINARY.get(token[1], 0) < precedence:
+                return node
+            self.take()
+            node = (token[1], node, self.binary(_BINARY[token[1]] + 1))
+
+    def unary(self):
+        if self.peek('!', '-', '+'):
+            return ('unary' + self.take()[1], self.unary())
+        return self.postfix(self.primary())
+
+    def postfix(self, node):
+        while True:
+            if self.peek('.'):
+                self.take('.')
+                kind, name = self.take()
+                if kind != 'name':
+                    raise Unsupported(f'member {name!r}')
+                node = ('member', node, ('lit', name))
+            elif self.peek('['):
+                self.take('[')
+                node = ('member', node, self.expression())
+                self.take(']')
+            elif self.peek('(') and node[0] == 'name':
+                self.take('(')
+                node = ('call', node[1], self.sequence(')'))
+            else:
+                return node
+
+    def sequence(self, close):
+        items = []
+        while not self.peek(close):
+            items.append(self.expression())
+            if not self.peek(close):
+                self.take(',')
+        self.take(close)
+        return items
+
+    def primary(self):
+        kind, value = self.take()
+        if kind in ('lit', 'name'):
+            return (kind, value)
+        if value == '(':
+            node = self.expression()
+            self.take(')')
+            return node
+        if value == '[':
+            return ('array', self.sequence(']'))
+        if value == '{':
+            entries = []
+            while not self.peek('}'):
+                key_kind, key = self.take()
+                if key_kind not in ('lit', 'name'):
+                    raise Unsupported(f'object key {key!r}')
+                self.take(':')
+                entries.append((_js_string(key) if key_kind == 'lit' else key, self.expression()))
+                if not self.peek('}'):
+                    self.take(',')
+            self.take('}')
+            return ('object', entries)
+        raise Unsupported(f'unexpected {value!r}')
+
+
+@functools.lru_cache(maxsize=256)
+def parse(source):
+    """Syntax tree (nested tuples) of an expression."""
+    return _Parser(source).parse()
+
+
+# ------------------------------- values -------------------------------- #
+
+class _Value:
+    """An expression evaluated on every row: the ``data`` array, its JavaScript
+    ``kind`` (number, string, boolean, temporal or any), the ``missing`` mask of
+    the rows where it is null or undefined and the ``unknown`` mask of the rows
+    where JavaScript semantics can't be reproduced (e.g. ``null * 2``).
+
+    Unknown rows are fine as long as they don't reach the result, as in
+    ``isValid(datum.x) ? datum.x * 2 : 0``.
+    """
+
+    __slots__ = ('data', 'kind', 'missing', 'unknown')
+
+    def __init__(self, data, kind, missing, unknown=None):
+        self.data = data
+        self.kind = kind
+        self.missing = missing
+        self.unknown = np.zeros(len(data), dtype=bool) if unknown is None else unknown
+
+
+class _Literal:
+    """A constant array or object, only used as a lookup table."""
+
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+
+_CONSTANTS = {'true': True, 'false': False, 'null': None, 'undefined': None, 'NaN': math.nan,
+              'PI': math.pi, 'E': math.e, 'LN2': math.log(2), 'LN10': math.log(10),
+              'LOG2E': 1 / math.log(2), 'LOG10E': 1 / math.log(10),
+              'SQRT2': math.sqrt(2), 'SQRT1_2': math.sqrt(0.5)}
+
+# local-time strings (no offset) are read the same in any time zone
+_LOCAL_DATETIME = re.compile(r'^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}(?::\d{2}(?:\.\d{1,3})?)?$')
+_UTC_DATETIME = re.compile(r'^\d{4}-\d{2}-\d{2}(?:T\d{2}:\d{2}(?::\d{2}(?:\.\d{1,3})?)?Z)?$')
+
+
+def _js_string(value):
+    """``String(value)`` of a number, string or boolean."""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (bool, np.bool_)):
+        return 'true' if value else 'false'
+    if value is None:
+        raise Unsupported('string of null')
+    value = float(value)
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return 'Infinity' if value > 0 else '-Infinity'
+    if value.is_integer() and abs(value) < 1e21:
+        return str(int(value))
+    text = repr(value)
+    if 'e' in text:
+        raise Unsupported(f'string of {text}')
+    return text
+
+
+def _kind_of(values):
+    kinds = {type(v) for v in values}
+    if kinds <= {str}:
+        return 'string'
+    if kinds <= {bool, np.bool_}:
+        return 'boolean'
+    if kinds and all(issubclass(k, (int, float, np.integer, np.floating)) and not issubclass(k, (bool, np.bool_))
+                     for k in kinds):
+        return 'number'
+    return 'any'
+
+
+def column(frame, field, temporal=()):
+    """The value of ``datum[field]`` on every row of ``frame``."""
+    n = len(frame)
+    if field not in frame.columns:
+        return _Value(np.full(n, None, dtype=object), 'any', np.ones(n, dtype=bool))
+    series = frame[field]
+    if series.dtype.kind in 'iuf':
+        data = series.to_numpy(dtype=float)
+        return _Value(data, 'number', np.isnan(data))
+    if series.dtype.kind == 'b':
+        return _Value(series.to_numpy(), 'boolean', np.zeros(n, dtype=bool))
+
+    data = series.to_numpy(dtype=object)
+    missing = pd.isna(data)
+    kind = _kind_of(data[~missing])
+    if kind == 'number':
+        data = np.where(missing, np.nan, data).astype(float)
+    elif kind == 'boolean':
+        data = np.where(missing, False, data).astype(bool)
+    elif kind == 'string' and field in temporal:
+        kind = 'temporal'  # Vega-Lite parses it as a date at the source
+    return _Value(data, kind, missing)
+
+
+def _constant(value, n):
+    if isinstance(value, (list, dict)):
+        return _Literal(value)
+    if value is None:
+        return _Value(np.full(n, None, dtype=object), 'any', np.ones(n, dtype=bool))
+    if isinstance(value, bool):
+        return _Value(np.full(n, value), 'boolean', np.zeros(n, dtype=bool))
+    if isinstance(value, str):
+        return _Value(np.full(n, value, dtype=object), 'string', np.zeros(n, dtype=bool))
+    return _Value(np.full(n, float(value)), 'number', np.zeros(n, dtype=bool))
+
+
+def _require(value, *kinds):
+    if not isinstance(value, _Value) or (value.kind not in kinds and not value.missing.all()):
+        raise Unsupported(f'{getattr(value, "kind", "literal")} operand where {"/".join(kinds)} is expected')
+    return value
+
+
+def _unknown(*values, nulls=True):
+    """Rows where any of ``values`` is unknown (or, with ``nulls``, null)."""
+    unknown = functools.reduce(np.logical_or, (v.unknown for v in values))
+    return unknown | functools.reduce(np.logical_or, (v.missing for v in values)) if nulls else unknown
+
+
+def _filled(value, kind):
+    """``value.data`` as ``kind``, with a placeholder on the null rows."""
+    if kind == 'number':
+        return value.data if value.kind == 'number' else np.full(len(value.data), np.nan)
+    if kind == 'boolean':
+        return value.data.astype(bool) if value.kind == 'boolean' else np.zeros(len(value.data), dtype=bool)
+    return np.where(value.missing, '', value.data.astype(object))
+
+
+def truthy(value):
+    """Boolean mask of the rows where ``value`` is truthy."""
+    if isinstance(value, _Literal):
+        return True
+    if value.kind == 'number':
+        return (value.data != 0) & ~np.isnan(value.data) & ~value.missing
+    if value.kind == 'boolean':
+        return value.data.astype(bool) & ~value.missing
+    if value.kind in ('string', 'temporal'):
+        return (value.data != '') & ~value.missing
+    return np.array([_js_truthy(v) for v in value.data], dtype=bool)
+
+
+def _js_truthy(value):
+    if value is None or isinstance(value, (list, dict)):
+        return value is not None
+    if isinstance(value, float) and math.isnan(value):
+        return False
+    return bool(value)
+
+
+def _select(test, a, b):
+    """``test ? a : b``, row by row."""
+    if isinstance(a, _Literal) or isinstance(b, _Literal):
+        raise Unsupported('conditional literal')
+    mask = truthy(test)
+    unknown = np.where(mask, a.unknown, b.unknown)
+    if not isinstance(test, _Literal):
+        unknown |= test.unknown
+    if a.kind == b.kind or a.missing.all() or b.missing.all():
+        kind = b.kind if a.missing.all() else a.kind
+        if kind == 'number':
+            data = np.where(mask, _filled(a, kind), _filled(b, kind))
+        else:
+            data = np.where(mask, a.data.astype(object), b.data.astype(object))
+    else:
+        kind, data = 'any', np.where(mask, a.data.astype(object), b.data.astype(object))
+    return _Value(data, kind, np.where(mask, a.missing, b.missing), unknown)
+
+
+# ----------------------------- evaluation ------------------------------ #
+
+def _binary(op, a, b, n):
+    if op in ('&&', '||'):
+        return _select(a, b, a) if op == '&&' else _select(a, a, b)
+    if op == '+' and (getattr(a, 'kind', None) == 'string' or getattr(b, 'kind', None) == 'string'):
+        _require(a, 'string', 'number', 'boolean')
+        _require(b, 'string', 'number', 'boolean')
+        unknown = _unknown(a, b)
+        strings = ['' if skip else _js_string(x) + _js_string(y) for x, y, skip in zip(a.data, b.data, unknown)]
+        return _Value(np.array(strings, dtype=object), 'string', np.zeros(n, dtype=bool), unknown)
+    if op in ('==', '!=') and isinstance(a, _Value) and isinstance(b, _Value) and (a.missing.all() or b.missing.all()):
+        equal = b.missing if a.missing.all() else a.missing  # x == null holds for null and undefined
+        return _Value(equal if op == '==' else ~equal, 'boolean', np.zeros(n, dtype=bool), _unknown(a, b, nulls=False))
+    if op in ('==', '!=', '===', '!=='):
+        kind = _require(a, 'number', 'string', 'boolean').kind
+        _require(b, kind)
+        equal = _filled(a, kind) == _filled(b, kind)
+        return _Value(equal if op in ('==', '===') else ~equal, 'boolean', np.zeros(n, dtype=bool), _unknown(a, b))
+    if op in ('<', '<=', '>', '>='):
+        kind = _require(a, 'number', 'string').kind if not a.missing.all() else _require(b, 'number', 'string').kind
+        _require(b, kind)
+        compare = {'<': np.less, '<=': np.less_equal, '>': np.greater, '>=': np.greater_equal}[op]
+        with np.errstate(invalid='ignore'):
+            result = compare(_filled(a, kind), _filled(b, kind)).astype(bool)
+        return _Value(result, 'boolean', np.zeros(n, dtype=bool), _unknown(a, b))
+
+    x, y = _filled(_require(a, 'number'), 'number'), _filled(_require(b, 'number'), 'number')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        data = {'+': np.add, '-': np.subtract, '*': np.multiply, '/': np.divide, '%': np.fmod}[op](x, y)
+    return _Value(data, 'number', np.zeros(n, dtype=bool), _unknown(a, b))
+
+
+def _member(node, frame, n, temporal):
+    target, key = node[1], node[2]
+    if target == ('name', 'datum'):
+        if key[0] != 'lit' or not isinstance(key[1], str):
+            raise Unsupported('computed datum field')
+        return column(frame, key[1], temporal)
+
+    table = _evaluate(target, frame, n, temporal)
+    if not isinstance(table, _Literal):
+        raise Unsupported('member of a field')
+    index = _evaluate(key, frame, n, temporal)
+    if isinstance(index, _Literal):
+        raise Unsupported('literal index')
+    table = table.value
+    if isinstance(table, list):
+        _require(index, 'number')
+        position = np.where(index.missing, -1, np.nan_to_num(_filled(index, 'number'), nan=-1.0))
+        found = (position >= 0) & (position < len(table)) & (position == np.floor(position))
+        items = np.empty(len(table) + 1, dtype=object)
+        items[:-1] = table
+        items[-1] = None
+        values = items[np.where(found, position, len(table)).astype(np.int64)]
+    else:
+        _require(index, 'string', 'number')
+        keys = [None if missing else _js_string(key) for key, missing in zip(index.data, index.missing)]
+        found = np.array([key in table for key in keys], dtype=bool)
+        values = np.array([table.get(key) for key in keys], dtype=object)
+
+    if any(isinstance(v, (list, dict)) for v in values):
+        raise Unsupported('nested literal')
+    missing = np.array([v is None for v in values], dtype=bool)
+    kind = _kind_of(values[~missing])
+    if kind == 'number':
+        values = np.where(missing, np.nan, values).astype(float)
+    return _Value(values, kind, missing, index.unknown | ~found)  # a miss is undefined, not null
+
+
+def _evaluate(node, frame, n, temporal):
+    op = node[0]
+    if op == 'lit':
+        return _constant(node[1], n)
+    if op == 'name':
+        if node[1] not in _CONSTANTS:
+            raise Unsupported(f'signal or selection {node[1]!r}')
+        return _constant(_CONSTANTS[node[1]], n)
+    if op == 'array':
+        return _Literal([_literal(item) for item in node[1]])
+    if op == 'object':
+        return _Literal({key: _literal(value) for key, value in node[1]})
+    if op == 'member':
+        return _member(node, frame, n, temporal)
+    if op == 'call':
+        return _call(node[1], [_evaluate(arg, frame, n, temporal) for arg in node[2]], n)
+    if op == '?':
+        return _select(*(_evaluate(child, frame, n, temporal) for child in node[1:]))
+    if op == 'unary!':
+        value = _evaluate(node[1], frame, n, temporal)
+        unknown = value.unknown if isinstance(value, _Value) else np.zeros(n, dtype=bool)
+        return _Value(np.logical_not(truthy(value)) & np.ones(n, dtype=bool), 'boolean', np.zeros(n, dtype=bool), unknown)
+    if op in ('unary-', 'unary+'):
+        value = _require(_evaluate(node[1], frame, n, temporal), 'number')
+        data = _filled(value, 'number')
+        return _Value(-data if op == 'unary-' else data, 'number', np.zeros(n, dtype=bool), _unknown(value))
+    return _binary(op, _evaluate(node[1], frame, n, temporal), _evaluate(node[2], frame, n, temporal), n)
+
+
+def _literal(node):
+    """Python value of a constant sub-expression (array and object elements)."""
+    if node[0] == 'lit':
+        return node[1]
+    if node[0] == 'name' and node[1] in ('true', 'false', 'null'):
+        return _CONSTANTS[node[1]]
+    if node[0] == 'unary-' and node[1][0] == 'lit' and isinstance(node[1][1], float):
+        return -node[1][1]
+    if node[0] == 'array':
+        return [_literal(item) for item in node[1]]
+    if node[0] == 'object':
+        return {key: _literal(value) for key, value in node[1]}
+    raise Unsupported('non-constant literal element')
+
+
+# ------------------------------ functions ------------------------------ #
+
+def _numbers(args):
+    if any(isinstance(arg, _Literal) for arg in args):
+        raise Unsupported('literal argument')
+    return [_filled(_require(arg, 'number'), 'number') for arg in args]
+
+
+def _math(function):
+    def apply(n, *args):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            data = function(*_numbers(args))
+        return _Value(data, 'number', np.zeros(n, dtype=bool), _unknown(*args))
+    return apply
+
+
+def _js_round(x):
+    return np.floor(x + 0.5)
+
+
+def _clamp(x, low, high):
+    return np.maximum(low, np.minimum(x, high))
+
+
+def _extreme(function):
+    def apply(n, *args):
+        if not args:
+            raise Unsupported('min/max without arguments')
+        data = functools.reduce(function, _numbers(args))
+        return _Value(data, 'number', np.zeros(n, dtype=bool), _unknown(*args))
+    return apply
+
+
+def _dates(value, utc, skip):
+    if isinstance(value, _Literal):
+        raise Unsupported('date of a literal')
+    if value.kind == 'number' and utc:
+        return pd.Series(pd.to_datetime(np.where(skip, 0, value.data), unit='ms'))
+    if value.kind in ('string', 'temporal'):
+        pattern = _UTC_DATETIME if utc else _LOCAL_DATETIME
+        texts = np.where(skip, '1970-01-01T00:00', value.data.astype(object))
+        if all(pattern.match(text) for text in texts):
+            return pd.to_datetime(pd.Series(texts, dtype=object).str.rstrip('Z'))
+    raise Unsupported('date in the time zone of the browser')
+
+
+def _date_part(part, utc):
+    def apply(n, value):
+        unknown = _unknown(value)
+        data = part(_dates(value, utc, unknown).dt)
+        return _Value(np.asarray(data, dtype=float), 'number', np.zeros(n, dtype=bool), unknown)
+    return apply
+
+
+_DATE_PARTS = {
+    'year': lambda d: d.year,
+    'month': lambda d: d.month - 1,
+    'date': lambda d: d.day,
+    'day': lambda d: (d.dayofweek + 1) % 7,
+    'hours': lambda d: d.hour,
+    'minutes': lambda d: d.minute,
+    'seconds': lambda d: d.second,
+    'milliseconds': lambda d: d.microsecond // 1000,
+}
+
+
+def _is_valid(n, value):
+    if isinstance(value, _Literal):
+        return _Value(np.ones(n, dtype=bool), 'boolean', np.zeros(n, dtype=bool))
+    valid = ~value.missing
+    if value.kind == 'number':
+        valid &= ~np.isnan(value.data)
+    return _Value(valid, 'boolean', np.zeros(n, dtype=bool), value.unknown.copy())
+
+
+def _number_test(function):
+    def apply(n, value):
+        data = function(*_numbers([value]))
+        return _Value(data, 'boolean', np.zeros(n, dtype=bool), _unknown(value))
+    return apply
+
+
+def _to_string(n, value):
+    _require(value, 'number', 'string', 'boolean')
+    data = np.array([None if missing else _js_string(v) for v, missing in zip(value.data, value.missing)], dtype=object)
+    return _Value(data, 'string', value.missing.copy(), value.unknown.copy())
+
+
+def _string_method(function, kind='string'):
+    def apply(n, value):
+        data = [function(text) for text in _filled(_require(value, 'string'), 'string')]
+        return _Value(np.array(data, dtype=float if kind == 'number' else object), kind,
+                      np.zeros(n, dtype=bool), _unknown(value))
+    return apply
+
+
+def _if(n, test, then, otherwise):
+    return _select(test, then, otherwise)
+
+
+_FUNCTIONS = {
+    'abs': _math(np.abs), 'ceil': _math(np.ceil), 'floor': _math(np.floor), 'round': _math(_js_round),
+    'sqrt': _math(np.sqrt), 'exp': _math(np.exp), 'log': _math(np.log), 'pow': _math(np.power),
+    'sin': _math(np.sin), 'cos': _math(np.cos), 'tan': _math(np.tan), 'atan2': _math(np.arctan2),
+    'clamp': _math(_clamp), 'min': _extreme(np.minimum), 'max': _extreme(np.maximum),
+    'isNaN': _number_test(np.isnan), 'isFinite': _number_test(np.isfinite), 'isValid': _is_valid,
+    'toString': _to_string, 'length': _string_method(len, 'number'),
+    'upper': _string_method(str.upper), 'lower': _string_method(str.lower), 'trim': _string_method(str.strip),
+    'if': _if,
+    **{name: _date_part(part, utc=False) for name, part in _DATE_PARTS.items()},
+    **{'utc' + name: _date_part(part, utc=True) for name, part in _DATE_PARTS.items()},
+}
+
+
+def _call(name, args, n):
+    function = _FUNCTIONS.get(name)
+    if function is None:
+        raise Unsupported(f'function {name}()')
+    try:
+        return function(n, *args)
+    except TypeError:
+        raise Unsupported(f'{name}() with {len(args)} arguments') from None
+
+
+# --------------------------------- API --------------------------------- #
+
+def evaluate_value(source, frame, temporal=()):
+    """Evaluate ``source`` (an expression string or a parsed tree) on every row of ``frame``."""
+    node = parse(source) if isinstance(source, str) else source
+    value = _evaluate(node, frame, len(frame), frozenset(temporal))
+    if isinstance(value, _Literal):
+        raise Unsupported('array or object result')
+    if value.unknown.any():
+        raise Unsupported('null operand')
+    return value
+
+
+def evaluate(source, frame, temporal=()):
+    """The values of an expression as a Series aligned on ``frame`` (nulls as ``None``/``NaN``).
+
+    ``temporal`` lists the fields Vega-Lite parses as dates at the source;
+    they can only be passed to the date functions.
+    """
+    value = evaluate_value(source, frame, temporal)
+    if value.kind == 'temporal':
+        raise Unsupported('date field used as a string')
+    if value.kind == 'number':
+        return pd.Series(np.where(value.missing, np.nan, value.data), index=frame.index)
+    data = value.data.astype(object)
+    data[value.missing] = None
+    return pd.Series(data, index=frame.index, dtype=object)
+
+
+def evaluate_mask(source, frame, temporal=()):
+    """Boolean mask of the rows of ``frame`` where the expression is truthy."""
+    return truthy(evaluate_value(source, frame, temporal))
@@ -0,0 +1,131 @@
+"""Offline, vectorized reverse geocoding against the NYC ZIP code polygons.
+
+Replaces the per-row ``Nominatim.reverse`` calls of the preprocessing notebook
+with a batch point-in-polygon test on ``ny_city_map.geojson``.  The polygons'
+bounding boxes are registered in a uniform grid; points are bucketed into the
+same grid (sorted by cell, CSR offsets) so that each polygon only runs the
+even-odd ray casting test on the points of the cells it overlaps.
+"""
+
+import json
+
+import numpy as np
+import pandas as pd
+
+CHUNK_ELEMENTS = 4_000_000
+
+
+def read_polygons(path):
+    """Read the features of a GeoJSON file as ``(properties, parts)`` pairs.
+
+    ``parts`` has one ``[outer, *holes]`` list of ``(n, 2)`` lon/lat arrays per
+    polygon of the feature: one for a Polygon, one per part for a MultiPolygon.
+    """
+    with open(path) as f:
+        features = json.load(f)['features']
+
+    polygons = []
+    for feature in features:
+        geometry = feature['geometry']
+        parts = geometry['coordinates'] if geometry['type'] == 'MultiPolygon' else [geometry['coordinates']]
+        polygons.append((feature['properties'],
+                         [[np.asarray(ring, dtype=float)[:, :2] for ring in part] for part in parts]))
+    return polygons
+
+
+def flat_rings(parts):
+    """Every ring of the parts of a feature, outer rings and holes alike (all the even-odd rule needs)."""
+    return [ring for part in parts for ring in part]
+
+
+def _edges(rings):
+    """Edges of all rings as ``(x0, y0, x1, y1)`` arrays."""
+    starts = np.concatenate([ring for ring in rings])
+    ends = np.concatenate([np.roll(ring, -1, axis=0) for ring in rings])
+    return starts[:, 0], starts[:, 1], ends[:, 0], ends[:, 1]
+
+
+def points_in_polygon(x, y, rings):
+    """Vectorized even-odd test of the points ``(x, y)`` against ``rings``."""
+    x0, y0, x1, y1 = _edges(rings)
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    inside = np.zeros(len(x), dtype=bool)
+
+    step = max(1, CHUNK_ELEMENTS // max(len(x0), 1))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for start in range(0, len(x), step):
+            px = x[start:start + step, None]
+            py = y[start:start + step, None]
+            straddles = (y0 > py) != (y1 > py)
+            x_cross = (x1 - x0) * (py - y0) / (y1 - y0) + x0
+            crossings = np.count_nonzero(straddles & (px < x_cross), axis=1)
+            inside[start:start + step] = crossings % 2 == 1
+    return inside
+
+
+class ZipGeocoder:
+    """Assign borough and ZIP code to lat/lon arrays using the ZIP polygons."""
+
+    def __init__(self, path, cell_size=0.01):
+        polygons = read_polygons(path)
+        self.cell_size = cell_size
+        self.zip_codes = np.array([props['postalCode'] for props, _ in polygons], dtype=object)
+        self.boroughs = np.array([props['borough'].upper() for props, _ in polygons], dtype=object)
+        self.rings = [flat_rings(parts) for _, parts in polygons]
+
+        bounds = np.array([[r[:, 0].min(), r[:, 1].min(), r[:, 0].max(), r[:, 1].max()]
+                           for r in (np.concatenate(rings) for rings in self.rings)])
+        self.bounds = bounds
+        self.origin = bounds[:, :2].min(axis=0)
+        self.n_cols, self.n_rows = (np.floor((bounds[:, 2:].max(axis=0) - self.origin) / cell_size) + 1).astype(int)
+
+        # cells overlapped by every polygon's bounding box
+        lo = self._cell_xy(bounds[:, 0], bounds[:, 1])
+        hi = self._cell_xy(bounds[:, 2], bounds[:, 3])
+        self.polygon_cells = [
+            (np.arange(r0, r1 + 1)[:, None] * self.n_cols + np.arange(c0, c1 + 1)[None, :]).ravel()
+            for c0, r0, c1, r1 in zip(lo[0], lo[1], hi[0], hi[1])
+        ]
+
+    def _cell_xy(self, lon, lat):
+        col = np.floor((np.asarray(lon) - self.origin[0]) / self.cell_size).astype(np.int64)
+        row = np.floor((np.asarray(lat) - self.origin[1]) / self.cell_size).astype(np.int64)
+        return col, row
+
+    def locate(self, latitude, longitude):
+        """Index of the polygon containing each point, ``-1`` when none does."""
+        lat = np.asarray(latitude, dtype=float)
+        lon = np.asarray(longitude, dtype=float)
+        result = np.full(len(lat), -1, dtype=np.int64)
+
+        col, row = self._cell_xy(np.nan_to_num(lon, nan=-1e9), np.nan_to_num(lat, nan=-1e9))
+        valid = (col >= 0) & (col < self.n_cols) & (row >= 0) & (row < self.n_rows)
+        cells = np.where(valid, row * self.n_cols + col, -1)
+
+        # bucket the points by cell so that a polygon can gather its candidates with slices
+        order = np.argsort(cells, kind='stable')
+        offsets = np.searchsorted(cells[order], np.arange(self.n_rows * self.n_cols + 1))
+
+        for polygon, poly_cells in enumerate(self.polygon_cells):
+            candidates = np.concatenate([order[offsets[c]:offsets[c + 1]] for c in poly_cells])
+            candidates = candidates[result[candidates] == -1]
+            if len(candidates) == 0:
+                continue
+            inside = points_in_polygon(lon[candidates], lat[candidates], self.rings[polygon])
+            result[candidates[inside]] = polygon
+        return result
+
+    def reverse(self, latitude, longitude):
+        """Return a ``BOROUGH``/``ZIP_CODE`` frame aligned with the inputs.
+
+        Points outside every polygon (water, outside the city, missing
+        coordinates) get ``None`` in both columns.
+        """
+        polygon = self.locate(latitude, longitude)
+        found = polygon >= 0
+        borough = np.full(len(polygon), None, dtype=object)
+        zip_code = np.full(len(polygon), None, dtype=object)
+        borough[found] = self.boroughs[polygon[found]]
+        zip_code[found] = self.zip_codes[polygon[found]]
+        index = latitude.index if isinstance(latitude, pd.Series) else None
+        return pd.DataFrame({'BOROUGH': borough, 'ZIP_CODE': zip_code}, index=index)
@@ -0,0 +1,224 @@
+"""Local, simplified and quantized basemap geometry.
+
+Turns ``ny_city_map.geojson`` into TopoJSON so the map no longer has to be
+fetched from GitHub (or shipped at full resolution) on every page load:
+
+* coordinates are quantized to an integer grid, so vertices shared by
+  neighbouring ZIP codes match exactly;
+* rings are cut at the junctions where the neighbours change and identical
+  arcs are stored once, so every shared border exists a single time;
+* each arc is simplified with Douglas-Peucker keeping its end points, which
+  keeps the topology (no gaps or overlaps between neighbours) at any level;
+* arcs are delta-encoded as in the TopoJSON spec.
+
+Every level is written to ``.cache/`` next to the GeoJSON and only rebuilt
+when the source file changes.
+"""
+
+import json
+import os
+
+import numpy as np
+
+from nyc_collisions.geocoder import flat_rings, read_polygons
+from nyc_collisions.loader import CACHE_DIR_NAME, is_fresh, write_manifest
+
+# Douglas-Peucker tolerance of every level, in degrees
+LEVELS = {
+    'full': 0.0,
+    'high': 0.0001,
+    'medium': 0.0005,
+    'low': 0.002,
+}
+QUANTIZATION = 100_000
+OBJECT_NAME = 'zipcodes'
+PROPERTIES = ['postalCode', 'PO_NAME', 'borough']
+
+
+def douglas_peucker(points, tolerance):
+    """Indices of the vertices of ``points`` kept by Douglas-Peucker."""
+    n = len(points)
+    if n <= 2 or tolerance <= 0:
+        return np.arange(n)
+
+    keep = np.zeros(n, dtype=bool)
+    keep[[0, n - 1]] = True
+    stack = [(0, n - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        segment = points[start + 1:end]
+        a, b = points[start], points[end]
+        ab = b - a
+        length = np.hypot(*ab)
+        if length == 0:
+            dist = np.hypot(*(segment - a).T)
+        else:
+            dist = np.abs(ab[0] * (segment[:, 1] - a[1]) - ab[1] * (segment[:, 0] - a[0])) / length
+        farthest = int(np.argmax(dist))
+        if dist[farthest] > tolerance:
+            split = start + 1 + farthest
+            keep[split] = True
+            stack.extend([(start, split), (split, end)])
+    return np.flatnonzero(keep)
+
+
+def _simplify_arc(arc, tolerance, closed):
+    if not closed:
+        return arc[douglas_peucker(arc, tolerance)]
+
+    # A closed ring starts and ends on the same vertex: split it at the vertex
+    # farthest from the start so that DP has a real segment to work with, and
+    # keep at least a triangle
+    far = int(np.argmax(np.hypot(*(arc - arc[0]).T)))
+    first = arc[:far + 1][douglas_peucker(arc[:far + 1], tolerance)]
+    second = arc[far:][douglas_peucker(arc[far:], tolerance)]
+    ring = np.concatenate([first, second[1:]])
+    if len(ring) < 4:
+        ring = arc[np.unique(np.linspace(0, len(arc) - 1, 4).astype(int))]
+    return ring
+
+
+def _quantize(ring, lo, scale):
+    ring = np.rint((ring - lo) / scale).astype(np.int64)
+    # rounding can make consecutive vertices coincide
+    keep = np.ones(len(ring), dtype=bool)
+    keep[1:] = np.any(np.diff(ring, axis=0) != 0, axis=1)
+    ring = ring[keep]
+    if not np.array_equal(ring[0], ring[-1]):
+        ring = np.vstack([ring, ring[:1]])
+    return ring
+
+
+def _junctions(rings):
+    """Quantized points where the set of neighbouring vertices changes."""
+    neighbours = {}
+    for ring in rings:
+        points = [tuple(p) for p in ring[:-1]]
+        n = len(points)
+        for i, point in enumerate(points):
+            pair = frozenset((points[i - 1], points[(i + 1) % n]))
+            neighbours.setdefault(point, set()).add(pair)
+    return {point for point, pairs in neighbours.items() if len(pairs) > 1}
+
+
+def _cut(ring, junctions):
+    """Cut a closed ring into arcs at its junctions."""
+    points = [tuple(p) for p in ring[:-1]]
+    cuts = [i for i, point in enumerate(points) if point in junctions]
+    if not cuts:
+        # no junction: rotate to a canonical start so identical rings match
+        start = points.index(min(points))
+        points = points[start:] + points[:start]
+        return [points + [points[0]]], True
+
+    points = points[cuts[0]:] + points[:cuts[0]]
+    cuts = [c - cuts[0] for c in cuts] + [len(points)]
+    points = points + [points[0]]
+    return [points[a:b + 1] for a, b in zip(cuts[:-1], cuts[1:])], False
+
+
+class _ArcStore:
+    def __init__(self):
+        self.arcs, self.closed, self.index = [], [], {}
+
+    def add(self, arc, closed):
+        key = tuple(arc)
+        if key in self.index:
+            return self.index[key]
+        reverse = tuple(reversed(arc))
+        if reverse in self.index:
+            return ~self.index[reverse]
+        if closed:
+            # the same ring traversed the other way round, from the same start
+            turned = (arc[0],) + tuple(reversed(arc[1:-1])) + (arc[0],)
+            if turned in self.index:
+                return ~self.index[turned]
+        self.index[key] = len(self.arcs)
+        self.arcs.append(np.array(arc, dtype=np.int64))
+        self.closed.append(closed)
+        return self.index[key]
+
+
+def build_topology(path, tolerance=0.0, quantization=QUANTIZATION, properties=PROPERTIES):
+    """Build a quantized, simplified TopoJSON topology from a GeoJSON file.
+
+    Features of several parts are written as MultiPolygons, one list of ring
+    arcs (outer ring first, then its holes) per part.
+    """
+    polygons = read_polygons(path)
+    coords = np.concatenate([ring for _, parts in polygons for ring in flat_rings(parts)])
+    lo, hi = coords.min(axis=0), coords.max(axis=0)
+    scale = (hi - lo) / (quantization - 1)
+    scale[scale == 0] = 1
+
+    quantized = [[[_quantize(ring, lo, scale) for ring in part] for part in parts] for _, parts in polygons]
+    junctions = _junctions([ring for parts in quantized for ring in flat_rings(parts)])
+
+    store = _ArcStore()
+    geometries = []
+    for (props, _), parts in zip(polygons, quantized):
+        part_arcs = []
+        for part in parts:
+            ring_arcs = []
+            for ring in part:
+                arcs, closed = _cut(ring, junctions)
+                ring_arcs.append([store.add(arc, closed) for arc in arcs])
+            part_arcs.append(ring_arcs)
+        geometries.append({
+            'type': 'Polygon' if len(part_arcs) == 1 else 'MultiPolygon',
+            'arcs': part_arcs[0] if len(part_arcs) == 1 else part_arcs,
+            'properties': {k: props[k] for k in properties if k in props},
+        })
+
+    # tolerance is in degrees; simplify in the quantized grid with the mean scale
+    tolerance_q = tolerance / scale.mean() if tolerance else 0.0
+    arcs = []
+    for arc, closed in zip(store.arcs, store.closed):
+        arc = _simplify_arc(arc, tolerance_q, closed)
+        deltas = np.vstack([arc[:1], np.diff(arc, axis=0)])
+        arcs.append(deltas.tolist())
+
+    return {
+        'type': 'Topology',
+        'transform': {'scale': scale.tolist(), 'translate': lo.tolist()},
+        'objects': {OBJECT_NAME: {'type': 'GeometryCollection', 'geometries': geometries}},
+        'arcs': arcs,
+    }
+
+
+def basemap(path, level='medium', quantization=QUANTIZATION, cache_dir=None):
+    """Cached TopoJSON of ``path`` at one of the :data:`LEVELS` of detail."""
+    source = os.path.abspath(path)
+    cache_dir = cache_dir or os.path.join(os.path.dirname(source), CACHE_DIR_NAME)
+    stem = os.path.splitext(os.path.basename(source))[0]
+    key = f'topojson-{level}-q{quantization}-parts'
+    data_path = os.path.join(cache_dir, f'{stem}.{level}.topo.json')
+    manifest_path = os.path.join(cache_dir, f'{stem}.{level}.topo.manifest.json')
+
+    if is_fresh(source, data_path, manifest_path, key):
+        with open(data_path) as f:
+            return json.load(f)
+
+    topology = build_topology(source, LEVELS[level], quantization)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = data_path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(topology, f, separators=(',', ':'))
+    os.replace(tmp, data_path)
+    write_manifest(manifest_path, source, key)
+    return topology
+
+
+def build_levels(path, levels=None, quantization=QUANTIZATION, cache_dir=None):
+    """Precompute (or refresh) the cached TopoJSON of every level."""
+    return {level: basemap(path, level, quantization, cache_dir) for level in (levels or LEVELS)}
+
+
+if __name__ == '__main__':
+    import sys
+
+    for level, topology in build_levels(sys.argv[1]).items():
+        size = len(json.dumps(topology, separators=(',', ':')))
+        print(f'{level:>7}: {sum(len(arc) for arc in topology["arcs"]):>6} points, {size / 1024:7.1f} KB')
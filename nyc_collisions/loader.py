@@ -0,0 +1,184 @@
+"""Columnar ingest cache for the collision and weather CSVs.
+
+Each CSV is parsed once (including the datetime columns) and stored next to it
+in ``.cache/`` as a typed Parquet file.  Later reads memory-map that file and
+only pull the requested columns and the row groups that can satisfy the
+filters.  The cache is rebuilt when the source file changes: a different
+mtime/size triggers a content hash, and only a different hash forces a new
+parse (so a ``touch`` or a fresh checkout does not).  Collision columns are
+stored with the compact dtypes of :mod:`nyc_collisions.schema`; a change of
+the parsed layout bumps ``CACHE_VERSION``.
+
+Without ``pyarrow`` installed the parsed frame is cached as a pickle instead
+and projection/filters are applied in pandas after reading it.
+"""
+
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+from nyc_collisions.profiling import stage
+from nyc_collisions.schema import apply_schema
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - depends on the environment
+    pa = pq = None
+
+CACHE_DIR_NAME = '.cache'
+CACHE_VERSION = 2
+ROW_GROUP_SIZE = 64_000
+
+# as in the pyarrow filters, a comparison with a missing value is false ('not in' aside)
+_OPS = {
+    '==': lambda s, v: s == v,
+    '!=': lambda s, v: (s != v) & s.notna(),
+    '<': lambda s, v: s < v,
+    '<=': lambda s, v: s <= v,
+    '>': lambda s, v: s > v,
+    '>=': lambda s, v: s >= v,
+    'in': lambda s, v: s.isin(list(v)),
+    'not in': lambda s, v: ~s.isin(list(v)),
+}
+
+
+# ----------------------------- parsers ------------------------------- #
+
+def parse_collisions(path):
+    """Parse a collisions CSV into a typed frame.
+
+    Handles both layouts used in the repo: the raw ``CRASH_DATE`` +
+    ``CRASH_TIME`` columns (Project 1) and the already combined
+    ``CRASH_DATETIME`` column (Project 2).  A ``YEAR`` column is added so that
+    year predicates can be pushed down to the Parquet reader.
+    """
+    collisions = pd.read_csv(path, dtype={'ZIP_CODE': str})
+    if 'CRASH_DATE' in collisions.columns and 'CRASH_TIME' in collisions.columns:
+        collisions['CRASH_DATETIME'] = pd.to_datetime(collisions['CRASH_DATE'] + ' ' + collisions['CRASH_TIME'],
+                                                      format='%m/%d/%Y %H:%M')
+    else:
+        collisions['CRASH_DATETIME'] = pd.to_datetime(collisions['CRASH_DATETIME'], format='%Y-%m-%d %H:%M:%S')
+    collisions['YEAR'] = collisions['CRASH_DATETIME'].dt.year.astype('int16')
+    return apply_schema(collisions)
+
+
+def parse_weather(path):
+    """Parse a daily weather CSV, with ``datetime`` as a datetime column."""
+    weather = pd.read_csv(path)
+    weather['datetime'] = pd.to_datetime(weather['datetime'], format='%Y-%m-%d')
+    return weather
+
+
+# ------------------------------ cache -------------------------------- #
+
+def _file_hash(path, block_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_paths(source, parser_name, cache_dir=None):
+    """Return the ``(data, manifest)`` cache paths for ``source``."""
+    source = os.path.abspath(source)
+    cache_dir = cache_dir or os.path.join(os.path.dirname(source), CACHE_DIR_NAME)
+    stem = os.path.splitext(os.path.basename(source))[0]
+    ext = 'parquet' if pq is not None else 'pkl'
+    base = os.path.join(cache_dir, f'{stem}.{parser_name}')
+    return f'{base}.{ext}', f'{base}.json'
+
+
+def is_fresh(source, data_path, manifest_path, parser_name):
+    """Whether the cache at ``data_path`` was built by ``parser_name`` from the current ``source``."""
+    if not (os.path.exists(data_path) and os.path.exists(manifest_path)):
+        return False
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if manifest.get('parser') != parser_name or manifest.get('version') != CACHE_VERSION:
+        return False
+
+    stat = os.stat(source)
+    if manifest.get('mtime') == stat.st_mtime and manifest.get('size') == stat.st_size:
+        return True
+
+    # The file was touched or copied: only its content decides
+    if manifest.get('sha1') != _file_hash(source):
+        return False
+    write_manifest(manifest_path, source, parser_name, manifest['sha1'])
+    return True
+
+
+def write_manifest(manifest_path, source, parser_name, sha1=None):
+    """Record the state of ``source`` that a cache entry was built from."""
+    stat = os.stat(source)
+    manifest = {'source': os.path.abspath(source), 'parser': parser_name, 'version': CACHE_VERSION,
+                'mtime': stat.st_mtime, 'size': stat.st_size, 'sha1': sha1 or _file_hash(source)}
+    tmp = manifest_path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, manifest_path)
+
+
+def _build(source, parse, data_path, manifest_path, parser_name):
+    os.makedirs(os.path.dirname(data_path), exist_ok=True)
+    frame = parse(source)
+    tmp = data_path + '.tmp'
+    if pq is not None:
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        pq.write_table(table, tmp, row_group_size=ROW_GROUP_SIZE)
+    else:
+        frame.to_pickle(tmp)
+    os.replace(tmp, data_path)
+    write_manifest(manifest_path, source, parser_name)
+    return frame
+
+
+def apply_filters(frame, filters):
+    """Apply ``[(column, op, value), ...]`` filters (ANDed) to a DataFrame."""
+    if not filters:
+        return frame
+    mask = pd.Series(True, index=frame.index)
+    for column, op, value in filters:
+        mask &= _OPS[op](frame[column], value)
+    return frame[mask].reset_index(drop=True)
+
+
+def cached_table(source, parse, columns=None, filters=None, cache_dir=None):
+    """Read ``source`` through the columnar cache.
+
+    ``parse(path) -> DataFrame`` does the expensive CSV parsing and is only
+    called when the cache is missing or stale.  ``columns`` projects the
+    result and ``filters`` is a list of ``(column, op, value)`` tuples with the
+    operators ``== != < <= > >= in 'not in'``, combined with AND (the
+    pyarrow/Parquet filter format).
+    """
+    parser_name = parse.__name__
+    data_path, manifest_path = cache_paths(source, parser_name, cache_dir)
+
+    if not is_fresh(source, data_path, manifest_path, parser_name):
+        with stage('parse csv', path=os.path.basename(source)):
+            frame = _build(source, parse, data_path, manifest_path, parser_name)
+            frame = apply_filters(frame, filters)
+        return frame[columns] if columns is not None else frame
+
+    with stage('read cache', path=os.path.basename(source)):
+        if pq is not None:
+            table = pq.read_table(data_path, columns=columns, filters=filters or None, memory_map=True)
+            return table.to_pandas()
+
+        frame = apply_filters(pd.read_pickle(data_path), filters)
+        return frame[columns] if columns is not None else frame
+
+
+def load_collisions(path, columns=None, filters=None, cache_dir=None):
+    """Cached, typed read of a collisions CSV (see :func:`parse_collisions`)."""
+    return cached_table(path, parse_collisions, columns=columns, filters=filters, cache_dir=cache_dir)
+
+
+def load_weather(path, columns=None, filters=None, cache_dir=None):
+    """Cached, typed read of a weather CSV (see :func:`parse_weather`)."""
+    return cached_table(path, parse_weather, columns=columns, filters=filters, cache_dir=cache_dir)
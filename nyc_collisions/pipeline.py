@@ -0,0 +1,272 @@
+"""Chunked, resumable version of the Project 2 preprocessing notebook.
+
+The collisions dump is streamed with ``pd.read_csv(chunksize=...)`` and every
+chunk goes through the notebook steps, vectorized:
+
+* combine ``CRASH_DATE``/``CRASH_TIME`` into ``CRASH_DATETIME``,
+* keep the selected years and vehicle types,
+* normalize borough names and (optionally) impute missing borough/ZIP codes
+  offline with :class:`nyc_collisions.geocoder.ZipGeocoder`,
+* drop incomplete rows, derive ``MONTH``, ``HOUR``, ``DAY_WEEK``, ``DAY`` and
+  ``CASUALTIES`` and add the weather ``icon`` of the day.
+
+The output is partitioned as ``year=YYYY/month=MM/part-NNNNN.<ext>``, one part
+per input chunk.  ``_progress.json`` records the last chunk written, so an
+interrupted run resumes after it (a half-written chunk is simply rewritten),
+and each partition gets a ``_SUCCESS`` marker once the whole input has been
+processed; partitions with a marker are skipped by later runs.  When the
+input files change (the dump grew by a few days), the input is read again but
+the finished months are kept, all but the last one.  Other settings need
+``--overwrite``, which only deletes the partitions, never other files of the
+output directory.  Both the raw
+public dataset (``CRASH DATE``, ``NUMBER OF PERSONS INJURED``...) and the
+already renamed ``preprocessed-collisions.csv`` are accepted.
+"""
+
+import glob
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from nyc_collisions.loader import _file_hash, load_weather, pq
+from nyc_collisions.weather import WeatherStore
+
+RAW_COLUMNS = {
+    'CRASH DATE': 'CRASH_DATE',
+    'CRASH TIME': 'CRASH_TIME',
+    'ZIP CODE': 'ZIP_CODE',
+    'NUMBER OF PERSONS INJURED': 'TOTAL_INJURED',
+    'NUMBER OF PERSONS KILLED': 'TOTAL_KILLED',
+    'NUMBER OF PEDESTRIANS INJURED': 'PEDESTRIANS_INJURED',
+    'NUMBER OF PEDESTRIANS KILLED': 'PEDESTRIANS_KILLED',
+    'NUMBER OF CYCLIST INJURED': 'CYCLIST_INJURED',
+    'NUMBER OF CYCLIST KILLED': 'CYCLIST_KILLED',
+    'NUMBER OF MOTORIST INJURED': 'MOTORIST_INJURED',
+    'NUMBER OF MOTORIST KILLED': 'MOTORIST_KILLED',
+    'CONTRIBUTING FACTOR VEHICLE 1': 'CONTRIBUTING_FACTOR_VEHICLE1',
+    'VEHICLE TYPE CODE 1': 'VEHICLE_TYPE_CODE1',
+}
+INPUT_COLUMNS = ['CRASH_DATE', 'CRASH_TIME', 'BOROUGH', 'ZIP_CODE', 'LATITUDE', 'LONGITUDE',
+                 'TOTAL_INJURED', 'TOTAL_KILLED', 'CONTRIBUTING_FACTOR_VEHICLE1', 'VEHICLE_TYPE_CODE1']
+OUTPUT_COLUMNS = ['BOROUGH', 'ZIP_CODE', 'LATITUDE', 'LONGITUDE', 'CONTRIBUTING_FACTOR_VEHICLE1',
+                  'VEHICLE_TYPE_CODE1', 'CRASH_DATETIME', 'MONTH', 'HOUR', 'DAY_WEEK', 'DAY', 'CASUALTIES', 'icon']
+BOROUGH_NAMES = {'THE BRONX': 'BRONX', 'QUEENS COUNTY': 'QUEENS'}
+INVALID_BOROUGHS = ['KINGS COUNTY']
+VEHICLE_TYPES = ['Taxi', 'Ambulance', 'Fire truck']
+
+PROGRESS_FILE = '_progress.json'
+SUCCESS_FILE = '_SUCCESS'
+
+
+def weather_icons(weather_path):
+    """Store of the weather ``icon`` of every day (``-day`` suffix removed)."""
+    weather = load_weather(weather_path, columns=['datetime', 'icon'])
+    weather['icon'] = weather['icon'].str.replace('-day', '')
+    return WeatherStore(weather)
+
+
+def transform_chunk(chunk, weather, years=None, vehicle_types=VEHICLE_TYPES, geocoder=None):
+    """Apply the notebook preprocessing to one chunk of the collisions dump."""
+    chunk = chunk.rename(columns=RAW_COLUMNS)[INPUT_COLUMNS]
+    chunk['CRASH_DATETIME'] = pd.to_datetime(chunk['CRASH_DATE'] + ' ' + chunk['CRASH_TIME'], format='%m/%d/%Y %H:%M')
+
+    keep = np.ones(len(chunk), dtype=bool)
+    if years is not None:
+        keep &= chunk['CRASH_DATETIME'].dt.year.isin(years).to_numpy()
+    if vehicle_types is not None:
+        keep &= chunk['VEHICLE_TYPE_CODE1'].isin(vehicle_types).to_numpy()
+    chunk = chunk[keep]
+
+    if geocoder is not None:
+        missing = (chunk['BOROUGH'].isna() | chunk['ZIP_CODE'].isna()) & chunk['LATITUDE'].notna() & chunk['LONGITUDE'].notna()
+        located = geocoder.reverse(chunk.loc[missing, 'LATITUDE'], chunk.loc[missing, 'LONGITUDE']).dropna()
+        chunk.loc[located.index, 'BOROUGH'] = located['BOROUGH']
+        chunk.loc[located.index, 'ZIP_CODE'] = located['ZIP_CODE']
+
+    chunk['BOROUGH'] = chunk['BOROUGH'].replace(BOROUGH_NAMES)
+    # some dumps store ZIP codes as floats ('10023.0')
+    chunk['ZIP_CODE'] = chunk['ZIP_CODE'].str.replace(r'\.0$', '', regex=True)
+    chunk = chunk[~chunk['BOROUGH'].isin(INVALID_BOROUGHS)].dropna()
+
+    crash = chunk['CRASH_DATETIME'].dt
+    chunk['MONTH'] = crash.month_name()
+    chunk['HOUR'] = crash.hour
+    chunk['DAY_WEEK'] = crash.day_name()
+    chunk['DAY'] = crash.day
+    chunk['CASUALTIES'] = np.where(chunk['TOTAL_INJURED'] + chunk['TOTAL_KILLED'] > 0, 'Injured or Killed', 'No Damage')
+    chunk['icon'] = np.asarray(weather.lookup(chunk['CRASH_DATETIME'], 'icon'))
+    return chunk[OUTPUT_COLUMNS]
+
+
+def partition_dir(out_dir, year, month):
+    return os.path.join(out_dir, f'year={year:04d}', f'month={month:02d}')
+
+
+def _write_part(frame, directory, chunk_index):
+    os.makedirs(directory, exist_ok=True)
+    ext = 'parquet' if pq is not None else 'csv'
+    path = os.path.join(directory, f'part-{chunk_index:05d}.{ext}')
+    tmp = path + '.tmp'
+    if pq is not None:
+        frame.to_parquet(tmp, index=False)
+    else:
+        frame.to_csv(tmp, index=False)
+    os.replace(tmp, path)
+
+
+def _partition_dirs(out_dir):
+    """``{(year, month): directory}`` of the partitions under ``out_dir``."""
+    dirs = {}
+    for directory in glob.glob(os.path.join(out_dir, 'year=*', 'month=*')):
+        try:
+            year = int(os.path.basename(os.path.dirname(directory)).split('=')[1])
+            month = int(os.path.basename(directory).split('=')[1])
+        except ValueError:
+            continue
+        dirs[year, month] = directory
+    return dirs
+
+
+def _remove_partitions(out_dir, keep=()):
+    """Delete the parts and markers of every partition but ``keep``; other files are left alone."""
+    keep = set(map(tuple, keep))
+    for partition, directory in _partition_dirs(out_dir).items():
+        if partition in keep:
+            continue
+        for path in glob.glob(os.path.join(directory, 'part-*')) + [os.path.join(directory, SUCCESS_FILE)]:
+            if os.path.exists(path):
+                os.remove(path)
+        for empty in (directory, os.path.dirname(directory)):
+            try:
+                os.rmdir(empty)
+            except OSError:  # not empty
+                break
+
+
+def _settings(config):
+    return {key: value for key, value in config.items() if key != 'inputs'}
+
+
+def _load_progress(out_dir, config, overwrite=False):
+    path = os.path.join(out_dir, PROGRESS_FILE)
+    fresh = {'config': config, 'chunks_done': 0, 'partitions': []}
+    if not os.path.exists(path):
+        return fresh
+    with open(path) as f:
+        progress = json.load(f)
+    previous = progress.get('config', {})
+    if previous == config:
+        return progress
+
+    if 'inputs' in previous and _settings(previous) == _settings(config):
+        # new input files, e.g. the dump grew by a few days: the input is read again, but the
+        # finished months are kept except the last one, which the new days may fall in
+        finished = sorted(tuple(p) for p in progress['partitions'] if os.path.exists(
+            os.path.join(partition_dir(out_dir, *p), SUCCESS_FILE)))
+        _remove_partitions(out_dir, keep=finished[:-1])
+        return dict(fresh, partitions=finished[:-1])
+
+    if not overwrite:
+        raise ValueError(f'{out_dir} holds the output of a run with other settings, '
+                         f'pass overwrite=True (--overwrite) to replace it')
+    _remove_partitions(out_dir)
+    return fresh
+
+
+def _save_progress(out_dir, progress):
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, PROGRESS_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(progress, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def run(collisions_path, weather_path, out_dir, years=None, vehicle_types=VEHICLE_TYPES,
+        chunksize=250_000, geocoder=None, overwrite=False, verbose=False):
+    """Stream ``collisions_path`` into year/month partitions under ``out_dir``.
+
+    A run with other settings than the one in ``out_dir`` raises a
+    ``ValueError`` unless ``overwrite`` is set, which deletes its partitions.
+    Returns the sorted list of ``(year, month)`` partitions written.
+    """
+    config = {
+        'inputs': {'collisions': _file_hash(collisions_path), 'weather': _file_hash(weather_path)},
+        'years': sorted(years) if years is not None else None,
+        'vehicle_types': sorted(vehicle_types) if vehicle_types is not None else None,
+        'chunksize': chunksize,
+        'geocoder': geocoder is not None,
+    }
+    progress = _load_progress(out_dir, config, overwrite)
+    done = {tuple(p) for p in progress['partitions'] if os.path.exists(
+        os.path.join(partition_dir(out_dir, *p), SUCCESS_FILE))}
+    weather = weather_icons(weather_path)
+
+    reader = pd.read_csv(collisions_path, chunksize=chunksize, dtype={'ZIP CODE': str, 'ZIP_CODE': str})
+    partitions = set(map(tuple, progress['partitions']))
+    for index, chunk in enumerate(reader):
+        if index < progress['chunks_done']:
+            continue
+        chunk = transform_chunk(chunk, weather, years, vehicle_types, geocoder)
+        crash = chunk['CRASH_DATETIME'].dt
+        for (year, month), part in chunk.groupby([crash.year, crash.month]):
+            if (year, month) in done:
+                continue
+            _write_part(part, partition_dir(out_dir, year, month), index)
+            partitions.add((int(year), int(month)))
+
+        progress['chunks_done'] = index + 1
+        progress['partitions'] = sorted(partitions)
+        _save_progress(out_dir, progress)
+        if verbose:
+            print(f'chunk {index}: {len(chunk)} rows')
+
+    for year, month in partitions:
+        open(os.path.join(partition_dir(out_dir, year, month), SUCCESS_FILE), 'w').close()
+    progress['partitions'] = sorted(partitions)
+    _save_progress(out_dir, progress)
+    return sorted(partitions)
+
+
+def read_partitions(out_dir, years=None, months=None, columns=None):
+    """Read the partitions of a pipeline run back into a single DataFrame."""
+    frames = []
+    for directory in sorted(glob.glob(os.path.join(out_dir, 'year=*', 'month=*'))):
+        year = int(os.path.basename(os.path.dirname(directory)).split('=')[1])
+        month = int(os.path.basename(directory).split('=')[1])
+        if (years is not None and year not in years) or (months is not None and month not in months):
+            continue
+        for path in sorted(glob.glob(os.path.join(directory, 'part-*'))):
+            if path.endswith('.parquet'):
+                frames.append(pd.read_parquet(path, columns=columns))
+            elif path.endswith('.csv'):
+                frames.append(pd.read_csv(path, usecols=columns, dtype={'ZIP_CODE': str},
+                                          parse_dates=['CRASH_DATETIME'] if columns is None or 'CRASH_DATETIME' in columns else None))
+    if not frames:
+        return pd.DataFrame(columns=columns or OUTPUT_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Stream the collisions dump into year/month partitions.')
+    parser.add_argument('collisions')
+    parser.add_argument('weather')
+    parser.add_argument('out_dir')
+    parser.add_argument('--years', type=int, nargs='*')
+    parser.add_argument('--chunksize', type=int, default=250_000)
+    parser.add_argument('--geojson', help='ZIP code polygons used to impute missing boroughs/ZIP codes')
+    parser.add_argument('--overwrite', action='store_true',
+                        help='replace the partitions of a run with other settings in out_dir')
+    args = parser.parse_args()
+
+    geocoder = None
+    if args.geojson:
+        from nyc_collisions.geocoder import ZipGeocoder
+        geocoder = ZipGeocoder(args.geojson)
+
+    written = run(args.collisions, args.weather, args.out_dir, years=args.years,
+                  chunksize=args.chunksize, geocoder=geocoder, overwrite=args.overwrite, verbose=True)
+    print(f'{len(written)} partitions written to {args.out_dir}')
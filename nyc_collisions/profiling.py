@@ -0,0 +1,229 @@
+"""Lightweight stage timings for the chart modules and the Streamlit apps.
+
+Code marks its stages with :func:`stage` (a context manager) or
+:func:`profiled` (a decorator)::
+
+    with stage('load', path=path):
+        frame = pd.read_csv(path)
+
+Every stage records its wall time and, when memory tracing is on, the bytes
+allocated and still alive at its end (``tracemalloc``, off by default since it
+slows Python down).  Stages nest: each record keeps its depth and parent, and
+the Chrome trace shows them as a flame graph.
+
+Records are grouped in runs (one per Streamlit rerun, see
+:meth:`Profiler.begin_run`); stages outside a run, e.g. at import time, go to
+the ``startup`` run.  The last :attr:`Profiler.max_runs` runs are kept and can
+be dumped as JSON or in the Chrome trace event format (``chrome://tracing``,
+Perfetto).  A timing costs about a microsecond, so the hooks stay in
+production code.
+"""
+
+import functools
+import itertools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict
+
+STARTUP_RUN = 'startup'
+MEMORY_ENV = 'NYC_COLLISIONS_PROFILE_MEMORY'
+
+
+class Profiler:
+    """Thread-safe store of the stage records of the last runs."""
+
+    def __init__(self, max_runs=50):
+        self.max_runs = max_runs
+        self.runs = OrderedDict()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._origin = time.perf_counter()
+        if os.environ.get(MEMORY_ENV) == '1':
+            self.trace_memory(True)
+
+    # ----------------------------- runs ------------------------------ #
+
+    def _new_run(self, run_id, label):
+        run = {'id': run_id, 'label': label, 'start': self._now(), 'duration': None, 'stages': []}
+        with self._lock:
+            self.runs[run_id] = run
+            while len(self.runs) > self.max_runs:
+                self.runs.popitem(last=False)
+        return run
+
+    def begin_run(self, label):
+        """Start a run in the calling thread; its stages are recorded under it."""
+        run = self._new_run(f'{label}-{next(self._ids)}', label)
+        self._local.run = run
+        self._local.stack = []
+        return run
+
+    def end_run(self):
+        """Close the current run of the calling thread and return it."""
+        run = getattr(self._local, 'run', None)
+        if run is not None:
+            run['duration'] = self._now() - run['start']
+            self._local.run = None
+        return run
+
+    def _current_run(self):
+        run = getattr(self._local, 'run', None)
+        if run is None:
+            with self._lock:
+                run = self.runs.get(STARTUP_RUN)
+            if run is None:
+                run = self._new_run(STARTUP_RUN, STARTUP_RUN)
+        return run
+
+    def _now(self):
+        return time.perf_counter() - self._origin
+
+    # ---------------------------- stages ----------------------------- #
+
+    @staticmethod
+    def trace_memory(enabled):
+        if enabled and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        elif not enabled and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def stage(self, name, **args):
+        return _Stage(self, name, args)
+
+    def profiled(self, name=None):
+        """Decorator recording every call of a function as a stage."""
+        def decorator(function):
+            stage_name = name or function.__qualname__
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.stage(stage_name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    # ---------------------------- reports ---------------------------- #
+
+    def run(self, run_id=None):
+        """Run ``run_id``, or the last finished one."""
+        with self._lock:
+            if run_id is not None:
+                return self.runs.get(run_id)
+            finished = [run for run in self.runs.values() if run['duration'] is not None]
+        return finished[-1] if finished else None
+
+    def breakdown(self, run):
+        """Rows ``stage, depth, calls, total_ms, max_ms, alloc_kb`` of a run, in call order.
+
+        Totals are inclusive: a stage includes the time of the stages nested in it.
+        """
+        rows = {}
+        for record in sorted(run['stages'], key=lambda record: record['start']):
+            row = rows.setdefault(record['name'], {'stage': record['name'], 'depth': record['depth'], 'calls': 0,
+                                                   'total_ms': 0.0, 'max_ms': 0.0, 'alloc_kb': None})
+            row['calls'] += 1
+            row['total_ms'] += record['duration'] * 1000
+            row['max_ms'] = max(row['max_ms'], record['duration'] * 1000)
+            if record['alloc'] is not None:
+                row['alloc_kb'] = (row['alloc_kb'] or 0) + record['alloc'] / 1024
+        return list(rows.values())
+
+    def to_json(self, runs=None):
+        runs = list(self.runs.values()) if runs is None else runs
+        return json.dumps({'pid': os.getpid(), 'runs': runs}, indent=1, default=str)
+
+    def to_chrome_trace(self, runs=None):
+        """The runs in the Chrome trace event format, one thread per run."""
+        runs = list(self.runs.values()) if runs is None else runs
+        pid = os.getpid()
+        events = []
+        for tid, run in enumerate(runs, 1):
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': run['id']}})
+            if run['duration'] is not None:
+                events.append({'name': run['label'], 'cat': 'run', 'ph': 'X', 'pid': pid, 'tid': tid,
+                               'ts': run['start'] * 1e6, 'dur': run['duration'] * 1e6})
+            for record in run['stages']:
+                args = dict(record['args'])
+                if record['alloc'] is not None:
+                    args['alloc_bytes'] = record['alloc']
+                events.append({'name': record['name'], 'cat': 'stage', 'ph': 'X', 'pid': pid, 'tid': tid,
+                               'ts': record['start'] * 1e6, 'dur': record['duration'] * 1e6, 'args': args})
+        return json.dumps({'traceEvents': events, 'displayTimeUnit': 'ms'}, default=str)
+
+    def clear(self):
+        with self._lock:
+            self.runs.clear()
+
+
+class _Stage:
+
+    __slots__ = ('profiler', 'name', 'args', 'start', 'memory')
+
+    def __init__(self, profiler, name, args):
+        self.profiler = profiler
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.profiler._stack().append(self.name)
+        self.memory = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None
+        self.start = self.profiler._now()
+        return self
+
+    def __exit__(self, *exc_info):
+        end = self.profiler._now()
+        stack = self.profiler._stack()
+        stack.pop()
+        alloc = None
+        if self.memory is not None and tracemalloc.is_tracing():
+            alloc = tracemalloc.get_traced_memory()[0] - self.memory
+        record = {'name': self.name, 'start': self.start, 'duration': end - self.start, 'depth': len(stack),
+                  'parent': stack[-1] if stack else None, 'alloc': alloc, 'args': self.args}
+        if exc_info[0] is not None:
+            record['error'] = exc_info[0].__name__
+        self.profiler._current_run()['stages'].append(record)
+        return False
+
+
+profiler = Profiler()
+stage = profiler.stage
+profiled = profiler.profiled
+
+
+def streamlit_panel(run=None, container=None):
+    """Sidebar table of the stages of a run (by default the last one) with JSON and trace downloads."""
+    import pandas as pd
+    import streamlit as st
+
+    container = container or st.sidebar
+    run = run or profiler.run()
+    if run is None:
+        container.caption('No run recorded yet.')
+        return
+
+    container.title('⏱️ Diagnostics')
+    container.caption(f"{run['id']}: {run['duration'] * 1000:.0f} ms, {len(run['stages'])} stages")
+    rows = pd.DataFrame(profiler.breakdown(run))
+    if not rows.empty:
+        rows['stage'] = ['  ' * depth + name for depth, name in zip(rows.pop('depth'), rows['stage'])]
+        container.dataframe(rows, hide_index=True, use_container_width=True)
+
+    memory = container.checkbox('Trace memory', value=tracemalloc.is_tracing(),
+                                help='Record the allocations of every stage (slows the app down).')
+    profiler.trace_memory(memory)
+
+    runs = list(profiler.runs.values())
+    container.download_button('Runs (JSON)', profiler.to_json(runs), file_name='profile.json',
+                              mime='application/json')
+    container.download_button('Chrome trace', profiler.to_chrome_trace(runs), file_name='trace.json',
+                              mime='application/json')
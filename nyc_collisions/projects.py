@@ -0,0 +1,44 @@
+"""Access to the chart modules of both projects from outside their apps.
+
+Both projects name their chart module ``altair_visualizations`` and resolve
+data paths relative to the directory their Streamlit app runs from, so tools
+(benchmarks, static export) import them under unique names and run them from
+that directory.
+"""
+
+import contextlib
+import importlib.util
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# name -> (working directory of the app, charts shown by the app)
+PROJECTS = {
+    'project1': (os.path.join(ROOT, 'Project 1', 'code'), ['c1', 'c2', 'c3', 'c4', 'c5', 'c6']),
+    'project2': (os.path.join(ROOT, 'Project 2'), ['final_chart']),
+}
+
+
+@contextlib.contextmanager
+def working_directory(path):
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+def import_charts(project):
+    """Import the ``altair_visualizations`` module of a project as ``<project>_charts``."""
+    directory, _ = PROJECTS[project]
+    name = f'{project}_charts'
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.spec_from_file_location(name, os.path.join(directory, 'altair_visualizations.py'))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    with working_directory(directory):
+        spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,577 @@
+"""Server-side execution of the leading Vega-Lite transforms of a spec.
+
+A view whose transforms reduce its rows (an ``aggregate`` of raw collisions,
+a ``filter``, a ``density`` of thousands of values) can receive the reduced
+table instead: :func:`push_down` evaluates, in pandas, the transforms at the
+start of every view's pipeline, stores the result as a new dataset and leaves
+the rest of the pipeline to the browser::
+
+    data: raw (3952 rows)                     data: reduced (48 rows)
+    transform: [aggregate, filter(param)]  ->  transform: [filter(param)]
+
+Supported: ``calculate`` and ``filter`` (see :mod:`nyc_collisions.expression`),
+``aggregate``, ``joinaggregate``, ``bin`` and ``density``, with the semantics
+of Vega (null values skipped by the aggregates, R-7 quantiles, Vega's bin step
+selection and KDE curve sampling).  A pipeline stops at the first step that is
+not supported or depends on a selection (``{"param": ...}`` filters, signals
+in expressions), and everything after it runs in the browser as before.
+
+A dataset is only replaced when that makes the spec smaller: the new tables,
+plus the original if some view still reads it, must weigh less than the
+original.  Decoding ``calculate``s (see :mod:`nyc_collisions.schema`) are
+therefore left to the browser unless an aggregate after them pays for it.
+Facet and repeat specs are left alone.
+"""
+
+import copy
+import json
+import math
+
+import numpy as np
+import pandas as pd
+
+from nyc_collisions.expression import Unsupported, column, evaluate, evaluate_mask
+from nyc_collisions.spec import _dataset_name, _dumps, _root_field, referenced_fields
+
+# rows serialized to estimate the size of a table
+SAMPLE_ROWS = 500
+# kernel terms evaluated at once by the density transform
+KDE_CHUNK = 1 << 22
+
+_CHILDREN = ('layer', 'hconcat', 'vconcat', 'concat')
+
+
+# ----------------------------- tables ------------------------------ #
+
+def to_frame(rows):
+    return pd.DataFrame.from_records(rows) if rows else pd.DataFrame()
+
+
+def _json_value(value):
+    if isinstance(value, (float, np.floating)):
+        if np.isnan(value):
+            return None
+        if np.isinf(value):
+            raise Unsupported('infinite value')
+        return int(value) if float(value).is_integer() and abs(value) < 2 ** 53 else float(value)
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.bool_):
+        return bool(value)
+    return value
+
+
+def to_records(frame):
+    """Rows of ``frame`` as JSON-ready dicts (``NaN`` as null, integral floats as ints)."""
+    columns = [[_json_value(value) for value in frame[name].tolist()] for name in frame.columns]
+    names = list(frame.columns)
+    return [dict(zip(names, row)) for row in zip(*columns)]
+
+
+def _size(frame, fields):
+    """Estimated bytes of ``frame`` in a spec, restricted to ``fields`` (``None``: all)."""
+    if fields is not None:
+        frame = frame[[name for name in frame.columns if name in fields]]
+    if not len(frame):
+        return 2
+    sample = frame.iloc[:SAMPLE_ROWS]
+    return len(_dumps(to_records(sample)).encode()) * len(frame) / len(sample)
+
+
+def _plain(field):
+    """Column name of a Vega-Lite field without nested access."""
+    if not isinstance(field, str) or _root_field(field) != field.replace('\\.', '.'):
+        raise Unsupported(f'nested field {field!r}')
+    return field.replace('\\.', '.')
+
+
+# --------------------------- aggregation ---------------------------- #
+
+def _group_ids(frame, groupby):
+    """Group of every row (numbered in order of first appearance, as Vega) and the number of groups."""
+    if not groupby:
+        return np.zeros(len(frame), dtype=np.int64), 1
+    for field in groupby:
+        value = column(frame, field)
+        if value.kind not in ('number', 'string', 'boolean') or value.missing.any():
+            raise Unsupported(f'group by {field!r} with null or mixed values')
+    ids = frame.groupby(list(groupby), sort=False).ngroup().to_numpy()
+    return ids, int(ids.max()) + 1 if len(ids) else 0
+
+
+def _undefined(values, defined):
+    return np.where(defined, values, np.nan)
+
+
+def _running_moments(v, g, n_groups):
+    """Mean and sum of squared deviations of every group, updated value by value as Vega does.
+
+    The update is vectorized over the groups: step ``j`` adds the ``j``-th
+    value of every group, so the results round exactly as in the browser.
+    """
+    mean, dev = np.zeros(n_groups), np.zeros(n_groups)
+    if not len(v):
+        return mean, dev
+    counts = np.bincount(g, minlength=n_groups)
+    if counts.max() > 1024:
+        # few large groups: a plain loop beats one NumPy step per value
+        mean, dev = mean.tolist(), dev.tolist()
+        seen = [0] * n_groups
+        for x, group in zip(v.tolist(), g.tolist()):
+            seen[group] += 1
+            delta = x - mean[group]
+            mean[group] += delta / seen[group]
+            dev[group] += delta * (x - mean[group])
+        return np.array(mean), np.array(dev)
+
+    order = np.argsort(g, kind='stable')
+    v, g = v[order], g[order]
+    rank = np.arange(len(v)) - (np.cumsum(counts) - counts)[g]
+    by_rank = np.argsort(rank, kind='stable')
+    bounds = np.searchsorted(rank[by_rank], np.arange(counts.max() + 1))
+    for j in range(counts.max()):
+        step = by_rank[bounds[j]:bounds[j + 1]]
+        groups, x = g[step], v[step]
+        delta = x - mean[groups]
+        mean[groups] += delta / (j + 1)
+        dev[groups] += delta * (x - mean[groups])
+    return mean, dev
+
+
+def _measure(frame, op, field, ids, n_groups):
+    """Vega aggregate ``op`` of ``field`` for every group."""
+    result = _group_measure(frame, op, field, ids, n_groups)
+    if np.isnan(result).any():
+        # Vega leaves the field out, which a table cannot tell from null
+        raise Unsupported(f'{op} undefined for a group')
+    return result
+
+
+def _group_measure(frame, op, field, ids, n_groups):
+    """Vega aggregate ``op`` of ``field`` for every group (``NaN`` for undefined)."""
+    if op == 'count':
+        return np.bincount(ids, minlength=n_groups).astype(float)
+    if field is None:
+        raise Unsupported(f'{op} without a field')
+
+    value = column(frame, _plain(field))
+    missing = value.missing | ((value.data == '') if value.kind == 'string' else False)
+    if op == 'missing':
+        return np.bincount(ids[missing], minlength=n_groups).astype(float)
+    if op == 'distinct':
+        if value.missing.any() or value.kind not in ('number', 'string', 'boolean'):
+            raise Unsupported('distinct of null values')  # null and undefined are counted apart
+        return pd.Series(value.data).groupby(ids).nunique().reindex(range(n_groups), fill_value=0).to_numpy(float)
+    if value.kind != 'number' and not value.missing.all():
+        raise Unsupported(f'{op} of non-numeric values')
+
+    data = value.data.astype(float) if value.kind == 'number' else np.full(len(frame), np.nan)
+    valid = ~missing & ~np.isnan(data)
+    v, g = data[valid], ids[valid]
+    counts = np.bincount(g, minlength=n_groups).astype(float)
+    if op == 'valid':
+        return counts
+    if op == 'sum':
+        return np.bincount(g, weights=v, minlength=n_groups)
+    if op == 'product':
+        return pd.Series(v).groupby(g).prod().reindex(range(n_groups), fill_value=1).to_numpy(float)
+
+    mean, dev = _running_moments(v, g, n_groups)
+    if op in ('mean', 'average'):
+        return _undefined(mean, counts > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        spread = {'variance': lambda: dev / (counts - 1), 'variancep': lambda: dev / counts,
+                  'stdev': lambda: np.sqrt(dev / (counts - 1)), 'stdevp': lambda: np.sqrt(dev / counts),
+                  'stderr': lambda: np.sqrt(dev / (counts * (counts - 1)))}
+        if op in spread:
+            return _undefined(spread[op](), counts > 1)
+
+    grouped = pd.Series(v).groupby(g)
+    quantiles = {'median': 0.5, 'q1': 0.25, 'q3': 0.75}
+    if op in quantiles:
+        result = grouped.quantile(quantiles[op])
+    elif op in ('min', 'max'):
+        result = getattr(grouped, op)()
+    else:
+        raise Unsupported(f'aggregate op {op!r}')
+    return result.reindex(range(n_groups)).to_numpy(float)
+
+
+def _measures(transform, key):
+    measures = []
+    for measure in transform[key]:
+        if 'as' not in measure:
+            raise Unsupported(f'{key} without "as"')
+        measures.append((measure['op'], measure.get('field'), measure['as']))
+    return measures
+
+
+def aggregate(frame, transform):
+    groupby = [_plain(field) for field in transform.get('groupby', [])]
+    if not groupby and not len(frame):
+        raise Unsupported('aggregate of no rows')
+    ids, n_groups = _group_ids(frame, groupby)
+    first = np.unique(ids, return_index=True)[1]
+    result = frame[groupby].iloc[first].reset_index(drop=True)
+    for op, field, name in _measures(transform, 'aggregate'):
+        result[name] = _measure(frame, op, field, ids, n_groups)
+    return result
+
+
+def joinaggregate(frame, transform):
+    groupby = [_plain(field) for field in transform.get('groupby', [])]
+    ids, n_groups = _group_ids(frame, groupby)
+    values = {name: _measure(frame, op, field, ids, n_groups)[ids] for op, field, name
+              in _measures(transform, 'joinaggregate')}
+    return frame.assign(**values)
+
+
+# ------------------------------ binning ------------------------------ #
+
+_BIN_PARAMS = {'maxbins', 'base', 'divide', 'extent', 'nice', 'minstep', 'step', 'steps'}
+
+
+def bin_steps(extent, maxbins=10, base=10, divide=(5, 2), nice=True, minstep=0, step=None, steps=None):
+    """``(start, stop, step)`` of Vega's bin transform (vega-statistics ``bin``)."""
+    lo, hi = extent
+    span = (hi - lo) or abs(lo) or 1
+    logb = np.log(base)
+    if step:
+        pass
+    elif steps:
+        target = span / maxbins
+        i = 0
+        while i < len(steps) and steps[i] < target:
+            i += 1
+        step = steps[max(0, i - 1)]
+    else:
+        level = np.ceil(np.log(maxbins) / logb)
+        step = max(minstep, base ** (np.floor(np.log(span) / logb + 0.5) - level))
+        while np.ceil(span / step) > maxbins:
+            step *= base
+        for div in divide:
+            candidate = step / div
+            if candidate >= minstep and span / candidate <= maxbins:
+                step = candidate
+
+    v = np.log(step)
+    precision = 0 if v >= 0 else int(-v / logb) + 1
+    eps = base ** (-precision - 1)
+    if nice:
+        v = np.floor(lo / step + eps) * step
+        lo = v - step if lo < v else v
+        hi = np.ceil(hi / step) * step
+    return lo, (lo + step if hi == lo else hi), step
+
+
+def bin_(frame, transform):
+    params = transform['bin']
+    params = {} if params is True else params
+    if not isinstance(params, dict) or set(params) - _BIN_PARAMS:
+        raise Unsupported(f'bin {params!r}')
+    field = _plain(transform['field'])
+    names = transform['as'] if isinstance(transform['as'], list) else [transform['as'], transform['as'] + '_end']
+
+    value = column(frame, field)
+    if value.kind != 'number' or value.missing.any() or np.isnan(value.data).any():
+        raise Unsupported('bin of null or non-numeric values')
+    extent = params.get('extent', [value.data.min(), value.data.max()] if len(frame) else None)
+    if extent is None or not all(isinstance(bound, (int, float, np.number)) for bound in extent):
+        raise Unsupported('bin extent')
+
+    options = {key: params[key] for key in _BIN_PARAMS - {'extent'} if key in params}
+    start, stop, step = bin_steps(extent, **options)
+    if (value.data < start).any() or (value.data > stop).any():
+        raise Unsupported('values outside the bin extent')
+    clipped = np.maximum(start, np.minimum(value.data, stop - step))
+    bins = start + step * np.floor(1e-14 + (clipped - start) / step)
+    return frame.assign(**{names[0]: bins, names[1]: bins + step})
+
+
+# ------------------------------ density ------------------------------ #
+
+_DENSITY_PARAMS = {'density', 'groupby', 'bandwidth', 'extent', 'minsteps', 'maxsteps', 'steps', 'counts',
+                   'cumulative', 'as'}
+_SQRT2PI = math.sqrt(2 * math.pi)
+
+
+def _kde_pdf(support, bandwidth, grid):
+    """Gaussian kernel density of ``support`` at every point of ``grid``.
+
+    The terms are summed in Vega's order; the results may still differ in the
+    last digit, where ``np.exp`` and ``Math.exp`` round differently.
+    """
+    curve = np.empty(len(grid))
+    chunk = max(1, KDE_CHUNK // max(len(support), 1))
+    for start in range(0, len(grid), chunk):
+        z = (grid[start:start + chunk, None] - support) / bandwidth
+        terms = np.exp(-0.5 * z * z) / _SQRT2PI
+        curve[start:start + chunk] = np.cumsum(terms, axis=1)[:, -1] / bandwidth / len(support)
+    return curve
+
+
+def sample_grid(extent, steps):
+    """The ``steps + 1`` abscissas where Vega samples a density shared by groups."""
+    lo, hi = extent
+    return np.array([lo] + [lo + (i / steps) * (hi - lo) for i in range(1, steps)] + [hi])
+
+
+def density(frame, transform):
+    from nyc_collisions.density import scott_bandwidth
+
+    if set(transform) - _DENSITY_PARAMS or transform.get('cumulative'):
+        raise Unsupported('density options')
+    field = _plain(transform['density'])
+    groupby = [_plain(name) for name in transform.get('groupby', [])]
+    value_as, density_as = transform.get('as', ['value', 'density'])
+
+    value = column(frame, field)
+    if value.kind != 'number' or value.missing.any() or np.isnan(value.data).any() or not len(frame):
+        raise Unsupported('density of null or non-numeric values')
+    # Vega-Lite resolves the densities as 'shared': one extent and uniform grid for all the groups
+    extent = transform.get('extent') or [value.data.min(), value.data.max()]
+    grid = sample_grid(extent, transform.get('steps') or transform.get('maxsteps', 200))
+
+    ids, n_groups = _group_ids(frame, groupby)
+    first = np.unique(ids, return_index=True)[1]
+    rows = []
+    for group in range(n_groups):
+        support = value.data[ids == group]
+        bandwidth = transform.get('bandwidth') or float(scott_bandwidth(support)[0])
+        scale = len(support) if transform.get('counts') else 1
+        curve = _kde_pdf(support, bandwidth, grid) * scale
+        keys = {name: frame[name].iloc[first[group]] for name in groupby}
+        rows += [{**keys, value_as: x, density_as: y} for x, y in zip(grid, curve)]
+    return pd.DataFrame(rows, columns=groupby + [value_as, density_as])
+
+
+# ----------------------------- filtering ----------------------------- #
+
+_COMPARISONS = {'equal': '===', 'lt': '<', 'lte': '<=', 'gt': '>', 'gte': '>='}
+
+
+def _predicate_mask(frame, predicate, parsed):
+    if isinstance(predicate, str):
+        return evaluate_mask(predicate, frame, parsed)
+    if not isinstance(predicate, dict) or 'param' in predicate:
+        raise Unsupported('selection filter')
+    if 'and' in predicate:
+        return np.logical_and.reduce([_predicate_mask(frame, p, parsed) for p in predicate['and']] + [np.ones(len(frame), bool)])
+    if 'or' in predicate:
+        return np.logical_or.reduce([_predicate_mask(frame, p, parsed) for p in predicate['or']] + [np.zeros(len(frame), bool)])
+    if 'not' in predicate:
+        return ~_predicate_mask(frame, predicate['not'], parsed)
+    if 'field' not in predicate or 'timeUnit' in predicate:
+        raise Unsupported(f'filter {predicate!r}')
+
+    datum = f'datum[{json.dumps(_plain(predicate["field"]))}]'
+    tests = []
+    for key, value in predicate.items():
+        if key == 'field':
+            continue
+        if isinstance(value, dict) or (isinstance(value, list) and any(isinstance(v, dict) for v in value)):
+            raise Unsupported('date time or signal in a field predicate')
+        if key in _COMPARISONS:
+            tests.append(f'{datum}{_COMPARISONS[key]}{json.dumps(value)}')
+        elif key == 'range':
+            low, high = value
+            tests += [f'{datum}>={json.dumps(low)}'] if low is not None else []
+            tests += [f'{datum}<={json.dumps(high)}'] if high is not None else []
+        elif key in ('oneOf', 'in'):
+            tests.append('(' + '||'.join(f'{datum}==={json.dumps(v)}' for v in value) + ')' if value else 'false')
+        elif key == 'valid':
+            tests.append(f'{"" if value else "!"}isValid({datum})')
+        else:
+            raise Unsupported(f'field predicate {key!r}')
+    return evaluate_mask('&&'.join(tests) or 'true', frame, parsed)
+
+
+def filter_(frame, transform, parsed):
+    mask = np.asarray(_predicate_mask(frame, transform['filter'], parsed), dtype=bool)
+    return frame[mask].reset_index(drop=True)
+
+
+def calculate(frame, transform, parsed):
+    return frame.assign(**{transform['as']: evaluate(transform['calculate'], frame, parsed)})
+
+
+def apply_transform(frame, transform, parsed=()):
+    """``frame`` after one Vega-Lite transform; raises :class:`Unsupported` for the browser's ones.
+
+    ``parsed`` lists the fields Vega-Lite parses at the source (temporal and
+    quantitative encodings), whose raw strings are not what the browser sees.
+    """
+    if 'calculate' in transform:
+        return calculate(frame, transform, parsed)
+    if 'filter' in transform:
+        return filter_(frame, transform, parsed)
+    if 'aggregate' in transform:
+        return aggregate(frame, transform)
+    if 'joinaggregate' in transform:
+        return joinaggregate(frame, transform)
+    if 'bin' in transform:
+        return bin_(frame, transform)
+    if 'density' in transform:
+        return density(frame, transform)
+    raise Unsupported(f'transform {next(iter(transform), None)!r}')
+
+
+# --------------------------- spec rewriting --------------------------- #
+
+def _parsed_fields(node, fields=None):
+    """Fields of temporal/quantitative encodings and time units, parsed by Vega-Lite at the source."""
+    fields = set() if fields is None else fields
+    if isinstance(node, dict):
+        if isinstance(node.get('field'), str) and (node.get('type') in ('temporal', 'quantitative') or 'timeUnit' in node):
+            fields.add(_root_field(node['field']))
+        for key, value in node.items():
+            if key != 'datasets':
+                _parsed_fields(value, fields)
+    elif isinstance(node, list):
+        for item in node:
+            _parsed_fields(item, fields)
+    return fields
+
+
+def _views(node, path, source, chain, datasets, out):
+    """Views with transforms: ``(path, dataset, transforms of their ancestors)``."""
+    data = node.get('data')
+    if data is not None:
+        named = isinstance(data, dict) and set(data) == {'name'} and data['name'] in datasets
+        source, chain = (data['name'] if named else None), []
+    transforms = node.get('transform', [])
+    if transforms and source is not None:
+        out.append((path, source, chain))
+    for key in _CHILDREN:
+        for i, child in enumerate(node.get(key, [])):
+            _views(child, path + ((key, i),), source, chain + transforms, datasets, out)
+    return out
+
+
+def _node(spec, path):
+    for key, i in path:
+        spec = spec[key][i]
+    return spec
+
+
+def _dataset_references(node, names=None):
+    names = set() if names is None else names
+    if isinstance(node, dict):
+        data = node.get('data')
+        if isinstance(data, dict) and isinstance(data.get('name'), str):
+            names.add(data['name'])
+        for key, value in node.items():
+            if key != 'datasets':
+                _dataset_references(value, names)
+    elif isinstance(node, list):
+        for item in node:
+            _dataset_references(item, names)
+    return names
+
+
+class _Evaluator:
+    """Transform chains applied to the datasets, memoized (views often share their first steps)."""
+
+    def __init__(self, datasets, parsed):
+        self.datasets = datasets
+        self.parsed = parsed
+        self.cache = {}
+
+    def run(self, source, transforms):
+        """The table after ``transforms``, or ``None`` if one is not supported."""
+        key = (source, _dumps(transforms))
+        if key not in self.cache:
+            if not transforms:
+                self.cache[key] = to_frame(self.datasets[source])
+            else:
+                before = self.run(source, transforms[:-1])
+                try:
+                    self.cache[key] = None if before is None else apply_transform(before, transforms[-1], self.parsed)
+                except Unsupported:
+                    self.cache[key] = None
+        return self.cache[key]
+
+
+def _plan(spec, views, evaluator, fields, longest=False):
+    """Best rewrite of every view: ``(path, steps pushed, table)``.
+
+    The number of steps pushed is the one with the smallest table (the most
+    steps on ties), or the most steps that can be evaluated with ``longest``.
+    """
+    plans = []
+    for path, source, chain in views:
+        if evaluator.run(source, chain) is None:
+            continue
+        transforms = _node(spec, path)['transform']
+        best = None
+        for k in range(0 if chain else 1, len(transforms) + 1):
+            table = evaluator.run(source, chain + transforms[:k])
+            if table is None:
+                break
+            size = _size(table, fields)
+            if best is None or longest or size <= best[0]:
+                best = (size, k, table)
+        if best is not None:
+            plans.append((path, best[1], best[2]))
+    return plans
+
+
+def _rewrite(spec, plans, datasets):
+    """Point every planned view to its table; returns the new ``{name: rows}``."""
+    tables = {}
+    for path, k, table in plans:
+        node = _node(spec, path)
+        rows = to_records(table)
+        name = _dataset_name(rows)
+        tables[name] = rows
+        node['data'] = {'name': name}
+        rest = node['transform'][k:]
+        if rest:
+            node['transform'] = rest
+        else:
+            del node['transform']
+    return tables
+
+
+def push_down(spec, datasets, force=False):
+    """Evaluate the leading transforms of the views of ``spec`` on the server, in place.
+
+    ``datasets`` are the top-level datasets of the spec (see
+    :func:`nyc_collisions.spec.compile_spec`); views whose pipeline can be
+    (partly) evaluated get a new dataset with the result.  The rewrite is kept
+    for a dataset only if the spec gets smaller; ``force`` keeps it anyway and
+    pushes every step the engine can evaluate.  Returns the number of
+    transforms moved out of the browser.
+    """
+    views = _views(spec, (), None, [], datasets, [])
+    if not views:
+        return 0
+    evaluator = _Evaluator(datasets, frozenset(_parsed_fields(spec)))
+    fields = referenced_fields(spec)
+
+    pushed = 0
+    for source in dict.fromkeys(source for _, source, _ in views):
+        try:
+            plans = _plan(spec, [view for view in views if view[1] == source], evaluator, fields, longest=force)
+            if not plans:
+                continue
+            candidate = copy.deepcopy(spec)
+            tables = _rewrite(candidate, plans, datasets)
+        except Unsupported:
+            continue
+
+        after_fields = referenced_fields(candidate)
+        kept = source in _dataset_references(candidate)
+        before = _size(to_frame(datasets[source]), fields)
+        after = sum(_size(to_frame(rows), after_fields) for rows in tables.values())
+        after += _size(to_frame(datasets[source]), after_fields) if kept else 0
+        if not force and after >= before:
+            continue
+
+        spec.clear()
+        spec.update(candidate)
+        datasets.update(tables)
+        if not kept:
+            del datasets[source]
+        pushed += sum(k for _, k, _ in plans)
+    return pushed
@@ -0,0 +1,129 @@
+"""Registry of lazily built, memoized chart factories.
+
+Chart modules register one factory per chart instead of building every chart
+at import time::
+
+    charts = ChartRegistry()
+
+    @charts.register('c1')
+    def build_c1(collisions):
+        ...
+
+    charts.get('c1', collisions)
+
+``get`` builds the chart the first time and then returns it from a bounded
+LRU keyed on the chart name and a fingerprint of the arguments, so the same
+data and parameters never pay the transform/build cost twice.  The
+fingerprint of a DataFrame is a hash of its contents; it is remembered per
+object, so frames are expected not to be mutated after they are passed in.
+Other inputs can provide their own content hash with a ``fingerprint()`` method.
+The registry can be used from several threads (see :mod:`nyc_collisions.warmup`).
+"""
+
+import hashlib
+import json
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from nyc_collisions.profiling import stage
+
+_frame_fingerprints = {}
+
+
+def _frame_fingerprint(frame):
+    cached = _frame_fingerprints.get(id(frame))
+    if cached is not None and cached[0]() is frame:
+        return cached[1]
+
+    digest = hashlib.sha1()
+    digest.update(repr((list(frame.columns), [str(t) for t in frame.dtypes], frame.shape)).encode())
+    digest.update(pd.util.hash_pandas_object(frame, index=True).to_numpy().tobytes())
+    value = digest.hexdigest()
+
+    key = id(frame)
+    _frame_fingerprints[key] = (weakref.ref(frame, lambda _: _frame_fingerprints.pop(key, None)), value)
+    return value
+
+
+def _update(digest, value):
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        frame = value.to_frame() if isinstance(value, pd.Series) else value
+        digest.update(b'frame:' + _frame_fingerprint(frame).encode())
+    elif hasattr(value, 'fingerprint'):
+        digest.update(b'object:' + type(value).__name__.encode() + value.fingerprint().encode())
+    elif isinstance(value, np.ndarray):
+        digest.update(b'array:' + repr((value.dtype.str, value.shape)).encode() + value.tobytes())
+    elif isinstance(value, (list, tuple)):
+        digest.update(b'seq:%d' % len(value))
+        for item in value:
+            _update(digest, item)
+    elif isinstance(value, dict):
+        digest.update(b'dict:%d' % len(value))
+        for key in sorted(value, key=repr):
+            _update(digest, key)
+            _update(digest, value[key])
+    else:
+        digest.update(b'value:' + json.dumps(value, sort_keys=True, default=repr).encode())
+
+
+def fingerprint(*args, **kwargs):
+    """Content hash of the arguments of a chart factory."""
+    digest = hashlib.sha1()
+    _update(digest, list(args))
+    _update(digest, kwargs)
+    return digest.hexdigest()
+
+
+class ChartRegistry:
+    """Named chart factories with an LRU of built charts."""
+
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self.factories = {}
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def __contains__(self, name):
+        return name in self.factories
+
+    def __iter__(self):
+        return iter(self.factories)
+
+    def register(self, name=None):
+        """Decorator registering a chart factory under ``name`` (or its function name)."""
+        def decorator(factory):
+            self.factories[name or factory.__name__] = factory
+            return factory
+        return decorator
+
+    def get(self, name, *args, **kwargs):
+        """Build the chart ``name`` for these arguments, or return the memoized one."""
+        with stage('fingerprint', chart=name):
+            key = (name, fingerprint(*args, **kwargs))
+        with self._lock:
+            if key in self._cache:
+                self.hits += 1
+                self._cache.move_to_end(key)
+                return self._cache[key]
+            self.misses += 1
+
+        with stage(f'build {name}'):
+            chart = self.factories[name](*args, **kwargs)
+        with self._lock:
+            self._cache[key] = chart
+            if len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        return chart
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self.hits = self.misses = 0
+
+    def cache_info(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._cache), 'maxsize': self.maxsize}
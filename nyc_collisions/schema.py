@@ -0,0 +1,114 @@
+"""Compact dtypes for the collision frames and dictionary-encoded chart data.
+
+:data:`COLLISIONS` maps the columns of both collision layouts to their storage
+type: the repeated strings (borough, vehicle type, contributing factor, day of
+the week, month, weather icon, casualties, ZIP code) become pandas
+categoricals and the hour/day and the casualty counts small ints.  The
+coordinates stay ``float64``: they have up to 6 decimals, which ``float32``
+rounds by up to a metre, enough to move collisions geocoded on a street
+between two ZIP polygons.  :func:`apply_schema` is applied by the loader, so
+the Parquet cache is typed as well.
+
+Charts receive the categorical columns as integer codes; the labels travel
+once per spec, as an array literal decoded by a ``calculate`` transform::
+
+    alt.Chart(frame)                  ->  encoded_chart(frame)
+    {"BOROUGH": "BROOKLYN"} per row   ->  {"BOROUGH": 1} + "... ? [...][datum.BOROUGH] : null"
+
+The decoding transform comes first, so the rest of the spec (encodings,
+filters, selections) sees the labels as before.
+"""
+
+import json
+
+import numpy as np
+import pandas as pd
+
+_CATEGORIES = ['BOROUGH', 'ZIP_CODE', 'CONTRIBUTING_FACTOR_VEHICLE1', 'CONTRIBUTING_FACTOR_VEHICLE2',
+               'VEHICLE_TYPE_CODE1', 'VEHICLE_TYPE_CODE2', 'DAY_WEEK', 'TYPE_DAY', 'MONTH', 'icon', 'CASUALTIES']
+_COUNTS = ['TOTAL_INJURED', 'TOTAL_KILLED', 'PEDESTRIANS_INJURED', 'PEDESTRIANS_KILLED',
+           'CYCLIST_INJURED', 'CYCLIST_KILLED', 'MOTORIST_INJURED', 'MOTORIST_KILLED']
+
+COLLISIONS = {
+    **{column: 'category' for column in _CATEGORIES},
+    **{column: 'int16' for column in _COUNTS},
+    'HOUR': 'int8',
+    'DAY': 'int8',
+    'YEAR': 'int16',
+}
+
+
+def apply_schema(frame, schema=COLLISIONS):
+    """Cast the columns of ``frame`` found in ``schema`` (in place) and return it.
+
+    Integer columns with missing values are left as they are.
+    """
+    for column, dtype in schema.items():
+        if column not in frame.columns or frame[column].dtype == dtype:
+            continue
+        values = frame[column]
+        if dtype != 'category' and np.dtype(dtype).kind == 'i':
+            if values.isna().any():
+                continue
+            values = pd.to_numeric(values)
+        frame[column] = values.astype(dtype)
+    return frame
+
+
+def memory_usage(frame):
+    """Bytes per column, strings included."""
+    return frame.memory_usage(index=False, deep=True)
+
+
+# --------------------------- chart payloads ---------------------------- #
+
+def encode(frame, columns=None):
+    """Replace the categorical (or listed) columns of ``frame`` by their integer codes.
+
+    Returns ``(frame, lookups)``, ``lookups`` mapping each encoded column to
+    its labels (a missing value has code -1, which decodes to ``null``).
+    """
+    frame = frame.copy()
+    if columns is None:
+        columns = [c for c in frame.columns if isinstance(frame[c].dtype, pd.CategoricalDtype)]
+
+    lookups = {}
+    for column in columns:
+        values = frame[column]
+        if not isinstance(values.dtype, pd.CategoricalDtype):
+            values = values.astype('category')
+        frame[column] = values.cat.codes
+        lookups[column] = [_label(label) for label in values.cat.categories]
+    return frame, lookups
+
+
+def _label(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def decoders(lookups):
+    """``{column: expression}`` for ``transform_calculate``, decoding the codes of :func:`encode`.
+
+    Missing values decode to ``null``, as Altair serializes them in a plain
+    chart, rather than the ``undefined`` of indexing with -1: the two are
+    grouped and labelled apart.
+    """
+    expressions = {}
+    for column, labels in lookups.items():
+        code = f'datum[{json.dumps(column)}]'
+        expressions[column] = f'{code} >= 0 ? {json.dumps(labels, ensure_ascii=False)}[{code}] : null'
+    return expressions
+
+
+def map_expression(column, mapping):
+    """Vega expression mapping the (decoded) values of ``column`` with a dict, ``undefined`` if missing."""
+    return f'{json.dumps(mapping, ensure_ascii=False)}[datum[{json.dumps(column)}]]'
+
+
+def encoded_chart(frame, columns=None, **kwargs):
+    """``alt.Chart(frame)`` fed with integer codes and decoding them first thing."""
+    import altair as alt
+
+    frame, lookups = encode(frame, columns)
+    chart = alt.Chart(frame, **kwargs)
+    return chart.transform_calculate(**decoders(lookups)) if lookups else chart
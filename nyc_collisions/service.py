@@ -0,0 +1,526 @@
+"""Local HTTP service for the chart data.
+
+Compiled specs carry their datasets inline, so every session of every
+Streamlit worker downloads them again inside the spec (close to a megabyte for
+the Project 2 dashboard).  With the service running::
+
+    python -m nyc_collisions.service --port 8765
+    NYC_COLLISIONS_DATA_URL=http://localhost:8765 streamlit run streamlit.py
+
+the apps :func:`publish` the datasets of every compiled spec to a directory
+shared with the service, and the views load them with ``{"url": ...}`` (what
+``alt.Data(url=...)`` produces).  Dataset names are content hashes, so their
+URLs are immutable: browsers cache them for good and every session, worker and
+chart that ships the same rows shares one download.
+
+The service also answers parameterized aggregate queries, for charts that
+want their data straight from a URL (see :func:`aggregate_url`; the hourly
+averages of Project 1's c3 load from ``/aggregates/daily``)::
+
+    GET /datasets/<name>.json
+    GET /aggregates/collisions?project=project2&groupby=BOROUGH,hour&month=6,7&hours=8-17
+    GET /aggregates/daily?groupby=year,hour&sum=TOTAL_KILLED&year=2018,2020
+    GET /aggregates/weather?groupby=conditions&mean=temp,precip&month=7
+
+Aggregates are filtered by ``year``, ``month`` (number or name), ``borough``,
+``vehicle`` (of the first vehicle, both case-insensitive) and ``hours`` (an
+inclusive range, ``8-17``), grouped by any column of the source or by
+``year``, ``month``, ``hour`` and ``date``, and return a ``count`` plus the
+``sum_<column>`` and ``mean_<column>`` asked for (means rounded as Vega's).
+
+Every response has a strong ``ETag`` and a ``Last-Modified`` date (of the
+data files), so clients revalidate with a 304; bodies are gzipped for clients
+that accept it, and the encoded responses are kept in an LRU bounded in bytes.
+CORS is open, since the apps are served from another port.  The sources are
+loaded on first use and kept until the service restarts.
+"""
+
+import email.utils
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+import urllib.parse
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+from nyc_collisions.projects import PROJECTS, ROOT, import_charts, working_directory
+from nyc_collisions.pushdown import _running_moments, to_records
+from nyc_collisions.spec import _dataset_name, _dumps
+
+DATA_URL_ENV = 'NYC_COLLISIONS_DATA_URL'
+DATASETS_DIR = os.path.join(ROOT, '.cache', 'datasets')
+CACHE_BYTES = 64 << 20
+# smaller bodies are sent as they are
+GZIP_MIN_BYTES = 1024
+
+_DATASET_PATH = re.compile(r'^/datasets/(data-[0-9a-f]{32})\.json$')
+_AGGREGATE_PATH = re.compile(r'^/aggregates/(\w+)$')
+
+# source -> the chart module loader, its datetime and hour columns (None: the
+# hour of the datetime), the column of pre-aggregated counts, the projects it
+# exists in and the module constants naming its data files
+SOURCES = {
+    'collisions': {'loader': 'default_collisions', 'datetime': 'CRASH_DATETIME', 'hour': None, 'weight': None,
+                   'projects': ('project1', 'project2'), 'files': ('COLLISIONS_PATH',)},
+    'daily': {'loader': 'default_daily', 'datetime': 'date', 'hour': 'HOUR', 'weight': 'collisions',
+              'projects': ('project1',), 'files': ('COLLISIONS_PATH',)},
+    'weather': {'loader': 'default_weather', 'datetime': 'datetime', 'hour': False, 'weight': None,
+                'projects': ('project1',), 'files': ('WEATHER_PATH',)},
+}
+FILTER_COLUMNS = {'borough': 'BOROUGH', 'vehicle': 'VEHICLE_TYPE_CODE1'}
+DERIVED = ('year', 'month', 'hour', 'date')
+_MONTHS = {name.lower(): number for number, name in enumerate(
+    ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October',
+     'November', 'December'], start=1)}
+
+
+class ServiceError(Exception):
+    """A request the service answers with an error ``status``."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+# ------------------------------ publishing ------------------------------ #
+
+def data_url():
+    """Base URL of the data service the charts load their data from, ``None`` if not configured."""
+    return os.environ.get(DATA_URL_ENV, '').rstrip('/') or None
+
+
+def _link(node, urls):
+    if isinstance(node, dict):
+        data = node.get('data')
+        if isinstance(data, dict) and data.get('name') in urls:
+            linked = {key: value for key, value in data.items() if key != 'name'}  # e.g. a topojson format
+            linked.setdefault('format', {'type': 'json'})
+            node['data'] = dict(linked, url=urls[data['name']])
+        for value in node.values():
+            _link(value, urls)
+    elif isinstance(node, list):
+        for item in node:
+            _link(item, urls)
+
+
+def publish(spec, base_url, directory=DATASETS_DIR):
+    """Move the top-level datasets of a compiled spec to ``directory`` and load them from
+    ``base_url`` instead (in place).  Returns the spec."""
+    datasets = spec.pop('datasets', {})
+    urls = {}
+    for name, rows in datasets.items():
+        body = _dumps(rows).encode()
+        # named by their content: the same name may hold other columns in another spec
+        published = _dataset_name(rows)
+        path = os.path.join(directory, published + '.json')
+        if not os.path.exists(path):
+            os.makedirs(directory, exist_ok=True)
+            tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(body)
+            os.replace(tmp, path)
+        urls[name] = f'{base_url}/datasets/{published}.json'
+    _link(spec, urls)
+    return spec
+
+
+def aggregate_url(source, base_url=None, **params):
+    """URL of an aggregate query, e.g. for ``alt.Data(url=..., format=alt.DataFormat(type='json'))``.
+
+    Lists are sent comma separated and a ``(lo, hi)`` tuple of ``hours`` as a range.
+    """
+    base_url = base_url or data_url()
+    if base_url is None:
+        raise ValueError(f'set {DATA_URL_ENV} to the URL of the data service')
+    query = {}
+    for key, value in params.items():
+        if value is None:
+            continue
+        if key == 'hours' and isinstance(value, tuple):
+            value = f'{value[0]}-{value[1]}'
+        elif isinstance(value, (list, tuple, set, range)):
+            value = ','.join(str(v) for v in value)
+        query[key] = str(value)
+    return f'{base_url}/aggregates/{source}' + (f'?{urllib.parse.urlencode(query, safe=",")}' if query else '')
+
+
+# ------------------------------- queries -------------------------------- #
+
+def _list(text):
+    return [value.strip() for value in text.split(',') if value.strip()]
+
+
+def _ints(text, name):
+    try:
+        return [int(value) for value in _list(text)]
+    except ValueError:
+        raise ServiceError(400, f'{name} takes integers, not {text!r}') from None
+
+
+def _months(text):
+    months = []
+    for value in _list(text):
+        month = _MONTHS.get(value.lower()) or (int(value) if value.isdigit() else None)
+        if month is None or not 1 <= month <= 12:
+            raise ServiceError(400, f'unknown month {value!r}')
+        months.append(month)
+    return months
+
+
+def _hours(text):
+    match = re.fullmatch(r'\s*(\d{1,2})\s*(?:-\s*(\d{1,2})\s*)?', text)
+    if match is None:
+        raise ServiceError(400, f'hours takes an hour or a range like 8-17, not {text!r}')
+    lo = int(match.group(1))
+    return lo, int(match.group(2) or lo)
+
+
+def _casefold_mask(values, wanted):
+    wanted = {value.casefold() for value in wanted}
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        keep = np.array([str(c).casefold() in wanted for c in values.cat.categories] + [False])
+        return keep[values.cat.codes.to_numpy()]  # code -1 (missing) takes the last entry
+    return values.astype(str).str.casefold().isin(wanted).to_numpy()
+
+
+class _Columns:
+    """The columns of a source frame, plus the ``year``/``month``/``hour``/``date`` of its datetime."""
+
+    def __init__(self, frame, info):
+        self.frame = frame
+        self.info = info
+        self._derived = {}
+
+    def __getitem__(self, name):
+        if name in DERIVED:
+            if name not in self._derived:
+                self._derived[name] = self._derive(name)
+            return self._derived[name]
+        if name not in self.frame.columns:
+            raise ServiceError(400, f'unknown column {name!r}')
+        return self.frame[name]
+
+    def _derive(self, name):
+        if name == 'hour':
+            if self.info['hour'] is False:
+                raise ServiceError(400, 'this source has no hours')
+            if self.info['hour'] is not None:
+                return self.frame[self.info['hour']]
+        times = self.frame[self.info['datetime']].dt
+        return {'year': times.year, 'month': times.month, 'hour': times.hour, 'date': times.normalize()}[name]
+
+
+def _records(table):
+    """JSON body of a result table, dates as Altair writes them."""
+    table = table.copy()
+    for column in table.columns:
+        if table[column].dtype.kind == 'M':
+            table[column] = table[column].dt.strftime('%Y-%m-%dT%H:%M:%S')
+        elif isinstance(table[column].dtype, pd.CategoricalDtype):
+            table[column] = table[column].astype(object)
+    return _dumps(to_records(table)).encode()
+
+
+def run_query(frame, info, params):
+    """Result table of the aggregate query ``params`` (a ``{name: text}`` dict) on a source frame."""
+    columns = _Columns(frame, info)
+    mask = np.ones(len(frame), dtype=bool)
+    for key, value in params.items():
+        if key in ('project', 'groupby', 'sum', 'mean'):
+            continue
+        if key == 'year':
+            mask &= columns['year'].isin(_ints(value, key)).to_numpy()
+        elif key == 'month':
+            mask &= columns['month'].isin(_months(value)).to_numpy()
+        elif key == 'hours':
+            lo, hi = _hours(value)
+            hours = columns['hour'].to_numpy()
+            mask &= (hours >= lo) & (hours <= hi)
+        elif key in FILTER_COLUMNS:
+            mask &= _casefold_mask(columns[FILTER_COLUMNS[key]], _list(value))
+        else:
+            raise ServiceError(400, f'unknown parameter {key!r}')
+
+    groupby = _list(params.get('groupby', ''))
+    data = {name: columns[name].to_numpy()[mask] for name in groupby}
+    weight = info['weight']
+    data['count'] = frame[weight].to_numpy()[mask] if weight else np.ones(int(mask.sum()), dtype=np.int64)
+    aggregations = {'count': ('count', 'sum')}
+    for op in ('sum', 'mean'):
+        for name in _list(params.get(op, '')):
+            if name not in frame.columns or frame[name].dtype.kind not in 'iufb':
+                raise ServiceError(400, f'{op} takes numeric columns, not {name!r}')
+            data[f'{op}_{name}'] = frame[name].to_numpy()[mask]
+            aggregations[f'{op}_{name}'] = (f'{op}_{name}', op)
+
+    table = pd.DataFrame(data)
+    if groupby:
+        grouped = table.groupby(groupby, sort=True, dropna=False)
+        result = grouped.agg(**aggregations).reset_index()
+        ids = grouped.ngroup().to_numpy()
+    else:
+        result = pd.DataFrame({name: [getattr(table[column], op)()] for name, (column, op) in aggregations.items()})
+        ids = np.zeros(len(table), dtype=np.int64)
+    # means accumulated value by value as in Vega, so a chart drawing them matches one averaging its rows
+    for name in _list(params.get('mean', '')):
+        values = table[f'mean_{name}'].to_numpy(float)
+        valid = ~np.isnan(values)
+        means, _ = _running_moments(values[valid], ids[valid], len(result))
+        result[f'mean_{name}'] = np.where(np.bincount(ids[valid], minlength=len(result)) > 0, means, np.nan)
+    return result
+
+
+# ------------------------------- service -------------------------------- #
+
+class Response:
+    """An encoded result with its validators."""
+
+    def __init__(self, body, last_modified, cache_control='no-cache'):
+        self.body = body
+        self.gzipped = gzip.compress(body, 6, mtime=0) if len(body) >= GZIP_MIN_BYTES else None
+        self.etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        self.last_modified = int(last_modified)
+        self.cache_control = cache_control
+
+    @property
+    def nbytes(self):
+        return len(self.body) + len(self.gzipped or b'')
+
+
+class ResultCache:
+    """Thread-safe LRU of responses, bounded by their total size in bytes."""
+
+    def __init__(self, max_bytes=CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            response = self._entries.get(key)
+            if response is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return response
+
+    def put(self, key, response):
+        if response.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            self.nbytes += response.nbytes - (previous.nbytes if previous else 0)
+            self._entries[key] = response
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+
+
+class DataService:
+    """The datasets and aggregate sources behind the HTTP handler."""
+
+    def __init__(self, datasets_dir=DATASETS_DIR, cache_bytes=CACHE_BYTES):
+        self.datasets_dir = datasets_dir
+        self.cache = ResultCache(cache_bytes)
+        self._sources = {}
+        self._lock = threading.Lock()
+
+    def get(self, path, params):
+        """Response of a request, from the cache when it was answered before."""
+        key = (path, tuple(sorted(params.items())))
+        response = self.cache.get(key)
+        if response is None:
+            response = self._answer(path, params)
+            self.cache.put(key, response)
+        return response
+
+    def _answer(self, path, params):
+        match = _DATASET_PATH.match(path)
+        if match:
+            return self.dataset(match.group(1))
+        match = _AGGREGATE_PATH.match(path)
+        if match:
+            return self.aggregate(match.group(1), params)
+        raise ServiceError(404, f'no such resource {path!r}')
+
+    def dataset(self, name):
+        path = os.path.join(self.datasets_dir, name + '.json')
+        if not os.path.exists(path):
+            raise ServiceError(404, f'no dataset {name!r}')
+        with open(path, 'rb') as f:
+            body = f.read()
+        return Response(body, os.path.getmtime(path), 'public, max-age=31536000, immutable')
+
+    def source(self, name, project):
+        """``(frame, last modified)`` of a source, loaded on first use."""
+        info = SOURCES.get(name)
+        if info is None:
+            raise ServiceError(404, f'no aggregate source {name!r}')
+        if project not in info['projects']:
+            raise ServiceError(400, f'{name} is not available for {project!r}')
+        with self._lock:  # the loaders run in the project directory, one at a time
+            if (name, project) not in self._sources:
+                module = import_charts(project)
+                with working_directory(PROJECTS[project][0]):
+                    value = getattr(module, info['loader'])()
+                    modified = max(os.path.getmtime(getattr(module, constant)) for constant in info['files'])
+                frame = value if isinstance(value, pd.DataFrame) else _weather_frame(value)
+                self._sources[name, project] = (frame, modified)
+            return self._sources[name, project]
+
+    def aggregate(self, name, params):
+        frame, modified = self.source(name, params.get('project', 'project1'))
+        return Response(_records(run_query(frame, SOURCES[name], params)), modified)
+
+
+def _weather_frame(store):
+    return pd.DataFrame({'datetime': store.times, **store.columns})
+
+
+def _etags(header):
+    return {tag.strip().removeprefix('W/') for tag in header.split(',')}
+
+
+def _accepts_gzip(header):
+    """Whether an ``Accept-Encoding`` header allows gzip; a quality that does not parse refuses it."""
+    qualities = {}
+    for item in header.split(','):
+        coding, *options = item.split(';')
+        quality = 1.0
+        for option in options:
+            key, _, value = option.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.strip().lower()] = quality
+    return qualities.get('gzip', qualities.get('*', 0.0)) > 0
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = 'nyc-collisions-data/1.0'
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self._respond(send_body=True)
+
+    def do_HEAD(self):
+        self._respond(send_body=False)
+
+    def do_OPTIONS(self):
+        self.send_response(204)
+        self._cors()
+        self.send_header('Access-Control-Allow-Methods', 'GET, HEAD, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'If-None-Match, If-Modified-Since')
+        self.send_header('Access-Control-Max-Age', '86400')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def _cors(self):
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Expose-Headers', 'ETag, Last-Modified')
+
+    def _respond(self, send_body):
+        url = urllib.parse.urlsplit(self.path)
+        params = dict(urllib.parse.parse_qsl(url.query, keep_blank_values=True))
+        try:
+            response = self.server.service.get(url.path, params)
+        except ServiceError as error:
+            return self._error(error.status, str(error), send_body)
+
+        if self._not_modified(response):
+            self.send_response(304)
+            self._validators(response)
+            self.end_headers()
+            return
+
+        body = response.body
+        gzipped = response.gzipped is not None and _accepts_gzip(self.headers.get('Accept-Encoding', ''))
+        self.send_response(200)
+        self._validators(response)
+        self.send_header('Content-Type', 'application/json')
+        if gzipped:
+            body = response.gzipped
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def _not_modified(self, response):
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            tags = _etags(if_none_match)
+            return '*' in tags or response.etag in tags
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since:
+            try:
+                since = email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return response.last_modified <= since
+        return False
+
+    def _validators(self, response):
+        self.send_header('ETag', response.etag)
+        self.send_header('Last-Modified', email.utils.formatdate(response.last_modified, usegmt=True))
+        self.send_header('Cache-Control', response.cache_control)
+        self.send_header('Vary', 'Accept-Encoding')
+        self._cors()
+
+    def _error(self, status, message, send_body):
+        body = json.dumps({'error': message}).encode()
+        self.send_response(status)
+        self._cors()
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+
+def make_server(host='127.0.0.1', port=8765, service=None, quiet=False):
+    """HTTP server (not started) answering from ``service``, one thread per request."""
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    server.service = service or DataService()
+    server.quiet = quiet
+    return server
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Serve the chart datasets and collision aggregates over HTTP.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--datasets', default=DATASETS_DIR, help='directory the apps publish their datasets to')
+    parser.add_argument('--cache-mb', type=float, default=CACHE_BYTES / 2 ** 20, help='size of the result cache')
+    parser.add_argument('--quiet', action='store_true', help='do not log every request')
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, DataService(args.datasets, int(args.cache_mb * 2 ** 20)), args.quiet)
+    print(f'serving on http://{args.host}:{server.server_port} (set {DATA_URL_ENV} to this URL)')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
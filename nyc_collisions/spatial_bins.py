@@ -0,0 +1,181 @@
+"""Level-of-detail aggregation of collision points: square grid, hexbin, raster.
+
+Points are binned in a Web Mercator plane (longitude, Mercator latitude, both
+in degrees), the same plane the map is drawn in, so square cells and hexagons
+keep their shape on screen.  The bin size is derived from the pixel size of
+the map and a ``zoom`` factor: every cell covers about :data:`CELL_PIXELS`
+pixels at ``zoom=1`` and gets smaller as the zoom grows.
+
+:func:`aggregate` keeps a set of attribute columns next to the cell centers so
+that cells can still be colored by borough and filtered by the dashboard
+selections; :func:`rasterize` goes one step further, as datashader does, and
+turns the points into an RGBA image encoded as PNG with the standard library.
+"""
+
+import base64
+import struct
+import zlib
+
+import numpy as np
+import pandas as pd
+
+# above this many points the scatter map is replaced by aggregated cells
+POINTS_LIMIT = 100_000
+CELL_PIXELS = 6
+# SVG paths in the [-1, 1] square, as used by Vega custom symbol shapes
+SHAPES = {
+    'hexbin': 'M0,-1L0.866,-0.5L0.866,0.5L0,1L-0.866,0.5L-0.866,-0.5Z',
+    'grid': 'square',
+}
+# Vega's 'dark2' scheme, the map colors of the boroughs
+DARK2 = ['#1b9e77', '#d95f02', '#7570b3', '#e7298a', '#66a61e', '#e6ab02', '#a6761d', '#666666']
+
+
+def mercator_y(lat):
+    lat = np.radians(np.asarray(lat, dtype=float))
+    return np.degrees(np.log(np.tan(np.pi / 4 + lat / 2)))
+
+
+def inverse_mercator_y(y):
+    y = np.radians(np.asarray(y, dtype=float))
+    return np.degrees(2 * np.arctan(np.exp(y)) - np.pi / 2)
+
+
+def extent(lat, lon):
+    """``(x0, y0, x1, y1)`` of the points in the Mercator plane."""
+    y = mercator_y(lat)
+    return float(np.min(lon)), float(np.min(y)), float(np.max(lon)), float(np.max(y))
+
+
+def fit_bounds(bounds, width, height):
+    """``bounds`` grown around their center to the ``width``/``height`` aspect ratio.
+
+    This is the area a Vega ``fit`` projection of ``bounds`` shows in a view of
+    that size, so an image of these bounds lines up with the map.
+    """
+    x0, y0, x1, y1 = bounds
+    scale = max((x1 - x0) / width, (y1 - y0) / height)
+    cx, cy = (x0 + x1) / 2, (y0 + y1) / 2
+    return cx - scale * width / 2, cy - scale * height / 2, cx + scale * width / 2, cy + scale * height / 2
+
+
+def cell_size(bounds, width, height, zoom=1.0, cell_pixels=CELL_PIXELS):
+    """Bin size (Mercator degrees) of ``cell_pixels`` pixels on a ``width`` x ``height`` map."""
+    x0, y0, x1, y1 = bounds
+    # the projection is fitted to the map, so the longest side sets the scale
+    degrees_per_pixel = max((x1 - x0) / width, (y1 - y0) / height)
+    return degrees_per_pixel * cell_pixels / zoom
+
+
+def square_centers(x, y, size):
+    """Center of the square cell of side ``size`` containing each point."""
+    return (np.floor(x / size) + 0.5) * size, (np.floor(y / size) + 0.5) * size
+
+
+def hex_centers(x, y, size):
+    """Center of the pointy-top hexagon of width ``size`` containing each point."""
+    radius = size / np.sqrt(3)
+    q = (np.sqrt(3) / 3 * x - y / 3) / radius
+    r = (2 / 3 * y) / radius
+
+    # round the cube coordinates (q, r, -q-r) to the nearest hexagon
+    s = -q - r
+    rq, rr, rs = np.rint(q), np.rint(r), np.rint(s)
+    dq, dr, ds = np.abs(rq - q), np.abs(rr - r), np.abs(rs - s)
+    fix_q = (dq > dr) & (dq > ds)
+    fix_r = ~fix_q & (dr > ds)
+    rq = np.where(fix_q, -rr - rs, rq)
+    rr = np.where(fix_r, -rq - rs, rr)
+
+    return radius * np.sqrt(3) * (rq + rr / 2), radius * 1.5 * rr
+
+
+def aggregate(frame, method='hexbin', size=None, keep=(), lat='LATITUDE', lon='LONGITUDE',
+              weight=None, zoom=1.0, width=350, height=400):
+    """Count the points of ``frame`` per cell and per combination of ``keep`` columns.
+
+    Returns a frame ``keep + [lat, lon, 'count']`` with the cell centers in
+    degrees, one row per non-empty (cell, attributes) combination.  ``size``
+    defaults to :func:`cell_size` for the extent of the points.
+    """
+    frame = frame.dropna(subset=[lat, lon])
+    x = frame[lon].to_numpy(dtype=float)
+    y = mercator_y(frame[lat].to_numpy())
+    if size is None:
+        size = cell_size(extent(frame[lat], frame[lon]), width, height, zoom)
+
+    centers = hex_centers if method == 'hexbin' else square_centers
+    cx, cy = centers(x, y, size)
+    cells = frame[list(keep)].assign(**{
+        lat: inverse_mercator_y(cy).round(6),
+        lon: cx.round(6),
+        'count': frame[weight].to_numpy() if weight else 1,
+    })
+    return cells.groupby(list(keep) + [lat, lon], observed=True, sort=False)['count'].sum().reset_index()
+
+
+def rasterize(lat, lon, categories=None, bounds=None, width=350, height=400, palette=DARK2, weights=None):
+    """RGBA image ``(height, width, 4)`` of the points, datashader style.
+
+    Each pixel takes the color of its most frequent category (indices into
+    ``palette``) and an opacity that grows with the log of its count.  The
+    image covers ``bounds`` (Mercator plane, see :func:`extent`), north up.
+    """
+    lat, lon = np.asarray(lat, dtype=float), np.asarray(lon, dtype=float)
+    x0, y0, x1, y1 = bounds if bounds is not None else extent(lat, lon)
+    categories = np.zeros(len(lat), dtype=np.int64) if categories is None else np.asarray(categories)
+    n_categories = len(palette)
+
+    y = mercator_y(lat)
+    # the bounds are inclusive: the points on the east and south edges go to the last column and row
+    inside = (lon >= x0) & (lon <= x1) & (y >= y0) & (y <= y1)
+    col = np.minimum(((lon[inside] - x0) / (x1 - x0) * width).astype(np.int64), width - 1)
+    row = np.minimum(((y1 - y[inside]) / (y1 - y0) * height).astype(np.int64), height - 1)
+    pixel = row * width + col
+
+    counts = np.bincount(pixel * n_categories + categories[inside] % n_categories,
+                         weights=None if weights is None else np.asarray(weights)[inside],
+                         minlength=width * height * n_categories).reshape(height, width, n_categories)
+    total = counts.sum(axis=2)
+    dominant = counts.argmax(axis=2)
+
+    colors = np.array([[int(c[i:i + 2], 16) for i in (1, 3, 5)] for c in palette], dtype=np.uint8)
+    image = np.zeros((height, width, 4), dtype=np.uint8)
+    image[..., :3] = colors[dominant]
+    if total.max() > 0:
+        alpha = np.log1p(total) / np.log1p(total.max())
+        image[..., 3] = np.where(total > 0, 64 + 191 * alpha, 0).astype(np.uint8)
+    return image
+
+
+def _png_chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+
+def png_bytes(image):
+    """Encode an RGBA ``uint8`` array as PNG."""
+    height, width, _ = image.shape
+    # every scanline starts with its filter type (0, none)
+    raw = np.hstack([np.zeros((height, 1), dtype=np.uint8), image.reshape(height, -1)]).tobytes()
+    return (b'\x89PNG\r\n\x1a\n'
+            + _png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0))
+            + _png_chunk(b'IDAT', zlib.compress(raw, 9))
+            + _png_chunk(b'IEND', b''))
+
+
+def data_url(image):
+    return 'data:image/png;base64,' + base64.b64encode(png_bytes(image)).decode()
+
+
+def raster_frame(frame, category, bounds=None, lat='LATITUDE', lon='LONGITUDE', width=350, height=400,
+                 palette=DARK2):
+    """One-row frame with the PNG data URL of the whole view, for a ``mark_image`` layer.
+
+    ``bounds`` are those the map projection is fitted to (by default the extent
+    of the points); the image covers the ``width`` x ``height`` view.
+    """
+    frame = frame.dropna(subset=[lat, lon])
+    codes, _ = pd.factorize(frame[category], sort=True)
+    bounds = fit_bounds(bounds or extent(frame[lat], frame[lon]), width, height)
+    image = rasterize(frame[lat], frame[lon], codes, bounds, width, height, palette)
+    return pd.DataFrame({'url': [data_url(image)]})
@@ -0,0 +1,210 @@
+"""Uniform grid index over collision points for spatial queries.
+
+Points are bucketed into square cells of the (longitude, latitude) plane and
+stored in compressed sparse row form: the row ids of cell ``c`` are
+``rows[offsets[c]:offsets[c + 1]]``, with their coordinates next to them in
+the same order.  A query only reads the cells it overlaps: the cells entirely
+inside the region are taken whole and only the points of the cells on its
+boundary are tested, with vectorized numpy.  So a map brush costs the points
+under the rectangle instead of a scan of every row::
+
+    index = GridIndex(collisions['LATITUDE'], collisions['LONGITUDE'])
+    rows = index.bbox(40.70, -74.02, 40.75, -73.97)     # row ids
+    index.bbox_count(40.70, -74.02, 40.75, -73.97)      # without gathering them
+    index.radius(40.758, -73.9855, 500)                  # within 500 m of Times Square
+    index.polygon(rings)                                 # GeoJSON rings, (lon, lat)
+    crossfilter.filter_mask('map', index.mask(rows))
+
+Row ids come out in cell order; points with a missing coordinate are not
+indexed and match no query.
+"""
+
+import numpy as np
+
+# mean radius, meters
+EARTH_RADIUS = 6_371_008.8
+POINTS_PER_CELL = 32
+MAX_CELLS = 1 << 22
+
+
+def haversine(lat0, lon0, lat1, lon1):
+    """Great-circle distance in meters."""
+    lat0, lon0, lat1, lon1 = (np.radians(np.asarray(v, dtype=float)) for v in (lat0, lon0, lat1, lon1))
+    a = np.sin((lat1 - lat0) / 2) ** 2 + np.cos(lat0) * np.cos(lat1) * np.sin((lon1 - lon0) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1)))
+
+
+def points_in_polygon(lat, lon, rings):
+    """Mask of the points inside a polygon given as GeoJSON rings of ``(lon, lat)``
+    (the first one the exterior, the others holes), by the even-odd rule."""
+    lat, lon = np.asarray(lat, dtype=float), np.asarray(lon, dtype=float)
+    inside = np.zeros(len(lat), dtype=bool)
+    for ring in rings:
+        ring = np.asarray(ring, dtype=float)
+        # one pass per edge, vectorized over the points
+        for (xa, ya), (xb, yb) in zip(ring, np.roll(ring, -1, axis=0)):
+            crosses = np.flatnonzero((ya > lat) != (yb > lat))
+            if len(crosses):
+                x = xa + (lat[crosses] - ya) * (xb - xa) / (yb - ya)
+                inside[crosses[lon[crosses] < x]] ^= True
+    return inside
+
+
+def _ranges(starts, ends):
+    """Concatenation of ``arange(start, end)`` over the pairs, without a Python loop."""
+    lengths = ends - starts
+    firsts = np.cumsum(lengths) - lengths
+    return np.repeat(starts - firsts, lengths) + np.arange(int(lengths.sum()))
+
+
+class GridIndex:
+    """Points in a uniform grid of ``cell_size`` degrees, stored cell by cell (CSR).
+
+    By default the cells hold about :data:`POINTS_PER_CELL` points each on
+    average.  ``weights`` (e.g. the count of aggregated cells) are what
+    :meth:`bbox_count` adds up.
+    """
+
+    def __init__(self, lat, lon, cell_size=None, weights=None, points_per_cell=POINTS_PER_CELL):
+        lat = np.asarray(lat, dtype=float)
+        lon = np.asarray(lon, dtype=float)
+        self.n = len(lat)
+        ids = np.flatnonzero(np.isfinite(lat) & np.isfinite(lon))
+
+        if len(ids):
+            self.origin = (float(lat[ids].min()), float(lon[ids].min()))
+            spans = (float(lat[ids].max()) - self.origin[0], float(lon[ids].max()) - self.origin[1])
+        else:
+            self.origin, spans = (0.0, 0.0), (0.0, 0.0)
+        if cell_size is None:
+            cell_size = np.sqrt(spans[0] * spans[1] * points_per_cell / max(len(ids), 1))
+        # coincident or aligned points: any positive size will do
+        cell_size = max(cell_size, spans[0] / 1024, spans[1] / 1024, 1e-9)
+        while (int(spans[0] / cell_size) + 1) * (int(spans[1] / cell_size) + 1) > MAX_CELLS:
+            cell_size *= 2
+        self.cell_size = float(cell_size)
+        self.shape = (int(spans[0] / self.cell_size) + 1, int(spans[1] / self.cell_size) + 1)
+
+        cells = self._row(lat[ids]) * self.shape[1] + self._col(lon[ids])
+        order = np.argsort(cells, kind='stable')
+        cells = cells[order]
+        self.rows = ids[order]
+        self.lat = lat[self.rows]
+        self.lon = lon[self.rows]
+        n_cells = self.shape[0] * self.shape[1]
+        self.offsets = np.zeros(n_cells + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cells, minlength=n_cells), out=self.offsets[1:])
+
+        # summed-area table of the weight of the cells, for counts without gathering the rows
+        self.weights = None if weights is None else np.asarray(weights)[self.rows]
+        totals = np.bincount(cells, weights=self.weights, minlength=n_cells).reshape(self.shape)
+        if self.weights is None or np.issubdtype(self.weights.dtype, np.integer):
+            totals = np.rint(totals).astype(np.int64)
+        self._summed = np.zeros((self.shape[0] + 1, self.shape[1] + 1), dtype=totals.dtype)
+        self._summed[1:, 1:] = totals.cumsum(axis=0).cumsum(axis=1)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _row(self, lat):
+        return np.clip(np.floor((lat - self.origin[0]) / self.cell_size), 0, self.shape[0] - 1).astype(np.int64)
+
+    def _col(self, lon):
+        return np.clip(np.floor((lon - self.origin[1]) / self.cell_size), 0, self.shape[1] - 1).astype(np.int64)
+
+    def _span(self, lat0, lon0, lat1, lon1):
+        """Rows and columns of the cells that may hold points of the box, ``None`` if none."""
+        lat0, lat1 = sorted((float(lat0), float(lat1)))
+        lon0, lon1 = sorted((float(lon0), float(lon1)))
+        top = (self.origin[0] + self.shape[0] * self.cell_size, self.origin[1] + self.shape[1] * self.cell_size)
+        if not len(self) or lat1 < self.origin[0] or lon1 < self.origin[1] or lat0 > top[0] or lon0 > top[1]:
+            return None
+        return (int(self._row(lat0)), int(self._row(lat1))), (int(self._col(lon0)), int(self._col(lon1)))
+
+    def _positions(self, rows, cols):
+        """Positions in the index of the points of a block of cells."""
+        # the cells of a grid row are contiguous: one range per row
+        starts = np.arange(rows[0], rows[1] + 1) * self.shape[1] + cols[0]
+        return _ranges(self.offsets[starts], self.offsets[starts + cols[1] - cols[0] + 1])
+
+    def _boundary(self, rows, cols):
+        """Positions of the points of the first and last row and column of a block of cells."""
+        (r0, r1), (c0, c1) = rows, cols
+        blocks = [((r0, r0), cols)]
+        if r1 > r0:
+            blocks.append(((r1, r1), cols))
+        if r1 - r0 > 1:
+            blocks.append(((r0 + 1, r1 - 1), (c0, c0)))
+            if c1 > c0:
+                blocks.append(((r0 + 1, r1 - 1), (c1, c1)))
+        return np.concatenate([self._positions(r, c) for r, c in blocks])
+
+    # ---------------------------- queries ---------------------------- #
+
+    def bbox(self, lat0, lon0, lat1, lon1):
+        """Row ids of the points with ``lat0 <= lat <= lat1`` and ``lon0 <= lon <= lon1``."""
+        span = self._span(lat0, lon0, lat1, lon1)
+        if span is None:
+            return np.zeros(0, dtype=np.int64)
+        (r0, r1), (c0, c1) = span
+        lat0, lat1 = sorted((lat0, lat1))
+        lon0, lon1 = sorted((lon0, lon1))
+        # cells strictly between the ones of the bounds are inside the box
+        inner = self._positions((r0 + 1, r1 - 1), (c0 + 1, c1 - 1)) if r1 - r0 > 1 and c1 - c0 > 1 else \
+            np.zeros(0, dtype=np.int64)
+        edge = self._boundary((r0, r1), (c0, c1))
+        keep = (self.lat[edge] >= lat0) & (self.lat[edge] <= lat1) & (self.lon[edge] >= lon0) & (self.lon[edge] <= lon1)
+        return self.rows[np.concatenate([inner, edge[keep]])]
+
+    def bbox_count(self, lat0, lon0, lat1, lon1):
+        """Number (or total weight) of the points of :meth:`bbox`, reading only its edge cells."""
+        span = self._span(lat0, lon0, lat1, lon1)
+        if span is None:
+            return 0
+        (r0, r1), (c0, c1) = span
+        lat0, lat1 = sorted((lat0, lat1))
+        lon0, lon1 = sorted((lon0, lon1))
+        total = 0
+        if r1 - r0 > 1 and c1 - c0 > 1:
+            s = self._summed
+            total = s[r1, c1] - s[r0 + 1, c1] - s[r1, c0 + 1] + s[r0 + 1, c0 + 1]
+        edge = self._boundary((r0, r1), (c0, c1))
+        keep = (self.lat[edge] >= lat0) & (self.lat[edge] <= lat1) & (self.lon[edge] >= lon0) & (self.lon[edge] <= lon1)
+        total += keep.sum() if self.weights is None else self.weights[edge[keep]].sum()
+        return total.item() if hasattr(total, 'item') else total
+
+    def radius(self, lat, lon, meters):
+        """Row ids of the points within ``meters`` (great-circle) of ``(lat, lon)``."""
+        dlat = np.degrees(meters / EARTH_RADIUS)
+        dlon = dlat / max(np.cos(np.radians(min(abs(lat) + dlat, 90.0))), 1e-12)
+        span = self._span(lat - dlat, lon - dlon, lat + dlat, lon + dlon)
+        if span is None:
+            return np.zeros(0, dtype=np.int64)
+        (r0, r1), (c0, c1) = span
+        rows, cols = np.meshgrid(np.arange(r0, r1 + 1), np.arange(c0, c1 + 1), indexing='ij')
+        # a cell whose farthest corner is in the circle is inside it (less a rounding margin)
+        far = np.max([haversine(lat, lon, self.origin[0] + (rows + i) * self.cell_size,
+                                self.origin[1] + (cols + j) * self.cell_size)
+                      for i in (0, 1) for j in (0, 1)], axis=0)
+        inner = (far <= meters * (1 - 1e-9)).ravel()
+        cells = (rows * self.shape[1] + cols).ravel()
+        positions = _ranges(self.offsets[cells], self.offsets[cells + 1])
+        tested = np.repeat(~inner, self.offsets[cells + 1] - self.offsets[cells])
+        keep = ~tested
+        keep[tested] = haversine(lat, lon, self.lat[positions[tested]], self.lon[positions[tested]]) <= meters
+        return self.rows[positions[keep]]
+
+    def polygon(self, rings):
+        """Row ids of the points inside a polygon of GeoJSON rings (``(lon, lat)``, holes after the exterior)."""
+        exterior = np.asarray(rings[0], dtype=float)
+        span = self._span(exterior[:, 1].min(), exterior[:, 0].min(), exterior[:, 1].max(), exterior[:, 0].max())
+        if span is None:
+            return np.zeros(0, dtype=np.int64)
+        positions = self._positions(*span)
+        return self.rows[positions[points_in_polygon(self.lat[positions], self.lon[positions], rings)]]
+
+    def mask(self, rows):
+        """Boolean mask over the ``n`` indexed rows of some row ids, e.g. for :meth:`Crossfilter.filter_mask`."""
+        mask = np.zeros(self.n, dtype=bool)
+        mask[rows] = True
+        return mask
@@ -0,0 +1,216 @@
+"""Vega-Lite spec post-processing: shared datasets and column projection.
+
+Altair inlines the DataFrame of every chart, so a dashboard built from a few
+frames ships the same rows several times and every column of each frame,
+whether a view uses it or not.  :func:`compile_spec`
+
+1. hoists inline ``data.values`` into the top-level ``datasets``,
+2. evaluates on the server the leading transforms of the views when that
+   makes the spec smaller (see :mod:`nyc_collisions.pushdown`),
+3. drops the dataset columns that no encoding, transform, selection or
+   expression of the spec references, and
+4. merges datasets that end up identical (typically the same frame passed to
+   several layers with a different column subset),
+
+and reports the size of the spec before and after.
+
+Projection is conservative: fields are collected over the whole spec (not per
+view, since selections filter across views), and it is skipped altogether when
+the spec could show arbitrary fields (``tooltip: true``/``{"content": "data"}``)
+or uses constructs whose field references are not tracked (``repeat``).
+"""
+
+import hashlib
+import json
+import re
+
+from nyc_collisions.profiling import stage
+
+_DATUM_FIELD = re.compile(r'datum\s*\.\s*([A-Za-z_$][\w$]*)|datum\s*\[\s*([\'"])(.+?)\2\s*\]')
+
+# transform keys whose value is a field name (or a list of them)
+_FIELD_KEYS = {'field', 'groupby', 'fields', 'density', 'regression', 'loess', 'on', 'pivot', 'value',
+               'impute', 'key', 'quantile', 'fold', 'flatten', 'lookup', 'sort'}
+_EXPRESSION_KEYS = {'calculate', 'filter', 'test', 'expr'}
+_UNSUPPORTED_KEYS = {'repeat'}
+
+
+def _dumps(spec):
+    return json.dumps(spec, separators=(',', ':'), sort_keys=False, default=str)
+
+
+def _root_field(name):
+    """``'a.b'`` -> ``'a'``, ``'a\\.b'`` -> ``'a.b'``, ``'a[0]'`` -> ``'a'``."""
+    root = re.split(r'(?<!\\)[.\[]', name, maxsplit=1)[0]
+    return root.replace('\\.', '.')
+
+
+class _FieldCollector:
+    def __init__(self):
+        self.fields = set()
+        self.complete = True
+
+    def visit(self, node, key=None):
+        if isinstance(node, dict):
+            if node.get('tooltip') is True or node.get('tooltip') == {'content': 'data'}:
+                self.complete = False
+            for k, value in node.items():
+                if k in ('datasets', 'values') or (k == 'data' and isinstance(value, dict) and 'values' in value):
+                    continue
+                if k in _UNSUPPORTED_KEYS:
+                    self.complete = False
+                if k in _FIELD_KEYS:
+                    self._fields(value)
+                if k in _EXPRESSION_KEYS or (k == 'signal' and isinstance(value, str)):
+                    self._expression(value)
+                self.visit(value, k)
+        elif isinstance(node, list):
+            for item in node:
+                self.visit(item, key)
+        elif isinstance(node, str) and 'datum' in node:
+            self._expression(node)
+
+    def _fields(self, value):
+        if isinstance(value, str):
+            self.fields.add(_root_field(value))
+        elif isinstance(value, list):
+            for item in value:
+                self._fields(item)
+        elif isinstance(value, dict) and 'field' in value:
+            self._fields(value['field'])
+
+    def _expression(self, value):
+        if isinstance(value, str):
+            for match in _DATUM_FIELD.finditer(value):
+                self.fields.add(match.group(1) or match.group(3))
+        elif isinstance(value, dict):
+            for item in value.values():
+                self._expression(item)
+
+
+def referenced_fields(spec):
+    """Fields referenced anywhere in ``spec``, or ``None`` if it cannot be known."""
+    collector = _FieldCollector()
+    collector.visit(spec)
+    return collector.fields if collector.complete else None
+
+
+def chart_to_dict(chart):
+    """``chart.to_dict()`` without Altair's 5000-row limit (as Streamlit does)."""
+    import altair as alt
+
+    with stage('to_dict'), alt.data_transformers.enable('default', max_rows=None):
+        return chart.to_dict()
+
+
+def _dataset_name(values):
+    return 'data-' + hashlib.md5(_dumps(values).encode()).hexdigest()
+
+
+def _hoist(node, datasets):
+    """Move inline ``data.values`` arrays into ``datasets`` (in place)."""
+    if isinstance(node, dict):
+        data = node.get('data')
+        if isinstance(data, dict) and isinstance(data.get('values'), list) and 'format' not in data:
+            name = _dataset_name(data['values'])
+            datasets.setdefault(name, data['values'])
+            node['data'] = {'name': name}
+        for key, value in node.items():
+            if key != 'datasets':
+                _hoist(value, datasets)
+    elif isinstance(node, list):
+        for item in node:
+            _hoist(item, datasets)
+
+
+def _rename(node, names):
+    if isinstance(node, dict):
+        data = node.get('data')
+        if isinstance(data, dict) and data.get('name') in names:
+            node['data'] = dict(data, name=names[data['name']])
+        for key, value in node.items():
+            if key != 'datasets':
+                _rename(value, names)
+    elif isinstance(node, list):
+        for item in node:
+            _rename(item, names)
+
+
+def _project(rows, fields):
+    if not isinstance(rows, list) or not rows or not isinstance(rows[0], dict):
+        return rows, set()
+    columns = set().union(*(row.keys() for row in rows))
+    dropped = columns - fields
+    if not dropped:
+        return rows, set()
+    return [{k: v for k, v in row.items() if k in fields} for row in rows], dropped
+
+
+def compile_spec(chart, project=True, pushdown=True):
+    """Compile an Altair chart (or a Vega-Lite dict) into a compact spec.
+
+    Returns ``(spec, report)`` where ``report`` has the byte size of the spec
+    before and after, the number of datasets, the number of transforms
+    evaluated on the server and the columns dropped from each dataset.
+    """
+    spec = chart_to_dict(chart) if hasattr(chart, 'to_dict') else json.loads(_dumps(chart))
+    bytes_before = len(_dumps(spec).encode())
+
+    datasets = dict(spec.pop('datasets', {}))
+    n_before = len(datasets) + _count_inline(spec)
+    _hoist(spec, datasets)
+
+    pushed = 0
+    if pushdown:
+        from nyc_collisions.pushdown import push_down
+
+        with stage('pushdown'):
+            pushed = push_down(spec, datasets)
+
+    dropped = {}
+    fields = referenced_fields(spec) if project else None
+    if fields is not None:
+        for name, rows in datasets.items():
+            datasets[name], dropped_columns = _project(rows, fields)
+            if dropped_columns:
+                dropped[name] = sorted(dropped_columns)
+
+    # identical datasets (after projection) are stored once
+    by_content, renames, merged = {}, {}, {}
+    for name, rows in datasets.items():
+        new_name = by_content.setdefault(_dataset_name(rows), name)
+        renames[name] = new_name
+        merged.setdefault(new_name, rows)
+    _rename(spec, {old: new for old, new in renames.items() if old != new})
+
+    if merged:
+        spec['datasets'] = merged
+    report = {
+        'bytes_before': bytes_before,
+        'bytes_after': len(_dumps(spec).encode()),
+        'datasets_before': n_before,
+        'datasets_after': len(merged),
+        'pushed_transforms': pushed,
+        'dropped_columns': dropped,
+    }
+    return spec, report
+
+
+def _count_inline(node):
+    if isinstance(node, dict):
+        data = node.get('data')
+        own = int(isinstance(data, dict) and isinstance(data.get('values'), list) and 'format' not in data)
+        return own + sum(_count_inline(v) for k, v in node.items() if k != 'datasets')
+    if isinstance(node, list):
+        return sum(_count_inline(item) for item in node)
+    return 0
+
+
+def format_report(report):
+    saved = 1 - report['bytes_after'] / report['bytes_before'] if report['bytes_before'] else 0
+    text = (f"{report['bytes_before'] / 1024:.1f} KB -> {report['bytes_after'] / 1024:.1f} KB "
+            f"({saved:.0%} smaller), {report['datasets_before']} -> {report['datasets_after']} datasets")
+    if report.get('pushed_transforms'):
+        text += f", {report['pushed_transforms']} transforms evaluated on the server"
+    return text
+
@@ -0,0 +1,123 @@
+"""Background warm-up of the charts of a Streamlit app.
+
+Importing a chart module pulls in pandas and Altair, and its first chart loads
+the data: the page used to stay blank for all of it.  With :class:`Warmup` an
+app renders its layout, with a placeholder per chart, before touching the
+module, and fills the placeholders as the charts come out of a thread pool::
+
+    warmup = streamlit_warmup('altair_visualizations')
+    futures = {name: warmup.spec(name) for name in names}   # starts the work
+    slots = {name: st.empty() for name in names}             # the layout
+    for name, spec in warmup.completed(futures):
+        slots[name].vega_lite_chart(spec)
+
+Tasks are memoized per server process, so only the first session after a
+start waits; a task that failed is submitted again on the next request.  The
+data loaders of the module (its ``default_*`` functions) share the Parquet and
+aggregate caches on disk, so they run one at a time; building and compiling
+the charts runs in parallel.  Streamlit calls stay in the script thread.
+"""
+
+import importlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from nyc_collisions.profiling import profiler, stage
+
+WARMUP_RUN = 'warmup'
+
+
+class Warmup:
+    """Thread pool building the charts of a chart module, each task once."""
+
+    def __init__(self, module, workers=None):
+        self.module_name = module
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self.futures = {}
+        self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix='warmup')
+        self._lock = threading.Lock()
+        self._data_lock = threading.Lock()
+
+    def module(self):
+        """The chart module, imported on first use."""
+        return importlib.import_module(self.module_name)
+
+    def submit(self, key, function, *args):
+        """Future of ``function(*args)``, run once per ``key``."""
+        with self._lock:
+            future = self.futures.get(key)
+            if future is None or (future.done() and future.exception() is not None):
+                future = self.futures[key] = self._pool.submit(self._run, function, *args)
+            return future
+
+    def _run(self, function, *args):
+        profiler.begin_run(WARMUP_RUN)
+        try:
+            return function(*args)
+        finally:
+            profiler.end_run()
+
+    # ------------------------------ tasks ------------------------------ #
+
+    def data(self, name):
+        """Future of ``module.<name>()``, one of the data loaders of the module."""
+        return self.submit(('data', name), self._load, name)
+
+    def spec(self, name):
+        """Future of the compiled Vega-Lite spec of chart ``name``."""
+        return self.submit(('spec', name), self._spec, name)
+
+    def image(self, name, fmt='svg'):
+        """Future of the static ``<img>`` of chart ``name`` (see :mod:`nyc_collisions.export`)."""
+        return self.submit(('image', name, fmt), self._image, name, fmt)
+
+    def _load(self, name):
+        module = self.module()
+        with self._data_lock:
+            return getattr(module, name)()
+
+    def _spec(self, name):
+        from nyc_collisions.service import data_url, publish
+
+        spec = self._compiled(name)
+        base_url = data_url()
+        if base_url is not None:  # the browser loads the datasets from the data service
+            with stage(f'publish {name}'):
+                spec = publish(spec, base_url)
+        return spec
+
+    def _compiled(self, name):
+        from nyc_collisions.spec import compile_spec
+
+        module = self.module()
+        with self._data_lock:
+            inputs = module.default_inputs(name)
+        chart = module.charts.get(name, *inputs)
+        with stage(f'compile {name}'):
+            spec, _ = compile_spec(chart)
+        return spec
+
+    def _image(self, name, fmt):
+        from nyc_collisions.export import RenderCache, image_html
+
+        cache = RenderCache(self.module().EXPORT_DIR)
+        return image_html(cache.artifact(name, self._compiled(name), fmt))
+
+    @staticmethod
+    def completed(futures):
+        """``(name, result)`` of a ``{name: future}`` dict, as they complete."""
+        names = {future: name for name, future in futures.items()}
+        for future in as_completed(names):
+            yield names[future], future.result()
+
+
+def streamlit_warmup(module, workers=None):
+    """The :class:`Warmup` of ``module``, shared by every session of the app."""
+    import streamlit as st
+
+    @st.cache_resource(show_spinner=False)
+    def get_warmup(module, workers):
+        return Warmup(module, workers)
+
+    return get_warmup(module, workers)
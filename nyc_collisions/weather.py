@@ -0,0 +1,146 @@
+"""Weather of any number of years, indexed by day ordinal.
+
+:class:`WeatherStore` keeps every attribute as one column array (strings
+dictionary encoded) sorted by time, plus a dense table from the day ordinal
+(days since 1970-01-01, minus the first day) to the row of that day.  The
+weather of an array of timestamps is then one subtraction and two ``take``
+calls, without the hashing of a ``merge`` or ``map``::
+
+    store = WeatherStore.from_csv(['weather.csv', 'weather2018.csv'])
+    store.lookup(collisions['CRASH_DATETIME'], 'icon')
+
+Observations that are not daily (e.g. hourly readings) are joined with
+:meth:`WeatherStore.asof`: every timestamp gets the last observation at or
+before it, found by binary search.
+"""
+
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+from nyc_collisions.loader import load_weather
+
+_NAT = np.iinfo(np.int64).min
+
+
+def day_ordinals(timestamps):
+    """Days since 1970-01-01 of an array of timestamps (``NaT`` stays the int64 minimum)."""
+    return np.asarray(timestamps, dtype='datetime64[ns]').astype('datetime64[D]').astype(np.int64)
+
+
+def _column(values):
+    if isinstance(values.dtype, pd.CategoricalDtype) or values.dtype == object:
+        return pd.Categorical(values)
+    return values.to_numpy()
+
+
+class WeatherStore:
+    """Columnar weather observations with O(1) lookups by day."""
+
+    def __init__(self, frame, datetime='datetime', columns=None):
+        columns = [c for c in (columns if columns is not None else frame.columns) if c != datetime]
+        times = pd.to_datetime(frame[datetime]).to_numpy(dtype='datetime64[ns]')
+        order = np.argsort(times, kind='stable')
+        self.times = times[order]
+        self.columns = {column: _column(frame[column].iloc[order]) for column in columns}
+
+        days = day_ordinals(self.times)
+        self.first_day = int(days[0]) if len(days) else 0
+        self.day_rows = np.full(int(days[-1]) - self.first_day + 1 if len(days) else 0, -1, dtype=np.int32)
+        self.day_rows[days - self.first_day] = np.arange(len(days))  # several per day: the last one wins
+        self._fingerprint = None
+
+    @classmethod
+    def from_csv(cls, paths, columns=None):
+        """Store of one or more weather CSVs (e.g. one per year); later files win on shared days."""
+        paths = [paths] if isinstance(paths, (str, os.PathLike)) else list(paths)
+        columns = ['datetime'] + [c for c in columns if c != 'datetime'] if columns is not None else None
+        frame = pd.concat([load_weather(path, columns=columns) for path in paths], ignore_index=True)
+        return cls(frame.drop_duplicates('datetime', keep='last'), columns=columns)
+
+    def __len__(self):
+        return len(self.times)
+
+    def __repr__(self):
+        days = f'{str(self.times[0])[:10]} to {str(self.times[-1])[:10]}' if len(self) else 'empty'
+        return f'WeatherStore({len(self)} observations, {days}, columns={list(self.columns)})'
+
+    def fingerprint(self):
+        """Content hash, used by the chart registry to memoize charts built from the store."""
+        if self._fingerprint is None:
+            digest = hashlib.sha1(self.times.tobytes())
+            for column, values in self.columns.items():
+                digest.update(column.encode())
+                if isinstance(values, pd.Categorical):
+                    digest.update(repr(list(values.categories)).encode() + values.codes.tobytes())
+                else:
+                    digest.update(values.tobytes())
+            self._fingerprint = digest.hexdigest()
+        return self._fingerprint
+
+    # ---------------------------- row lookups ---------------------------- #
+
+    def rows(self, timestamps):
+        """Row of the day of every timestamp, ``-1`` for days without weather."""
+        days = day_ordinals(timestamps)
+        offsets = days - self.first_day
+        found = (days != _NAT) & (offsets >= 0) & (offsets < len(self.day_rows))
+        rows = np.full(len(days), -1, dtype=np.int32)
+        rows[found] = self.day_rows[offsets[found]]
+        return rows
+
+    def asof_rows(self, timestamps, tolerance=None):
+        """Row of the last observation at or before every timestamp, ``-1`` if there is none.
+
+        With ``tolerance`` (a ``pd.Timedelta``), older observations don't match.
+        """
+        times = np.asarray(timestamps, dtype='datetime64[ns]')
+        rows = np.searchsorted(self.times, times, side='right') - 1
+        missing = (rows < 0) | np.isnat(times)
+        if tolerance is not None:
+            lag = times - self.times[np.maximum(rows, 0)]
+            missing |= lag > np.timedelta64(pd.Timedelta(tolerance).value, 'ns')
+        rows[missing] = -1
+        return rows.astype(np.int32)
+
+    # ------------------------------ values ------------------------------- #
+
+    def take(self, column, rows):
+        """Values of ``column`` at ``rows`` (missing for ``-1``)."""
+        values = self.columns[column]
+        missing = rows < 0
+        found = rows[~missing]
+        if isinstance(values, pd.Categorical):
+            codes = np.full(len(rows), -1, dtype=values.codes.dtype)
+            codes[~missing] = values.codes[found]
+            return pd.Categorical.from_codes(codes, dtype=values.dtype)
+        dtype = values.dtype
+        if missing.any() and dtype.kind in 'iub':
+            dtype = np.result_type(dtype, np.float32)
+        taken = np.empty(len(rows), dtype=dtype)
+        taken[~missing] = values[found]
+        if missing.any():
+            taken[missing] = np.datetime64('NaT') if dtype.kind == 'M' else np.nan
+        return taken
+
+    def lookup(self, timestamps, column):
+        """``column`` on the day of every timestamp."""
+        return self.take(column, self.rows(timestamps))
+
+    def asof(self, timestamps, column, tolerance=None):
+        """``column`` of the last observation at or before every timestamp."""
+        return self.take(column, self.asof_rows(timestamps, tolerance))
+
+    def join(self, frame, on, columns=None, how='left', asof=False, tolerance=None):
+        """``frame`` with the weather ``columns`` of its ``on`` timestamps added.
+
+        ``how='inner'`` drops the rows without weather, like ``pd.merge``.
+        """
+        rows = self.asof_rows(frame[on], tolerance) if asof else self.rows(frame[on])
+        if how == 'inner':
+            frame, rows = frame[rows >= 0], rows[rows >= 0]
+        elif how != 'left':
+            raise ValueError(f"how must be 'left' or 'inner', not {how!r}")
+        return frame.assign(**{column: self.take(column, rows) for column in columns or self.columns})
@@ -0,0 +1,27 @@
+import json
+import os
+import sys
+
+import pytest
+
+# the tests import nyc_collisions from the repository root, like the apps do
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+def square(lon, lat, side):
+    return [[lon, lat], [lon + side, lat], [lon + side, lat + side], [lon, lat + side], [lon, lat]]
+
+
+@pytest.fixture
+def features(tmp_path):
+    """GeoJSON of a MultiPolygon of two disjoint squares of about 1.87 km² and a square with a square hole."""
+    geometries = [
+        {'type': 'MultiPolygon', 'coordinates': [[square(-73.90, 40.70, 0.0141)], [square(-73.80, 40.70, 0.0141)]]},
+        {'type': 'Polygon', 'coordinates': [square(-73.70, 40.70, 0.02), square(-73.695, 40.705, 0.01)]},
+    ]
+    features = [{'type': 'Feature', 'properties': {'postalCode': str(10000 + i), 'borough': 'Queens'},
+                 'geometry': geometry} for i, geometry in enumerate(geometries)]
+    path = tmp_path / 'zips.geojson'
+    with open(path, 'w') as f:
+        json.dump({'type': 'FeatureCollection', 'features': features}, f)
+    return path
@@ -0,0 +1,145 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pandas.testing as tm
+import pytest
+
+from nyc_collisions import aggregates
+from nyc_collisions.aggregates import DailyAggregates
+
+
+def make_collisions(n=4000, seed=0):
+    """Collisions from mid-December 2019 to early February 2020: three months over two years."""
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp('2019-12-15')
+    minutes = np.sort(rng.integers(0, 55 * 24 * 60, n))
+    return pd.DataFrame({
+        'CRASH_DATETIME': start + pd.to_timedelta(minutes, unit='min'),
+        'BOROUGH': rng.choice(['BRONX', 'QUEENS', 'MANHATTAN'], n),
+        'TOTAL_KILLED': rng.choice([0, 0, 0, 1, 2], n).astype(float),
+    })
+
+
+def day_of(frame):
+    return frame['CRASH_DATETIME'].dt.strftime('%Y-%m-%d')
+
+
+def rebuilt(directory, frame):
+    store = DailyAggregates(str(directory))
+    store.rebuild(frame)
+    return store
+
+
+def assert_same(store, reference, frame):
+    tm.assert_frame_equal(store.table(), reference.table())
+    assert store.manifest == reference.manifest
+    assert store.verify(frame) == []
+
+
+def partition_files(store):
+    """Identity of every partition file: os.replace gives a rewritten file a new inode."""
+    paths = {month: store._partition_path(month) for month in store.months()}
+    return {month: (os.stat(path).st_ino, os.stat(path).st_mtime_ns) for month, path in paths.items()}
+
+
+def rewritten(before, after):
+    return sorted(month for month in before.keys() | after.keys() if before.get(month) != after.get(month))
+
+
+def test_rebuild_matches_aggregate_days(tmp_path):
+    frame = make_collisions()
+    store = rebuilt(tmp_path, frame)
+    assert store.months() == ['2019-12', '2020-01', '2020-02']
+    table = store.table()
+    assert table['collisions'].sum() == len(frame)
+    assert table['TOTAL_KILLED'].sum() == frame['TOTAL_KILLED'].sum()
+    tm.assert_frame_equal(table, aggregates.aggregate_days(frame))
+    # a new instance reads the same store back
+    assert_same(DailyAggregates(str(tmp_path)), store, frame)
+
+
+def test_append_last_days(tmp_path):
+    frame = make_collisions()
+    new = (day_of(frame) >= '2020-02-05').to_numpy()
+    store = rebuilt(tmp_path / 'store', frame[~new])
+    before = partition_files(store)
+
+    assert store.append(frame[new]) == ['2020-02']
+    assert rewritten(before, partition_files(store)) == ['2020-02']
+    assert_same(store, rebuilt(tmp_path / 'full', frame), frame)
+
+
+def test_append_late_rows_of_a_known_day(tmp_path):
+    frame = make_collisions()
+    late = (day_of(frame) == '2019-12-31').to_numpy() & (np.arange(len(frame)) % 2 == 0)
+    store = rebuilt(tmp_path / 'store', frame[~late])
+    assert store.append(frame[late]) == ['2019-12']
+    assert_same(store, rebuilt(tmp_path / 'full', frame), frame)
+
+
+def test_refresh_corrects_a_past_day(tmp_path):
+    frame = make_collisions()
+    store = rebuilt(tmp_path / 'store', frame)
+    before = partition_files(store)
+
+    corrected = frame.copy()
+    day = (day_of(corrected) == '2020-01-10').to_numpy()
+    corrected.loc[day, 'TOTAL_KILLED'] += 1                     # a revised count
+    corrected = corrected.drop(corrected.index[np.flatnonzero(day)[:3]])  # rows withdrawn
+    assert store.verify(corrected) == ['2020-01-10']
+    assert store.changed_days(corrected) == {'2020-01-10'}
+
+    assert store.refresh(corrected) == ['2020-01']
+    assert rewritten(before, partition_files(store)) == ['2020-01']
+    assert_same(store, rebuilt(tmp_path / 'full', corrected), corrected)
+    assert store.refresh(corrected) == []
+
+
+def test_refresh_drops_removed_days(tmp_path):
+    frame = make_collisions()
+    store = rebuilt(tmp_path / 'store', frame)
+    kept = frame[day_of(frame) >= '2020-01-01']
+    assert store.changed_days(kept) == set(day_of(frame[day_of(frame) < '2020-01-01']))
+    store.refresh(kept)
+    assert store.months() == ['2020-01', '2020-02']
+    assert_same(store, rebuilt(tmp_path / 'full', kept), kept)
+
+
+def test_replace_a_day(tmp_path):
+    frame = make_collisions()
+    store = rebuilt(tmp_path / 'store', frame)
+    before = partition_files(store)
+
+    day = (day_of(frame) == '2019-12-20').to_numpy()
+    rows = frame[day].iloc[::2].assign(TOTAL_KILLED=3.0)
+    assert store.replace(rows) == ['2019-12']
+    assert rewritten(before, partition_files(store)) == ['2019-12']
+    expected = pd.concat([frame[~day], rows]).sort_values('CRASH_DATETIME')
+    assert_same(store, rebuilt(tmp_path / 'full', expected), expected)
+
+
+def test_replace_with_no_rows_removes_the_day(tmp_path):
+    frame = make_collisions()
+    store = rebuilt(tmp_path / 'store', frame)
+    store.replace(frame.iloc[:0], days=['2020-02-08'])
+    kept = frame[day_of(frame) != '2020-02-08']
+    assert_same(store, rebuilt(tmp_path / 'full', kept), kept)
+
+
+def test_verify_finds_a_corrupted_partition(tmp_path):
+    frame = make_collisions()
+    store = rebuilt(tmp_path, frame)
+    table = store._read_partition('2020-01')
+    table.loc[table['date'] == '2020-01-03', 'collisions'] += 1
+    store._write_partition('2020-01', table)
+    assert store.verify(frame) == ['2020-01-03']
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_years_in_parallel(tmp_path, monkeypatch, workers):
+    monkeypatch.setattr(aggregates, 'PARALLEL_MIN_ROWS', 0)
+    frame = make_collisions(n=500)
+    store = DailyAggregates(str(tmp_path / 'store'), workers=workers)
+    store.rebuild(frame)
+    assert_same(store, rebuilt(tmp_path / 'full', frame), frame)
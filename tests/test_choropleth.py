@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+from nyc_collisions.choropleth import polygon_area_km2, polygon_areas, ring_area_km2
+from nyc_collisions.geocoder import ZipGeocoder, read_polygons
+
+from conftest import square
+
+
+def test_read_polygons_keeps_the_parts(features):
+    (_, multi), (_, holed) = read_polygons(features)
+    assert [len(part) for part in multi] == [1, 1]
+    assert [len(part) for part in holed] == [2]
+    assert multi[0][0].shape == (5, 2)
+
+
+def test_multipolygon_area_is_the_sum_of_its_parts(features):
+    (_, multi), _ = read_polygons(features)
+    part = ring_area_km2(np.array(square(-73.90, 40.70, 0.0141)))
+    assert part == pytest.approx(1.87, abs=0.01)
+    assert polygon_area_km2(multi) == pytest.approx(2 * part, rel=1e-6)
+
+
+def test_holes_are_subtracted(features):
+    _, (_, holed) = read_polygons(features)
+    outer = ring_area_km2(np.array(square(-73.70, 40.70, 0.02)))
+    hole = ring_area_km2(np.array(square(-73.695, 40.705, 0.01)))
+    assert polygon_area_km2(holed) == pytest.approx(outer - hole, rel=1e-9)
+    assert polygon_area_km2(holed) == pytest.approx(0.75 * outer, rel=1e-3)
+
+
+def test_cached_areas(features, tmp_path):
+    areas = polygon_areas(features, cache_dir=tmp_path / 'cache')
+    assert np.allclose(polygon_areas(features, cache_dir=tmp_path / 'cache'), areas)
+    assert areas[0] == pytest.approx(3.73, abs=0.01)
+
+
+def test_geocoder_finds_every_part_and_skips_holes(features):
+    geocoder = ZipGeocoder(features)
+    lat = [40.707, 40.707, 40.702, 40.71, 40.75]
+    lon = [-73.89, -73.79, -73.69, -73.69, -73.69]
+    assert geocoder.locate(lat, lon).tolist() == [0, 0, 1, -1, -1]
@@ -0,0 +1,153 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from nyc_collisions.crossfilter import Crossfilter
+
+DIMS = ['hour', 'borough', 'injured']
+
+
+def make_frame(n=500, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'hour': rng.integers(0, 24, n),
+        'borough': rng.choice(['BRONX', 'BROOKLYN', 'MANHATTAN', 'QUEENS', None], n),
+        'injured': rng.choice([0.0, 1.0, 2.0, 3.5], n),
+        'count': rng.integers(1, 9, n),
+    })
+
+
+class Reference:
+    """The same filters as row masks, the groups by pandas."""
+
+    def __init__(self, frame, weight=None):
+        self.frame = frame
+        self.weights = frame[weight] if weight else pd.Series(1, index=frame.index)
+        self.masks = {}
+
+    def filter(self, dim, values):
+        self.masks[dim] = self.frame[dim].isin(values).to_numpy()
+
+    def filter_range(self, dim, lo, hi):
+        self.masks[dim] = self.frame[dim].between(lo, hi).to_numpy()
+
+    def selected(self, dim=None):
+        keep = np.ones(len(self.frame), dtype=bool)
+        for name, mask in self.masks.items():
+            if name != dim:
+                keep &= mask
+        return keep
+
+    def group(self, dim, levels):
+        keep = self.selected(dim)
+        return self.weights[keep].groupby(self.frame[dim][keep], dropna=False).sum().reindex(levels, fill_value=0)
+
+
+def check(crossfilter, reference):
+    for dim in DIMS:
+        group = crossfilter.group(dim)
+        expected = reference.group(dim, group.index)
+        np.testing.assert_allclose(group.to_numpy(float), expected.to_numpy(float), err_msg=dim)
+        assert np.array_equal(crossfilter.selected(dim), reference.selected(dim))
+    for name in reference.masks:
+        if name not in DIMS:
+            assert np.array_equal(crossfilter.selected(name), reference.selected(name))
+    assert np.array_equal(crossfilter.selected(), reference.selected())
+    assert crossfilter.total() == reference.weights[reference.selected()].sum()
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('weight', [None, 'count'])
+def test_random_filters(seed, weight):
+    frame = make_frame(seed=seed)
+    crossfilter, reference = Crossfilter(frame, DIMS, weight=weight), Reference(frame, weight)
+    rng = np.random.default_rng(seed)
+    check(crossfilter, reference)
+    for _ in range(40):
+        action = rng.integers(0, 5)
+        dim = DIMS[rng.integers(0, len(DIMS))]
+        if action == 0:
+            values = list(rng.choice(frame[dim].dropna().unique(), rng.integers(0, 4)))
+            crossfilter.filter(dim, values)
+            reference.filter(dim, values)
+        elif action == 1 and dim != 'borough':
+            lo, hi = sorted(rng.choice(frame[dim].unique(), 2))
+            crossfilter.filter_range(dim, lo, hi)
+            reference.filter_range(dim, lo, hi)
+        elif action == 2:
+            crossfilter.clear(dim)
+            reference.masks.pop(dim, None)
+        else:
+            mask = rng.random(len(frame)) < rng.choice([0.0, 0.3, 0.9, 1.0])
+            crossfilter.filter_mask('map', mask)
+            reference.masks['map'] = mask
+        check(crossfilter, reference)
+
+
+def test_empty_selections():
+    frame = make_frame()
+    crossfilter, reference = Crossfilter(frame, DIMS), Reference(frame)
+    crossfilter.filter('hour', [])
+    reference.filter('hour', [])
+    check(crossfilter, reference)
+    assert crossfilter.total() == 0
+    assert crossfilter.group('hour').sum() == len(frame)  # a view is not filtered by its own selection
+
+    crossfilter.filter('hour', None).filter('borough', ['STATEN ISLAND'])  # no such value
+    reference.masks.pop('hour')
+    reference.filter('borough', ['STATEN ISLAND'])
+    check(crossfilter, reference)
+    assert crossfilter.filters == {'borough': []}
+
+    crossfilter.clear().filter_mask('map', np.zeros(len(frame), dtype=bool))
+    reference.masks = {'map': np.zeros(len(frame), dtype=bool)}
+    check(crossfilter, reference)
+    assert all(group.sum() == 0 for group in crossfilter.groups().values())
+
+
+def test_missing_values_are_a_level():
+    frame = make_frame()
+    crossfilter = Crossfilter(frame, DIMS).filter('borough', [None])
+    assert crossfilter.total() == frame['borough'].isna().sum()
+
+
+def test_ranges_are_inclusive():
+    frame = make_frame()
+    crossfilter = Crossfilter(frame, DIMS).filter_range('injured', 1.0, 2.0)
+    assert crossfilter.total() == frame['injured'].isin([1.0, 2.0]).sum()
+    assert Crossfilter(frame, DIMS).filter_range('hour', lo=20).total() == (frame['hour'] >= 20).sum()
+
+
+def test_copies_are_independent():
+    frame = make_frame()
+    crossfilter = Crossfilter(frame, DIMS).filter('hour', [8, 9])
+    other = crossfilter.copy().filter('borough', ['QUEENS']).filter_mask('map', frame['injured'].to_numpy() > 1)
+    reference = Reference(frame)
+    reference.filter('hour', [8, 9])
+    check(crossfilter, reference)
+    assert crossfilter.filters == {'hour': [8, 9]}
+    reference.filter('borough', ['QUEENS'])
+    reference.masks['map'] = frame['injured'].to_numpy() > 1
+    check(other, reference)
+
+
+def test_clear_every_filter():
+    frame = make_frame()
+    crossfilter = Crossfilter(frame, DIMS).filter('hour', [1]).filter_mask('map', np.zeros(len(frame), dtype=bool))
+    crossfilter.clear()
+    check(crossfilter, Reference(frame))
+    assert crossfilter.filters == {}
+
+
+def test_unset_mask_filters_nothing():
+    frame = make_frame()
+    crossfilter = Crossfilter(frame, DIMS).filter_mask('map', None)
+    assert crossfilter.selected('map').all()
+
+
+def test_invalid_masks():
+    crossfilter = Crossfilter(make_frame(), DIMS)
+    with pytest.raises(ValueError):
+        crossfilter.filter_mask('hour', np.ones(500, dtype=bool))
+    with pytest.raises(ValueError):
+        crossfilter.filter_mask('map', np.ones(3, dtype=bool))
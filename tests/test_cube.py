@@ -0,0 +1,138 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+import pandas.testing as tm
+import pytest
+
+from nyc_collisions.cube import Cube
+
+DIMS = ['hour', 'borough', 'injured']
+
+
+def make_frame(n=500, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'hour': rng.integers(0, 24, n),
+        'borough': rng.choice(['BRONX', 'BROOKLYN', 'MANHATTAN', 'QUEENS', None], n),
+        'injured': rng.choice([0.0, 1.0, 2.0, 3.5, np.nan], n),
+        'count': rng.integers(1, 9, n),
+    })
+
+
+def reference(frame, dims, weight=None, name='count'):
+    """The cube as pandas groups it: occupied cells only, missing values as a level."""
+    if not dims:
+        total = frame[weight].sum() if weight else len(frame)
+        return pd.DataFrame({name: [total]})
+    grouped = frame.groupby(dims, dropna=False)
+    counts = grouped[weight].sum() if weight else grouped.size()
+    return counts.rename(name).reset_index()
+
+
+def check(cube, expected, name='count'):
+    result = cube.to_frame(name)
+    dims = list(expected.columns[:-1])
+    assert list(result.columns) == dims + [name]
+    assert cube.total() == expected[name].sum()
+    # both sorted by their dimensions, missing values last
+    tm.assert_frame_equal(result.sort_values(dims, ignore_index=True) if dims else result,
+                          expected.sort_values(dims, ignore_index=True) if dims else expected,
+                          check_dtype=False)
+
+
+@pytest.mark.parametrize('seed', range(3))
+@pytest.mark.parametrize('weight', [None, 'count'])
+def test_from_frame(seed, weight):
+    frame = make_frame(seed=seed)
+    cube = Cube.from_frame(frame, DIMS, weight=weight)
+    check(cube, reference(frame, DIMS, weight))
+    assert len(cube) == len(frame.groupby(DIMS, dropna=False))
+    assert cube.shape == tuple(frame[dim].nunique(dropna=False) for dim in DIMS)
+
+
+@pytest.mark.parametrize('dims', [dims for k in range(len(DIMS) + 1) for dims in itertools.permutations(DIMS, k)])
+@pytest.mark.parametrize('weight', [None, 'count'])
+def test_rollup(dims, weight):
+    frame = make_frame()
+    rolled = Cube.from_frame(frame, DIMS, weight=weight).rollup(dims)
+    assert rolled.dims == list(dims)
+    check(rolled, reference(frame, list(dims), weight))
+    # the same cube as one built from the rows
+    if dims:
+        check(rolled, Cube.from_frame(frame, list(dims), weight=weight).to_frame())
+
+
+def test_rollup_keeps_integer_counts():
+    frame = make_frame()
+    assert Cube.from_frame(frame, DIMS).rollup(['hour']).counts.dtype.kind == 'i'
+    assert Cube.from_frame(frame, DIMS, weight='count').rollup(['hour']).counts.dtype.kind == 'f'
+
+
+SELECTIONS = [
+    {'hour': 8},
+    {'hour': [7, 8, 9], 'borough': 'QUEENS'},
+    {'borough': ['BRONX', None]},
+    {'injured': [np.nan]},
+    {'injured': [1.0, 3.5], 'hour': range(12)},
+    {'borough': ['STATEN ISLAND']},
+    {'hour': []},
+]
+
+
+def selected(frame, selections):
+    keep = np.ones(len(frame), dtype=bool)
+    for dim, values in selections.items():
+        values = [values] if np.ndim(values) == 0 else list(values)
+        column = frame[dim]
+        keep &= column.isin(values).to_numpy() | (column.isna().to_numpy() & pd.isna(values).any())
+    return frame[keep]
+
+
+@pytest.mark.parametrize('selections', SELECTIONS)
+@pytest.mark.parametrize('dims', [['hour'], ['borough', 'injured'], []])
+@pytest.mark.parametrize('weight', [None, 'count'])
+def test_slice_then_rollup(selections, dims, weight):
+    frame = make_frame()
+    cube = Cube.from_frame(frame, DIMS, weight=weight).slice(**selections)
+    rows = selected(frame, selections)
+    check(cube, reference(rows, DIMS, weight))
+    check(cube.rollup(dims), reference(rows, dims, weight))
+
+
+@pytest.mark.parametrize('selections', SELECTIONS)
+def test_mask(selections):
+    frame = make_frame()
+    cube = Cube.from_frame(frame, DIMS)
+    cells = cube.to_frame()
+    mask = cube.mask(**selections)
+    assert mask.shape == (len(cube),)
+    assert cells[mask]['count'].sum() == len(selected(frame, selections))
+    assert np.array_equal(mask, cells.index.isin(selected(cells, selections).index))
+
+
+def test_slice_keeps_levels():
+    cube = Cube.from_frame(make_frame(), DIMS).slice(borough='QUEENS')
+    assert cube.shape == Cube.from_frame(make_frame(), DIMS).shape
+    assert set(cube.to_frame()['borough']) == {'QUEENS'}
+
+
+def test_unknown_dimensions():
+    cube = Cube.from_frame(make_frame(), DIMS)
+    with pytest.raises(KeyError):
+        cube.rollup(['hour', 'weekday'])
+    with pytest.raises(KeyError):
+        cube.slice(weekday=1)
+
+
+def test_empty_frame():
+    cube = Cube.from_frame(make_frame().iloc[:0], DIMS)
+    assert len(cube) == 0 and cube.total() == 0
+    assert cube.to_frame().empty
+    assert cube.rollup([]).total() == 0
+
+
+def test_too_large():
+    frame = pd.DataFrame({f'd{i}': np.arange(2 ** 16) for i in range(4)})
+    with pytest.raises(ValueError):
+        Cube.from_frame(frame, list(frame.columns))
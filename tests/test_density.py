@@ -0,0 +1,176 @@
+import altair as alt
+import numpy as np
+import pandas as pd
+import pandas.testing as tm
+import pytest
+
+from nyc_collisions import density
+from nyc_collisions.density import box_table, density_table, scott_bandwidth, violin_table
+
+GROUPBY = ['year', 'conditions']
+
+
+def make_frame(n=600, seed=0):
+    """Daily collisions per year and weather, skewed with a few extreme days and missing counts."""
+    rng = np.random.default_rng(seed)
+    frame = pd.DataFrame({
+        'year': rng.choice([2018, 2020], n),
+        'conditions': rng.choice(['Clear', 'Rain', 'Snow'], n, p=[0.6, 0.35, 0.05]),
+        'collisions': rng.gamma(4, 60, n).round(),
+    })
+    frame.loc[rng.random(n) < 0.02, 'collisions'] = rng.uniform(900, 1500)
+    frame.loc[rng.random(n) < 0.03, 'collisions'] = np.nan
+    return frame
+
+
+def scenegraph_texts(node):
+    if isinstance(node, dict):
+        if node.get('marktype') == 'text' and node.get('role') == 'mark':
+            yield from (item['text'] for item in node['items'])
+        for value in node.values():
+            yield from scenegraph_texts(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from scenegraph_texts(value)
+
+
+def vega_density(frame, value, groupby, **options):
+    """The rows of ``transform_density``, as evaluated by Vega and read back from the scenegraph."""
+    vl_convert = pytest.importorskip('vl_convert')
+    fields = groupby + [value, 'density']
+    label = " + '|' + ".join(f'datum[{field!r}]' for field in fields)
+    chart = alt.Chart(frame).transform_density(value, groupby=groupby, as_=[value, 'density'], **options) \
+        .transform_calculate(label=label).mark_text().encode(text='label:N')
+    rows = [text.split('|') for text in scenegraph_texts(vl_convert.vegalite_to_scenegraph(chart.to_dict()))]
+    table = pd.DataFrame(rows, columns=fields).astype({value: float, 'density': float})
+    for field in groupby:
+        table[field] = table[field].astype(frame[field].dtype)
+    return table.sort_values(fields[:-1], ignore_index=True)
+
+
+def in_order(table, value, groupby):
+    return table.sort_values(groupby + [value], ignore_index=True)
+
+
+@pytest.mark.parametrize('groupby', [[], ['conditions'], GROUPBY])
+@pytest.mark.parametrize('bandwidth', [None, 40])
+def test_density_table_matches_vega(groupby, bandwidth):
+    frame = make_frame()
+    options = {'bandwidth': bandwidth} if bandwidth else {}
+    expected = vega_density(frame.dropna(), 'collisions', groupby, extent=[0, 1000], steps=40, **options)
+    result = density_table(frame, 'collisions', groupby, extent=(0, 1000), steps=40, bandwidth=bandwidth, cutoff=0)
+    groups = len(frame.dropna().drop_duplicates(groupby)) if groupby else 1
+    assert len(result) == len(expected) == 41 * groups
+    tm.assert_frame_equal(in_order(result, 'collisions', groupby), expected, check_exact=False, rtol=1e-12)
+
+
+def test_violin_densities_match_vega():
+    frame = make_frame(seed=1)
+    expected = vega_density(frame.dropna(), 'collisions', GROUPBY, extent=[0, 1000], steps=50)
+    table = violin_table(frame, 'collisions', GROUPBY, extent=(0, 1000), steps=50)
+    curves = table[table['layer'] == 'density'][GROUPBY + ['collisions', 'density']]
+    # the trimmed ends aside, every point of a curve is Vega's
+    merged = curves.merge(expected, on=GROUPBY + ['collisions'], how='left', suffixes=('', '_vega'))
+    assert merged['density_vega'].notna().all()
+    np.testing.assert_allclose(merged['density'], merged['density_vega'], rtol=1e-12)
+    assert set(table['layer']) == {'density', 'box', 'outlier'}
+
+
+def test_density_default_extent():
+    frame = make_frame().dropna()
+    result = density_table(frame, 'collisions', steps=10, cutoff=0)
+    assert result['collisions'].tolist() == pytest.approx(np.linspace(frame['collisions'].min(),
+                                                                      frame['collisions'].max(), 11).tolist())
+
+
+def test_scott_bandwidth():
+    values = make_frame()['collisions'].dropna().to_numpy()
+    q1, q3 = np.percentile(values, [25, 75])
+    expected = 1.06 * min(values.std(ddof=1), (q3 - q1) / 1.34) * len(values) ** -0.2
+    assert scott_bandwidth(values)[0] == pytest.approx(expected)
+    # no spread: the fallbacks of Vega
+    assert scott_bandwidth([3.0, 3.0, 3.0])[0] == pytest.approx(1.06 * 3 * 3 ** -0.2)
+    assert scott_bandwidth([0.0, 0.0])[0] == pytest.approx(1.06 * 2 ** -0.2)
+
+
+def bimodal():
+    """Two separate modes: the curve is nearly zero at both ends and between them."""
+    return pd.DataFrame({'collisions': np.r_[np.linspace(100, 150, 40), np.linspace(700, 750, 40)]})
+
+
+@pytest.mark.parametrize('cutoff', [1e-3, 1e-2, 0.2])
+def test_cutoff_trims_only_the_ends(cutoff):
+    frame = bimodal()
+    full = density_table(frame, 'collisions', extent=(0, 1000), steps=100, bandwidth=15, cutoff=0)
+    trimmed = density_table(frame, 'collisions', extent=(0, 1000), steps=100, bandwidth=15, cutoff=cutoff)
+    threshold = cutoff * full['density'].max()
+    above = np.flatnonzero(full['density'] >= threshold)
+    # from the first to the last point above the threshold, the valley between the modes included
+    tm.assert_frame_equal(trimmed, full.iloc[above[0]:above[-1] + 1].reset_index(drop=True))
+    assert (trimmed['density'] < threshold).any()
+    assert (full['density'].iloc[:above[0]] < threshold).all() and (full['density'].iloc[above[-1] + 1:] < threshold).all()
+
+
+def test_cutoff_per_group():
+    frame = pd.concat([bimodal().assign(conditions='Clear'),
+                       pd.DataFrame({'collisions': np.linspace(400, 600, 30), 'conditions': 'Rain'})])
+    full = density_table(frame, 'collisions', ['conditions'], extent=(0, 1000), steps=100, bandwidth=15, cutoff=0)
+    trimmed = density_table(frame, 'collisions', ['conditions'], extent=(0, 1000), steps=100, bandwidth=15)
+    for conditions, curve in full.groupby('conditions'):
+        kept = trimmed[trimmed['conditions'] == conditions]['collisions']
+        above = curve[curve['density'] >= 1e-3 * curve['density'].max()]['collisions']
+        assert kept.tolist() == curve['collisions'][curve['collisions'].between(above.min(), above.max())].tolist()
+
+
+def reference_boxes(frame, value, groupby):
+    """Quartiles by pandas, whiskers as the last values within 1.5 IQR of the box."""
+    rows, outliers = [], []
+    for key, group in frame.dropna(subset=[value]).groupby(groupby):
+        key = key if isinstance(key, tuple) else (key,)
+        values = group[value]
+        q1, median, q3 = values.quantile([0.25, 0.5, 0.75])
+        inside = values.between(q1 - 1.5 * (q3 - q1), q3 + 1.5 * (q3 - q1))
+        rows.append((*key, values[inside].min(), q1, median, q3, values[inside].max()))
+        outliers.extend((*key, outlier) for outlier in values[~inside])
+    boxes = pd.DataFrame(rows, columns=groupby + ['lower', 'q1', 'median', 'q3', 'upper'])
+    return boxes, pd.DataFrame(outliers, columns=groupby + [value]).sort_values(groupby + [value], ignore_index=True)
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_box_table(seed):
+    frame = make_frame(seed=seed)
+    boxes, outliers = box_table(frame, 'collisions', GROUPBY)
+    expected_boxes, expected_outliers = reference_boxes(frame, 'collisions', GROUPBY)
+    tm.assert_frame_equal(boxes, expected_boxes, check_exact=False, rtol=1e-12)
+    tm.assert_frame_equal(outliers, expected_outliers)
+    assert len(outliers) > 0
+    # numpy agrees with pandas on the quartiles
+    for row in boxes.itertuples():
+        values = frame[(frame['year'] == row.year) & (frame['conditions'] == row.conditions)]['collisions'].dropna()
+        assert [row.q1, row.median, row.q3] == pytest.approx(np.percentile(values, [25, 50, 75]))
+
+
+def test_box_table_small_groups():
+    frame = pd.DataFrame({'conditions': ['Clear', 'Rain', 'Rain', 'Snow', 'Snow', 'Snow', 'Snow', 'Snow'],
+                          'collisions': [7.0, 1.0, 3.0, 10.0, 10.0, 10.0, 10.0, 50.0]})
+    boxes, outliers = box_table(frame, 'collisions', ['conditions'])
+    expected_boxes, expected_outliers = reference_boxes(frame, 'collisions', ['conditions'])
+    tm.assert_frame_equal(boxes, expected_boxes)
+    tm.assert_frame_equal(outliers, expected_outliers)
+    assert outliers['collisions'].tolist() == [50.0]   # no spread in the box: anything else is out
+
+
+def test_box_table_without_groups():
+    values = make_frame()['collisions']
+    boxes, outliers = box_table(values.to_frame(), 'collisions')
+    q1, median, q3 = np.nanpercentile(values, [25, 50, 75])
+    assert boxes[['q1', 'median', 'q3']].iloc[0].tolist() == pytest.approx([q1, median, q3])
+    outside = (values < q1 - 1.5 * (q3 - q1)) | (values > q3 + 1.5 * (q3 - q1))
+    assert sorted(outliers['collisions']) == sorted(values[outside])
+
+
+def test_kde_chunks(monkeypatch):
+    frame = make_frame()
+    expected = density_table(frame, 'collisions', GROUPBY, extent=(0, 1000), steps=30)
+    monkeypatch.setattr(density, 'CHUNK_ROWS', 7)
+    tm.assert_frame_equal(density_table(frame, 'collisions', GROUPBY, extent=(0, 1000), steps=30), expected)
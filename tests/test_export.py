@@ -0,0 +1,44 @@
+import json
+import os
+
+import pytest
+
+from nyc_collisions import export
+from nyc_collisions.export import INDEX_FILE, RenderCache, artifact_key, export_specs
+
+pytest.importorskip('vl_convert')
+
+
+def bar_spec(values):
+    return {'data': {'values': [{'x': i, 'y': v} for i, v in enumerate(values)]}, 'mark': 'bar',
+            'encoding': {'x': {'field': 'x', 'type': 'ordinal'}, 'y': {'field': 'y', 'type': 'quantitative'}}}
+
+
+def test_exported_artifact_is_served(tmp_path, monkeypatch):
+    spec = bar_spec([1, 2, 3])
+    path = export_specs({'c1': spec}, str(tmp_path))['c1']['svg']
+    monkeypatch.setattr(export, 'render', lambda *args: pytest.fail('rendered again'))
+    assert RenderCache(str(tmp_path)).artifact('c1', spec) == path
+
+
+def test_stale_export_is_not_served(tmp_path):
+    old = export_specs({'c1': bar_spec([1, 2, 3])}, str(tmp_path))['c1']['svg']
+    spec = bar_spec([1, 2, 4])  # the data changed after the export
+    cache = RenderCache(str(tmp_path))
+    path = cache.artifact('c1', spec)
+    assert path != old
+    assert os.path.basename(path) == f'{artifact_key(spec, "svg")}.svg'
+    with open(path) as f:
+        assert f.read() == export.render(spec, 'svg').decode()
+    assert cache.read_index() == {'c1': {'svg': os.path.basename(path)}}
+
+
+def test_index_is_only_a_hint(tmp_path):
+    spec = bar_spec([5, 6])
+    cache = RenderCache(str(tmp_path))
+    other = cache.render(bar_spec([7]), 'svg')
+    # an index pointing at some other artifact, e.g. edited by hand
+    with open(tmp_path / INDEX_FILE, 'w') as f:
+        json.dump({'c1': {'svg': os.path.basename(other)}}, f)
+    assert cache.artifact('c1', spec) == cache.lookup(spec, 'svg')
+    assert cache.artifact('c2', spec) == cache.lookup(spec, 'svg')
@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from nyc_collisions.expression import Unsupported, evaluate, evaluate_mask
+
+
+def make_frame(n=200, seed=0):
+    rng = np.random.default_rng(seed)
+    times = pd.Timestamp('2018-01-01') + pd.to_timedelta(rng.integers(0, 3 * 365 * 24 * 60, n), unit='min')
+    return pd.DataFrame({
+        'x': np.where(rng.random(n) < 0.15, np.nan, rng.normal(10, 4, n).round(3)),
+        'y': rng.integers(-5, 21, n),
+        'h': rng.integers(0, 4, n),
+        'z': rng.normal(0, 2, n).round(2),
+        'code': rng.integers(0, 3, n),
+        'g': rng.choice(['a', 'b', 'c'], n),
+        's': rng.choice(['', 'foo', 'Bar', 'baz qux'], n),
+        # local date-times, read the same in every time zone
+        'd': times.strftime('%Y-%m-%dT%H:%M:%S'),
+    })
+
+
+FRAME = make_frame()
+
+
+def js_number_string(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+# expression -> the same values computed with numpy/pandas
+VALUES = [
+    ('datum.y * 2 + 1', lambda f: f.y * 2 + 1),
+    ('datum.y / 4 - datum.h', lambda f: f.y / 4 - f.h),
+    ('datum.y % 4', lambda f: np.fmod(f.y, 4)),  # the sign of the dividend, as in JavaScript
+    ('-datum.y + pow(2, datum.h) - sqrt(abs(datum.y))', lambda f: -f.y + 2.0 ** f.h - np.sqrt(np.abs(f.y))),
+    ('round(datum.z)', lambda f: np.floor(f.z + 0.5)),  # halves round up
+    ('floor(datum.z) + ceil(datum.z)', lambda f: np.floor(f.z) + np.ceil(f.z)),
+    ('clamp(datum.y, 0, 10)', lambda f: f.y.clip(0, 10)),
+    ('min(datum.y, datum.h) * max(1, datum.h)', lambda f: np.minimum(f.y, f.h) * np.maximum(1, f.h)),
+    ("datum.g + '-' + datum.y", lambda f: f.g + '-' + f.y.astype(str)),
+    ('upper(datum.s) + length(datum.s)', lambda f: f.s.str.upper() + f.s.str.len().astype(str)),
+    ('toString(datum.y / 8)', lambda f: (f.y / 8).map(js_number_string)),
+    ("datum.s ? 'yes' : 'no'", lambda f: np.where(f.s != '', 'yes', 'no')),
+    ('year(datum.d)', lambda f: pd.to_datetime(f.d).dt.year),
+    ('month(datum.d)', lambda f: pd.to_datetime(f.d).dt.month - 1),
+    ('date(datum.d)', lambda f: pd.to_datetime(f.d).dt.day),
+    ('day(datum.d)', lambda f: (pd.to_datetime(f.d).dt.dayofweek + 1) % 7),  # 0 is Sunday
+    ('hours(datum.d) * 60 + minutes(datum.d)', lambda f: pd.to_datetime(f.d).dt.hour * 60 + pd.to_datetime(f.d).dt.minute),
+    ('["zero", "one", "two"][datum["code"]]', lambda f: f.code.map({0: 'zero', 1: 'one', 2: 'two'})),
+    ('[10, 20, 30][datum.code]', lambda f: (f.code + 1) * 10),
+    ('isValid(datum.x) ? datum.x * 2 : -1', lambda f: f.x.mul(2).fillna(-1)),
+    ('datum.y > 3 ? datum.y : null', lambda f: f.y.where(f.y > 3)),
+    ('if(datum.h === 0, "none", "some")', lambda f: np.where(f.h == 0, 'none', 'some')),
+]
+
+MASKS = [
+    ("datum.y > 3 && datum.g !== 'b' || datum.h === 0", lambda f: ((f.y > 3) & (f.g != 'b')) | (f.h == 0)),
+    ('!(datum.y >= 3)', lambda f: ~(f.y >= 3)),
+    ('datum.x == null', lambda f: f.x.isna()),
+    ('datum.x != null && datum.x > 9', lambda f: f.x > 9),
+    ('isValid(datum.x) && datum.x > 12', lambda f: f.x > 12),
+    ("lower(trim(datum.s)) === 'bar'", lambda f: f.s == 'Bar'),
+    ('isFinite(datum.y / datum.h)', lambda f: f.h != 0),
+]
+
+UNSUPPORTED = [
+    'datum.x * 2',             # a null operand reaches the result
+    'brush.LATITUDE',          # selections live in the browser
+    'datum.s * 2',             # string to number coercion
+    'now()',
+    'utcyear(datum.d)',        # a local date-time read in UTC depends on the time zone of the browser
+    'datum.y +',
+]
+
+
+@pytest.mark.parametrize('expression, reference', VALUES, ids=[e for e, _ in VALUES])
+def test_values(expression, reference):
+    result = evaluate(expression, FRAME)
+    expected = pd.Series(np.asarray(reference(FRAME)), index=FRAME.index)
+    if expected.dtype == object:
+        assert result.tolist() == expected.tolist()
+    else:
+        np.testing.assert_allclose(result.astype(float), expected.astype(float), rtol=1e-12, equal_nan=True)
+
+
+@pytest.mark.parametrize('expression, reference', MASKS, ids=[e for e, _ in MASKS])
+def test_masks(expression, reference):
+    assert np.array_equal(evaluate_mask(expression, FRAME), np.asarray(reference(FRAME), dtype=bool))
+
+
+@pytest.mark.parametrize('expression', UNSUPPORTED)
+def test_unsupported(expression):
+    with pytest.raises(Unsupported):
+        evaluate(expression, FRAME)
+
+
+def test_empty_frame():
+    assert evaluate('datum.y * 2', FRAME.iloc[:0]).tolist() == []
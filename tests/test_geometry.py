@@ -0,0 +1,40 @@
+import json
+
+import numpy as np
+
+from nyc_collisions.geocoder import read_polygons
+from nyc_collisions.geometry import build_topology
+
+
+def decode_ring(topology, arc_ids):
+    """Coordinates of a TopoJSON ring, from its delta-encoded and quantized arcs."""
+    scale, translate = np.array(topology['transform']['scale']), np.array(topology['transform']['translate'])
+    points = []
+    for arc_id in arc_ids:
+        arc = np.cumsum(np.array(topology['arcs'][arc_id if arc_id >= 0 else ~arc_id]), axis=0) * scale + translate
+        arc = arc if arc_id >= 0 else arc[::-1]
+        points.extend(arc if not points else arc[1:])
+    return np.array(points)
+
+
+def test_multipolygons_keep_their_parts(features):
+    topology = build_topology(str(features))
+    multi, holed = topology['objects']['zipcodes']['geometries']
+    assert multi['type'] == 'MultiPolygon' and [len(part) for part in multi['arcs']] == [1, 1]
+    assert holed['type'] == 'Polygon' and len(holed['arcs']) == 2
+
+    (_, multi_parts), (_, holed_parts) = read_polygons(features)
+    step = np.array(topology['transform']['scale'])
+    for arcs, part in zip(multi['arcs'] + [holed['arcs']], multi_parts + holed_parts):
+        for ring_arcs, ring in zip(arcs, part):
+            decoded = decode_ring(topology, ring_arcs)
+            assert len(decoded) == len(ring)
+            # a rotated start is still the same closed ring
+            start = np.argmin(np.abs(ring[:-1] - decoded[0]).sum(axis=1))
+            expected = np.roll(ring[:-1], -start, axis=0)
+            assert np.all(np.abs(decoded[:-1] - expected) <= step)
+
+
+def test_topology_is_json(features):
+    topology = build_topology(str(features), tolerance=0.001)
+    assert json.loads(json.dumps(topology)) == topology
@@ -0,0 +1,176 @@
+import functools
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pandas.testing as tm
+import pytest
+
+from nyc_collisions import loader
+from nyc_collisions.loader import cache_paths, cached_table, parse_collisions, parse_weather
+from nyc_collisions.projects import ROOT
+
+COLLISIONS = {
+    # CRASH_DATE and CRASH_TIME, and the combined CRASH_DATETIME of the second project
+    'project1': os.path.join(ROOT, 'Project 1', 'data', 'preprocessed-collisions.csv'),
+    'project2': os.path.join(ROOT, 'Project 2', 'data', 'preprocessed-collisions-2.csv'),
+}
+WEATHER = os.path.join(ROOT, 'Project 1', 'data', 'weather.csv')
+
+QUERIES = [
+    (None, None),
+    (['BOROUGH', 'TOTAL_KILLED'], None),
+    (None, [('YEAR', '==', 2018)]),
+    (['CRASH_DATETIME', 'BOROUGH'], [('BOROUGH', 'in', ['QUEENS', 'BRONX']), ('TOTAL_INJURED', '>', 0)]),
+    (['LATITUDE'], [('CRASH_DATETIME', '>=', pd.Timestamp('2018-07-01')), ('CRASH_DATETIME', '<', pd.Timestamp('2020-08-01'))]),
+    (None, [('BOROUGH', '!=', 'QUEENS')]),
+    (None, [('BOROUGH', 'not in', ['QUEENS', 'BROOKLYN'])]),
+    (None, [('LATITUDE', '<=', 40.7), ('LONGITUDE', '>', -74.0)]),
+    (['ZIP_CODE'], [('BOROUGH', '==', 'NOWHERE')]),
+]
+# the Parquet filter semantics: a missing value fails every comparison but 'not in'
+OPS = {
+    '==': lambda values, value: values == value,
+    '!=': lambda values, value: (values != value) & values.notna(),
+    '<': lambda values, value: values < value,
+    '<=': lambda values, value: values <= value,
+    '>': lambda values, value: values > value,
+    '>=': lambda values, value: values >= value,
+    'in': lambda values, value: values.isin(value),
+    'not in': lambda values, value: ~values.isin(value),
+}
+
+
+@pytest.fixture(params=sorted(COLLISIONS))
+def source(request, tmp_path):
+    """A copy of the collisions of a project, some boroughs and coordinates missing."""
+    frame = pd.read_csv(COLLISIONS[request.param], dtype=str)
+    frame.loc[::7, 'BOROUGH'] = None
+    frame.loc[::5, 'LATITUDE'] = None
+    path = tmp_path / os.path.basename(COLLISIONS[request.param])
+    frame.to_csv(path, index=False)
+    return str(path)
+
+
+@pytest.fixture(params=['parquet', 'pickle'])
+def storage(request, monkeypatch):
+    """The Parquet cache (small row groups, so filters skip some) or the pickle of a setup without pyarrow."""
+    if request.param == 'parquet':
+        pytest.importorskip('pyarrow')
+        monkeypatch.setattr(loader, 'ROW_GROUP_SIZE', 500)
+    else:
+        monkeypatch.setattr(loader, 'pq', None)
+    return request.param
+
+
+@pytest.mark.parametrize('columns, filters', QUERIES)
+def test_cache_hit_equals_miss(source, storage, tmp_path, columns, filters):
+    cache_dir = str(tmp_path / 'cache')
+    miss = cached_table(source, parse_collisions, columns, filters, cache_dir=cache_dir)
+    assert os.path.exists(cache_paths(source, 'parse_collisions', cache_dir)[0])
+    hit = cached_table(source, parse_collisions, columns, filters, cache_dir=cache_dir)
+    tm.assert_frame_equal(hit, miss)
+
+    # the filters and the projection of the parsed frame, applied by hand
+    frame = parse_collisions(source)
+    keep = np.ones(len(frame), dtype=bool)
+    for column, op, value in filters or []:
+        keep &= OPS[op](frame[column], value).to_numpy()
+    expected = frame[keep].reset_index(drop=True)
+    tm.assert_frame_equal(hit, expected[columns] if columns is not None else expected)
+
+
+def test_weather_hit_equals_miss(tmp_path):
+    source = shutil.copy(WEATHER, tmp_path)
+    filters = [('datetime', '>=', pd.Timestamp('2019-01-01')), ('icon', 'in', ['rain', 'cloudy'])]
+    miss = cached_table(source, parse_weather, ['datetime', 'icon', 'temp'], filters)
+    hit = cached_table(source, parse_weather, ['datetime', 'icon', 'temp'], filters)
+    tm.assert_frame_equal(hit, miss)
+    assert len(hit) > 0 and set(hit['icon']) <= {'rain', 'cloudy'}
+    assert os.listdir(tmp_path / loader.CACHE_DIR_NAME)  # the default cache is next to the source
+
+
+def counting(parse):
+    """``parse`` counting its calls, under the same name (the name keys the cache)."""
+    calls = []
+
+    @functools.wraps(parse)
+    def counted(path):
+        calls.append(path)
+        return parse(path)
+    return counted, calls
+
+
+@pytest.fixture
+def cached(tmp_path):
+    """A weather CSV, its cache, and a read counting the parses."""
+    source = str(shutil.copy(WEATHER, tmp_path))
+    parse, calls = counting(parse_weather)
+    read = functools.partial(cached_table, source, parse, cache_dir=str(tmp_path / 'cache'))
+    read()
+    assert len(calls) == 1
+    read()
+    assert len(calls) == 1
+    return source, read, calls
+
+
+def manifest(source, cache_dir):
+    with open(cache_paths(source, 'parse_weather', cache_dir)[1]) as f:
+        return json.load(f)
+
+
+def test_touched_source_is_not_parsed_again(cached, tmp_path):
+    source, read, calls = cached
+    stat = os.stat(source)
+    os.utime(source, (stat.st_atime + 100, stat.st_mtime + 100))
+    tm.assert_frame_equal(read(), parse_weather(source))
+    assert len(calls) == 1
+    # the new mtime is recorded, so the next read does not hash the file again
+    assert manifest(source, str(tmp_path / 'cache'))['mtime'] == os.stat(source).st_mtime
+
+
+def test_changed_content_of_the_same_size(cached):
+    source, read, calls = cached
+    with open(source) as f:
+        text = f.read()
+    edited = text.replace('2018-06-01,26.7', '2018-06-01,29.7', 1)
+    assert edited != text and len(edited) == len(text)
+    with open(source, 'w') as f:
+        f.write(edited)
+    stat = os.stat(source)
+    os.utime(source, (stat.st_atime, stat.st_mtime + 100))  # a clock coarser than the edit would not see it
+
+    frame = read()
+    assert len(calls) == 2
+    assert frame.loc[frame['datetime'] == '2018-06-01', 'tempmax'].tolist() == [29.7]
+    read()
+    assert len(calls) == 2
+
+
+def test_grown_source(cached):
+    source, read, calls = cached
+    before = read()
+    with open(source, 'a') as f:
+        f.write('new york,2020-10-02' + ',' * (len(before.columns) - 2) + '\n')
+    frame = read()
+    assert len(calls) == 2
+    assert len(frame) == len(before) + 1 and frame['datetime'].iloc[-1] == pd.Timestamp('2020-10-02')
+
+
+@pytest.mark.parametrize('change', ['version', 'parser', 'missing data'])
+def test_stale_cache(cached, tmp_path, monkeypatch, change):
+    source, read, calls = cached
+    data_path, manifest_path = cache_paths(source, 'parse_weather', str(tmp_path / 'cache'))
+    if change == 'version':
+        monkeypatch.setattr(loader, 'CACHE_VERSION', loader.CACHE_VERSION + 1)
+    elif change == 'parser':
+        with open(manifest_path) as f:
+            entry = json.load(f)
+        with open(manifest_path, 'w') as f:
+            json.dump(dict(entry, parser='parse_collisions'), f)
+    else:
+        os.remove(data_path)
+    read()
+    assert len(calls) == 2
@@ -0,0 +1,123 @@
+import json
+import os
+
+import pandas as pd
+import pandas.testing as tm
+import pytest
+
+from nyc_collisions import pipeline
+from nyc_collisions.pipeline import (OUTPUT_COLUMNS, PROGRESS_FILE, RAW_COLUMNS, SUCCESS_FILE, partition_dir,
+                                     read_partitions, run, transform_chunk, weather_icons)
+from nyc_collisions.projects import ROOT
+
+COLLISIONS = os.path.join(ROOT, 'Project 1', 'data', 'preprocessed-collisions.csv')
+WEATHER = os.path.join(ROOT, 'Project 2', 'data', 'weather2018.csv')
+FINAL = os.path.join(ROOT, 'Project 2', 'data', 'preprocessed-collisions-final.csv')
+CHUNKSIZE = 1000
+SUMMER = [(2018, month) for month in (6, 7, 8, 9)]
+
+
+@pytest.fixture(scope='module')
+def final():
+    """The output of the Project 2 notebook (the pipeline writes ZIP codes without the float suffix)."""
+    frame = pd.read_csv(FINAL, parse_dates=['CRASH_DATETIME'], dtype={'ZIP_CODE': str})
+    frame['ZIP_CODE'] = frame['ZIP_CODE'].str.replace(r'\.0$', '', regex=True)
+    return frame
+
+
+@pytest.fixture(scope='module', params=['renamed', 'raw'])
+def collisions(request, tmp_path_factory):
+    """Path of the collisions with the renamed columns of the repo, or those of the public dump."""
+    if request.param == 'renamed':
+        return COLLISIONS
+    path = tmp_path_factory.mktemp('raw') / 'collisions.csv'
+    pd.read_csv(COLLISIONS, dtype=str).rename(columns={v: k for k, v in RAW_COLUMNS.items()}).to_csv(path, index=False)
+    return str(path)
+
+
+def in_order(frame):
+    return frame.sort_values(OUTPUT_COLUMNS, ignore_index=True)
+
+
+def test_transform_chunk(collisions, final):
+    chunk = pd.read_csv(collisions, dtype={'ZIP CODE': str, 'ZIP_CODE': str})
+    result = transform_chunk(chunk, weather_icons(WEATHER), years=[2018]).reset_index(drop=True)
+    tm.assert_frame_equal(result, final)
+
+
+def test_run(collisions, final, tmp_path):
+    assert run(collisions, WEATHER, str(tmp_path), years=[2018], chunksize=CHUNKSIZE) == SUMMER
+    tm.assert_frame_equal(in_order(read_partitions(str(tmp_path))), in_order(final))
+    assert all(os.path.exists(os.path.join(partition_dir(str(tmp_path), *p), SUCCESS_FILE)) for p in SUMMER)
+    # a finished run has nothing left to do
+    assert run(collisions, WEATHER, str(tmp_path), years=[2018], chunksize=CHUNKSIZE) == SUMMER
+    tm.assert_frame_equal(in_order(read_partitions(str(tmp_path))), in_order(final))
+
+
+def counting_transform(monkeypatch, fail_at=None):
+    """Count the chunks transformed, raising at chunk ``fail_at`` like an interrupted run."""
+    calls = []
+
+    def transform(chunk, *args, **kwargs):
+        if len(calls) == fail_at:
+            raise KeyboardInterrupt
+        calls.append(len(chunk))
+        return transform_chunk(chunk, *args, **kwargs)
+    monkeypatch.setattr(pipeline, 'transform_chunk', transform)
+    return calls
+
+
+def test_interrupted_run_resumes(final, tmp_path, monkeypatch):
+    chunks = -(-len(pd.read_csv(COLLISIONS, usecols=[0])) // CHUNKSIZE)
+    counting_transform(monkeypatch, fail_at=3)
+    with pytest.raises(KeyboardInterrupt):
+        run(COLLISIONS, WEATHER, str(tmp_path), years=[2018], chunksize=CHUNKSIZE)
+    with open(tmp_path / PROGRESS_FILE) as f:
+        assert json.load(f)['chunks_done'] == 3
+    assert not any(os.path.exists(os.path.join(partition_dir(str(tmp_path), *p), SUCCESS_FILE)) for p in SUMMER)
+
+    calls = counting_transform(monkeypatch)
+    assert run(COLLISIONS, WEATHER, str(tmp_path), years=[2018], chunksize=CHUNKSIZE) == SUMMER
+    assert len(calls) == chunks - 3
+    tm.assert_frame_equal(in_order(read_partitions(str(tmp_path))), in_order(final))
+
+
+def part_files(out_dir, partition):
+    directory = partition_dir(out_dir, *partition)
+    return {name: os.stat(os.path.join(directory, name)).st_ino for name in os.listdir(directory)}
+
+
+def test_grown_input_keeps_finished_months(final, tmp_path):
+    # a dump in date order, first up to mid August, then with the rest of the summer
+    rows = pd.read_csv(COLLISIONS, dtype=str)
+    rows = rows.iloc[pd.to_datetime(rows['CRASH_DATE'] + ' ' + rows['CRASH_TIME']).argsort(kind='stable')]
+    dump, out_dir = tmp_path / 'collisions.csv', str(tmp_path / 'out')
+    crash = pd.to_datetime(rows['CRASH_DATE'])
+    rows[crash < '2018-08-15'].to_csv(dump, index=False)
+    assert run(str(dump), WEATHER, out_dir, years=[2018], chunksize=CHUNKSIZE) == SUMMER[:3]
+    before = {p: part_files(out_dir, p) for p in SUMMER[:3]}
+
+    rows.to_csv(dump, index=False)
+    assert run(str(dump), WEATHER, out_dir, years=[2018], chunksize=CHUNKSIZE) == SUMMER
+    # June and July are finished and kept; August, where the new days fall, is written again
+    assert [p for p in SUMMER[:3] if part_files(out_dir, p) == before[p]] == SUMMER[:2]
+    tm.assert_frame_equal(in_order(read_partitions(out_dir)), in_order(final))
+
+
+def test_other_settings_need_overwrite(final, tmp_path):
+    out_dir = str(tmp_path)
+    run(COLLISIONS, WEATHER, out_dir, years=[2018, 2020], chunksize=CHUNKSIZE)
+    notes = tmp_path / 'notes.txt'
+    notes.write_text('not written by the pipeline')
+    (tmp_path / 'year=2020').joinpath('README').write_text('nor this')
+
+    with pytest.raises(ValueError, match='overwrite'):
+        run(COLLISIONS, WEATHER, out_dir, years=[2018], chunksize=CHUNKSIZE)
+    assert (tmp_path / 'year=2020' / 'month=07').exists()
+
+    assert run(COLLISIONS, WEATHER, out_dir, years=[2018], chunksize=CHUNKSIZE, overwrite=True) == SUMMER
+    tm.assert_frame_equal(in_order(read_partitions(out_dir)), in_order(final))
+    # only the partitions the pipeline wrote were deleted
+    assert notes.read_text() == 'not written by the pipeline'
+    assert sorted(os.listdir(tmp_path / 'year=2020')) == ['README']
+    assert PROGRESS_FILE in os.listdir(tmp_path)
@@ -0,0 +1,126 @@
+import re
+
+import altair as alt
+import numpy as np
+import pandas as pd
+import pandas.testing as tm
+import pytest
+
+from nyc_collisions.expression import Unsupported, evaluate
+from nyc_collisions.schema import decoders, encode, encoded_chart, map_expression
+
+
+def make_frame(n=300, seed=0):
+    """Collisions with categorical columns: missing values, an unused category, numbers and unicode."""
+    rng = np.random.default_rng(seed)
+    borough = pd.Categorical(rng.choice(['BRONX', 'BROOKLYN', 'QUEENS', None], n),
+                             categories=['BRONX', 'BROOKLYN', 'QUEENS', 'STATEN ISLAND'])
+    return pd.DataFrame({
+        'BOROUGH': borough,
+        'ZIP_CODE': pd.Categorical(rng.choice([10001, 11201, 11368], n)),
+        'icon': pd.Categorical(rng.choice(['rain', 'clear-day', 'snow', None], n)),
+        'VEHICLE_TYPE_CODE1': rng.choice(['Sedan', 'Bike', 'Taxi "yellow"', 'Véhicule'], n),
+        'HOUR': rng.integers(0, 24, n),
+        'TOTAL_INJURED': rng.integers(0, 4, n),
+    })
+
+
+def decoded(frame, lookups):
+    """The encoded columns decoded by the expressions of :func:`decoders`."""
+    return frame.assign(**{column: evaluate(expression, frame) for column, expression in decoders(lookups).items()})
+
+
+def as_values(frame):
+    return frame.apply(lambda column: column.astype(object).where(column.notna(), None))
+
+
+def test_encode_categoricals():
+    frame = make_frame()
+    encoded, lookups = encode(frame)
+    assert list(lookups) == ['BOROUGH', 'ZIP_CODE', 'icon']
+    assert lookups['BOROUGH'] == ['BRONX', 'BROOKLYN', 'QUEENS', 'STATEN ISLAND']  # unused categories kept
+    assert lookups['ZIP_CODE'] == [10001, 11201, 11368] and type(lookups['ZIP_CODE'][0]) is int
+    assert all(encoded[column].dtype.kind == 'i' for column in lookups)
+    assert (encoded['BOROUGH'] == -1).sum() == frame['BOROUGH'].isna().sum() > 0
+    tm.assert_frame_equal(encoded.drop(columns=list(lookups)), frame.drop(columns=list(lookups)))
+    assert isinstance(frame['BOROUGH'].dtype, pd.CategoricalDtype)  # the frame is not changed
+
+
+@pytest.mark.parametrize('columns', [None, ['BOROUGH', 'VEHICLE_TYPE_CODE1'], ['HOUR'], []])
+def test_round_trip(columns):
+    frame = make_frame()
+    encoded, lookups = encode(frame, columns)
+    # in Python with the codes and labels, and by evaluating the decoding expressions
+    restored = encoded.assign(**{column: pd.Categorical.from_codes(encoded[column], labels)
+                                 for column, labels in lookups.items()})
+    tm.assert_frame_equal(as_values(restored), as_values(frame))
+    tm.assert_frame_equal(as_values(decoded(encoded, lookups)), as_values(frame))
+
+
+def scenegraph_texts(node):
+    if isinstance(node, dict):
+        if node.get('marktype') == 'text' and node.get('role') == 'mark':
+            yield from (item['text'] for item in node['items'])
+        for value in node.values():
+            yield from scenegraph_texts(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from scenegraph_texts(value)
+
+
+def test_round_trip_in_vega():
+    vl_convert = pytest.importorskip('vl_convert')
+    frame = make_frame(n=60).reset_index(names='row')
+    columns = ['BOROUGH', 'ZIP_CODE', 'icon', 'VEHICLE_TYPE_CODE1']
+    # every decoded value as JSON (null stays null), one text mark per row
+    label = " + '|' + ".join(['datum.row'] + [f'(isValid(datum[{c!r}]) ? datum[{c!r}] : "null")' for c in columns])
+    chart = encoded_chart(frame, columns=columns).transform_calculate(label=label).mark_text().encode(text='label:N')
+    rows = sorted((text.split('|') for text in scenegraph_texts(vl_convert.vegalite_to_scenegraph(chart.to_dict()))),
+                  key=lambda row: int(row[0]))
+    expected = as_values(frame[columns].astype(object).astype(str).where(frame[columns].notna(), 'null'))
+    assert [row[1:] for row in rows] == expected.values.tolist()
+
+
+def render(chart):
+    vl_convert = pytest.importorskip('vl_convert')
+    return re.sub(r'(gradient_|clip)\d+', r'\1', vl_convert.vegalite_to_svg(chart.to_dict()))
+
+
+def test_encoded_chart_renders_as_the_plain_chart():
+    frame = make_frame()
+    selection = alt.selection_point(fields=['BOROUGH'], bind='legend')
+
+    def build(base):
+        return base.transform_filter(alt.datum.icon != 'snow').transform_calculate(
+            emoji=map_expression('icon', {'rain': '🌧', 'clear-day': '☀'}),
+        ).mark_bar().encode(
+            x=alt.X('BOROUGH:N', sort='-y'),
+            y='sum(TOTAL_INJURED):Q',
+            color=alt.Color('icon:N'),
+            opacity=alt.condition(selection, alt.value(1), alt.value(0.3)),
+            tooltip=['BOROUGH:N', 'ZIP_CODE:N', 'emoji:N', 'count():Q'],
+        ).add_params(selection)
+
+    plain = render(build(alt.Chart(frame)))
+    encoded = build(encoded_chart(frame))
+    # the rows carry codes, the labels are in the spec once
+    values = encoded.to_dict()['datasets']
+    assert all(isinstance(row['BOROUGH'], int) for rows in values.values() for row in rows)
+    assert render(encoded) == plain
+
+
+def test_decoders_without_categories():
+    frame = make_frame()[['HOUR', 'TOTAL_INJURED']]
+    encoded, lookups = encode(frame)
+    assert lookups == {}
+    tm.assert_frame_equal(encoded, frame)
+    assert 'transform' not in encoded_chart(frame).mark_point().to_dict()
+
+
+def test_map_expression():
+    expression = map_expression('icon', {'rain': '🌧', 'snow': '❄', 'Taxi "yellow"': 'taxi'})
+    frame = pd.DataFrame({'icon': ['rain', 'snow', 'Taxi "yellow"']})
+    assert evaluate(expression, frame).tolist() == ['🌧', '❄', 'taxi']
+    # a value without emoji maps to undefined, which only the browser tells from null
+    with pytest.raises(Unsupported):
+        evaluate(expression, pd.DataFrame({'icon': ['rain', 'fog']}))
@@ -0,0 +1,280 @@
+import email.utils
+import gzip
+import http.client
+import json
+import re
+import threading
+import urllib.request
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from nyc_collisions.projects import PROJECTS, import_charts, working_directory
+from nyc_collisions.service import (DataService, Response, ResultCache, ServiceError, _accepts_gzip, aggregate_url,
+                                    make_server, publish, run_query)
+from nyc_collisions.spec import compile_spec
+
+ROWS = [{'x': i, 'label': f'row {i}'} for i in range(200)]  # about 4 KB, gzipped
+SMALL_ROWS = [{'x': 1}]
+
+
+@pytest.fixture
+def server(tmp_path):
+    server = make_server(port=0, service=DataService(str(tmp_path)), quiet=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def dataset_path(server, rows):
+    spec = publish({'data': {'name': 'source'}, 'datasets': {'source': rows}}, 'http://test',
+                   server.service.datasets_dir)
+    return spec['data']['url'].removeprefix('http://test')
+
+
+def get(server, path, **headers):
+    connection = http.client.HTTPConnection('127.0.0.1', server.server_port, timeout=10)
+    try:
+        connection.request('GET', path, headers=headers)
+        response = connection.getresponse()
+        return response.status, dict(response.getheaders()), response.read()
+    finally:
+        connection.close()
+
+
+# ------------------------------ HTTP ------------------------------ #
+
+def test_dataset(server):
+    status, headers, body = get(server, dataset_path(server, ROWS))
+    assert status == 200
+    assert json.loads(body) == ROWS
+    assert headers['Content-Type'] == 'application/json'
+    assert 'immutable' in headers['Cache-Control']
+    assert headers['Access-Control-Allow-Origin'] == '*'
+
+
+def test_etag_revalidation(server):
+    path = dataset_path(server, ROWS)
+    _, headers, _ = get(server, path)
+    etag = headers['ETag']
+    for if_none_match in [etag, f'W/{etag}', f'"other", {etag}', '*']:
+        status, headers, body = get(server, path, **{'If-None-Match': if_none_match})
+        assert (status, body) == (304, b'')
+        assert headers['ETag'] == etag
+    status, _, body = get(server, path, **{'If-None-Match': '"other"'})
+    assert status == 200 and json.loads(body) == ROWS
+
+
+def test_if_modified_since(server):
+    path = dataset_path(server, ROWS)
+    _, headers, _ = get(server, path)
+    modified = email.utils.parsedate_to_datetime(headers['Last-Modified']).timestamp()
+    assert get(server, path, **{'If-Modified-Since': headers['Last-Modified']})[0] == 304
+    assert get(server, path, **{'If-Modified-Since': email.utils.formatdate(modified + 60, usegmt=True)})[0] == 304
+    assert get(server, path, **{'If-Modified-Since': email.utils.formatdate(modified - 60, usegmt=True)})[0] == 200
+    assert get(server, path, **{'If-Modified-Since': 'yesterday'})[0] == 200
+    # If-None-Match takes precedence
+    assert get(server, path, **{'If-None-Match': '"other"', 'If-Modified-Since': headers['Last-Modified']})[0] == 200
+
+
+@pytest.mark.parametrize('accept, gzipped', [
+    ('gzip', True), ('deflate, gzip;q=0.5', True), ('*', True), ('GZIP', True), ('br;q=1.0, gzip; q=0.8', True),
+    ('', False), ('identity', False), ('gzip;q=0', False), ('gzip;q=0, *', False), ('*;q=0', False),
+    ('gzip;q=x', False), ('gzip;q=', False), ('gzip;q=nan', False),
+])
+def test_gzip_negotiation(server, accept, gzipped):
+    assert _accepts_gzip(accept) == gzipped
+    status, headers, body = get(server, dataset_path(server, ROWS), **{'Accept-Encoding': accept})
+    assert status == 200
+    assert headers.get('Content-Encoding') == ('gzip' if gzipped else None)
+    assert json.loads(gzip.decompress(body) if gzipped else body) == ROWS
+    assert int(headers['Content-Length']) == len(body)
+    assert headers['Vary'] == 'Accept-Encoding'
+
+
+def test_small_bodies_are_not_gzipped(server):
+    _, headers, body = get(server, dataset_path(server, SMALL_ROWS), **{'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in headers
+    assert json.loads(body) == SMALL_ROWS
+
+
+@pytest.mark.parametrize('path, status', [
+    ('/nothing', 404), ('/datasets/data-' + '0' * 32 + '.json', 404), ('/aggregates/nothing', 404),
+    ('/aggregates/weather?project=project2', 400), ('/aggregates/collisions?month=13', 400),
+    ('/aggregates/collisions?colour=red', 400), ('/aggregates/collisions?hours=8-', 400),
+])
+def test_errors(server, path, status):
+    code, _, body = get(server, path)
+    assert code == status
+    assert 'error' in json.loads(body)
+
+
+def test_responses_are_cached(server):
+    path = dataset_path(server, ROWS)
+    get(server, path)
+    get(server, path, **{'Accept-Encoding': 'gzip'})
+    assert (server.service.cache.misses, server.service.cache.hits) == (1, 1)
+
+
+# --------------------------- result cache --------------------------- #
+
+def response(size):
+    return Response(b'x' * size, 0)
+
+
+def test_result_cache_is_bounded_in_bytes():
+    cache = ResultCache(max_bytes=1000)
+    for key in 'abc':
+        cache.put(key, response(300))
+    assert (len(cache), cache.nbytes) == (3, 900)
+    cache.get('a')  # the least recently used is now b
+    cache.put('d', response(300))
+    assert [key for key in 'abcd' if cache.get(key) is not None] == ['a', 'c', 'd']
+    assert cache.nbytes == 900
+
+    cache.put('c', response(100))  # a new value of a key replaces its size
+    assert cache.nbytes == 700
+    cache.put('e', response(1001))  # larger than the whole cache: not kept, nothing evicted
+    assert cache.get('e') is None and len(cache) == 3
+    cache.put('f', response(900))  # evicts a and d, the least recently used, down to the bound
+    assert [key for key in 'acdf' if cache.get(key) is not None] == ['c', 'f']
+    assert cache.nbytes == 1000
+
+
+def test_result_cache_counts_gzipped_bodies():
+    body = json.dumps(ROWS).encode()
+    assert Response(body, 0).nbytes == len(body) + len(gzip.compress(body))
+    assert Response(b'{}', 0).nbytes == 2
+
+
+# ------------------------------ queries ------------------------------ #
+
+INFO = {'datetime': 'CRASH_DATETIME', 'hour': None, 'weight': None}
+
+
+def make_collisions(n=2000, seed=0):
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp('2018-01-01')
+    return pd.DataFrame({
+        'CRASH_DATETIME': start + pd.to_timedelta(rng.integers(0, 3 * 365 * 24 * 60, n), unit='min'),
+        'BOROUGH': pd.Categorical(rng.choice(['BRONX', 'BROOKLYN', 'QUEENS', None], n)),
+        'VEHICLE_TYPE_CODE1': rng.choice(['Taxi', 'Sedan', 'Bike'], n),
+        'TOTAL_KILLED': rng.choice([0, 0, 0, 1], n),
+        'TOTAL_INJURED': rng.choice([0.0, 1.0, 2.0, np.nan], n),
+    })
+
+
+def reference(frame, keep, groupby, weight=None):
+    frame = frame[keep]
+    times = frame['CRASH_DATETIME'].dt
+    derived = {'year': times.year, 'month': times.month, 'hour': times.hour}
+    # the service groups the values, not the categories
+    keys = [pd.Series(np.asarray(derived.get(name, frame.get(name))), index=frame.index, name=name) for name in groupby]
+    counts = frame[weight] if weight else pd.Series(1, index=frame.index)
+    grouped = pd.DataFrame({'count': counts, 'sum_TOTAL_KILLED': frame['TOTAL_KILLED'],
+                            'mean_TOTAL_INJURED': frame['TOTAL_INJURED']}).groupby(keys)
+    return grouped.agg(count=('count', 'sum'), sum_TOTAL_KILLED=('sum_TOTAL_KILLED', 'sum'),
+                       mean_TOTAL_INJURED=('mean_TOTAL_INJURED', 'mean')).reset_index()
+
+
+def check(result, expected):
+    assert list(result.columns) == list(expected.columns)
+    assert len(result) == len(expected)
+    for column in result.columns:
+        if result[column].dtype.kind in 'iufb':
+            np.testing.assert_allclose(result[column].to_numpy(float), expected[column].to_numpy(float), rtol=1e-12)
+        else:
+            assert result[column].astype(str).tolist() == expected[column].astype(str).tolist()
+
+
+FRAME = make_collisions()
+TIMES = FRAME['CRASH_DATETIME'].dt
+QUERIES = [
+    ({}, np.ones(len(FRAME), dtype=bool)),
+    ({'year': '2018,2020'}, TIMES.year.isin([2018, 2020])),
+    ({'month': '6, July,AUGUST'}, TIMES.month.isin([6, 7, 8])),
+    ({'borough': 'bronx,Queens'}, FRAME['BOROUGH'].isin(['BRONX', 'QUEENS'])),
+    ({'borough': 'STATEN ISLAND'}, np.zeros(len(FRAME), dtype=bool)),
+    ({'vehicle': 'taxi'}, FRAME['VEHICLE_TYPE_CODE1'] == 'Taxi'),
+    ({'hours': '8-17'}, TIMES.hour.between(8, 17)),
+    ({'hours': '23'}, TIMES.hour == 23),
+    ({'year': '2019', 'month': '12', 'borough': 'BROOKLYN', 'vehicle': 'Sedan,Bike', 'hours': '0-5'},
+     (TIMES.year == 2019) & (TIMES.month == 12) & (FRAME['BOROUGH'] == 'BROOKLYN')
+     & FRAME['VEHICLE_TYPE_CODE1'].isin(['Sedan', 'Bike']) & (TIMES.hour <= 5)),
+]
+
+
+@pytest.mark.parametrize('groupby', [['year', 'hour'], ['BOROUGH'], ['month', 'VEHICLE_TYPE_CODE1']])
+@pytest.mark.parametrize('filters, keep', QUERIES)
+def test_run_query(filters, keep, groupby):
+    params = dict(filters, groupby=','.join(groupby), sum='TOTAL_KILLED', mean='TOTAL_INJURED')
+    result = run_query(FRAME, INFO, params)
+    expected = reference(FRAME, np.asarray(keep), groupby)
+    if 'BOROUGH' in groupby:  # missing boroughs are a group too
+        missing = FRAME[np.asarray(keep) & FRAME['BOROUGH'].isna().to_numpy()]
+        assert result['BOROUGH'].isna().sum() == (len(missing) > 0)
+        assert result.loc[result['BOROUGH'].isna(), 'count'].sum() == len(missing)
+        result = result[result['BOROUGH'].notna()].reset_index(drop=True)
+    check(result, expected)
+
+
+def test_query_totals():
+    result = run_query(FRAME, INFO, {'sum': 'TOTAL_KILLED', 'year': '2020'})
+    assert result.to_dict('records') == [{'count': (TIMES.year == 2020).sum(),
+                                          'sum_TOTAL_KILLED': FRAME.loc[TIMES.year == 2020, 'TOTAL_KILLED'].sum()}]
+
+
+def test_weighted_source():
+    daily = FRAME.assign(collisions=np.arange(len(FRAME)) % 5 + 1)
+    info = dict(INFO, weight='collisions')
+    check(run_query(daily, info, {'groupby': 'year', 'sum': 'TOTAL_KILLED', 'mean': 'TOTAL_INJURED'}),
+          reference(daily, np.ones(len(daily), dtype=bool), ['year'], weight='collisions'))
+
+
+@pytest.mark.parametrize('params', [{'month': 'Smarch'}, {'year': 'last'}, {'hours': 'noon'}, {'groupby': 'colour'},
+                                    {'sum': 'BOROUGH'}, {'mean': 'nothing'}, {'colour': 'red'}])
+def test_bad_queries(params):
+    with pytest.raises(ServiceError) as error:
+        run_query(FRAME, INFO, params)
+    assert error.value.status == 400
+
+
+def test_aggregate_url():
+    url = aggregate_url('daily', 'http://host:1', groupby=['year', 'hour'], mean=['collisions'], year=None,
+                        hours=(8, 17), borough='THE BRONX')
+    assert url == 'http://host:1/aggregates/daily?groupby=year,hour&mean=collisions&hours=8-17&borough=THE+BRONX'
+
+
+# --------------------------- chart consumer --------------------------- #
+
+def inline_urls(node):
+    """The spec with the data of every URL fetched and inlined."""
+    if isinstance(node, dict):
+        data = node.get('data')
+        if isinstance(data, dict) and 'url' in data:
+            with urllib.request.urlopen(data['url'], timeout=30) as response:
+                node['data'] = {'values': json.load(response)}
+        for value in node.values():
+            inline_urls(value)
+    elif isinstance(node, list):
+        for item in node:
+            inline_urls(item)
+    return node
+
+
+def test_hourly_averages_from_the_service(server):
+    # vl-convert would fetch the URL while holding the GIL, so the server thread could not answer it
+    vl_convert = pytest.importorskip('vl_convert')
+    module = import_charts('project1')
+    with working_directory(PROJECTS['project1'][0]):
+        daily = module.default_daily()
+        local = compile_spec(module.charts.get('c3', daily))[0]
+        served = compile_spec(module.charts.get('c3', daily, f'http://127.0.0.1:{server.server_port}'))[0]
+    assert '/aggregates/daily?' in json.dumps(served)
+
+    def render(spec):
+        return re.sub(r'(gradient_|clip)\d+', r'\1', vl_convert.vegalite_to_svg(spec))
+    assert render(inline_urls(served)) == render(local)
@@ -0,0 +1,185 @@
+import base64
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from nyc_collisions import spatial_bins
+from nyc_collisions.spatial_bins import (DARK2, aggregate, extent, fit_bounds, hex_centers, inverse_mercator_y,
+                                         mercator_y, png_bytes, raster_frame, rasterize, square_centers)
+
+
+def make_frame(n=3000, seed=0):
+    """Clustered collisions over New York, some without coordinates."""
+    rng = np.random.default_rng(seed)
+    centers = rng.uniform([40.55, -74.2], [40.9, -73.75], (8, 2))
+    lat, lon = (centers[rng.integers(0, 8, n)] + rng.normal(0, 0.03, (n, 2))).T
+    frame = pd.DataFrame({
+        'LATITUDE': lat, 'LONGITUDE': lon,
+        'BOROUGH': pd.Categorical(rng.choice(['BRONX', 'BROOKLYN', 'QUEENS'], n)),
+        'TOTAL_INJURED': rng.integers(0, 4, n),
+    })
+    frame.loc[rng.random(n) < 0.03, 'LATITUDE'] = np.nan
+    return frame
+
+
+def nearest_centers(x, y, size, method):
+    """Brute force: the nearest of all the cell centers around every point."""
+    if method == 'hexbin':
+        radius = size / np.sqrt(3)
+        # every lattice point (q, r) of the pointy-top hexagons within a few rows
+        r0, q0 = np.floor(y / (1.5 * radius)), np.floor(x / size - np.floor(y / (1.5 * radius)) / 2)
+        dq, dr = np.meshgrid(np.arange(-3, 4), np.arange(-3, 4))
+        q, r = q0[:, None] + dq.ravel(), r0[:, None] + dr.ravel()
+        cx, cy = size * (q + r / 2), 1.5 * radius * r
+    else:
+        di, dj = np.meshgrid(np.arange(-2, 3), np.arange(-2, 3))
+        cx = (np.floor(x / size)[:, None] + di.ravel() + 0.5) * size
+        cy = (np.floor(y / size)[:, None] + dj.ravel() + 0.5) * size
+    distance = np.hypot(cx - x[:, None], cy - y[:, None])
+    best = distance.argmin(axis=1)
+    rows = np.arange(len(x))
+    return cx[rows, best], cy[rows, best], distance[rows, best]
+
+
+@pytest.mark.parametrize('method, centers', [('hexbin', hex_centers), ('grid', square_centers)])
+@pytest.mark.parametrize('size', [0.002, 0.01, 0.05])
+def test_points_go_to_their_nearest_center(method, centers, size):
+    frame = make_frame().dropna()
+    x, y = frame['LONGITUDE'].to_numpy(), mercator_y(frame['LATITUDE'])
+    cx, cy = centers(x, y, size)
+    _, _, nearest = nearest_centers(x, y, size, method)
+    # the same distance, as a point on an edge is as near to either cell
+    np.testing.assert_allclose(np.hypot(cx - x, cy - y), nearest, rtol=0, atol=1e-12)
+    if method == 'grid':
+        assert (np.abs(cx - x) <= size / 2).all() and (np.abs(cy - y) <= size / 2).all()
+
+
+def reference(frame, method, size, keep=(), weight=None):
+    """``aggregate`` with the brute force centers and pandas."""
+    frame = frame.dropna(subset=['LATITUDE', 'LONGITUDE'])
+    cx, cy, _ = nearest_centers(frame['LONGITUDE'].to_numpy(), mercator_y(frame['LATITUDE']), size, method)
+    cells = frame[list(keep)].assign(LATITUDE=inverse_mercator_y(cy).round(6), LONGITUDE=cx.round(6),
+                                     count=frame[weight].to_numpy() if weight else 1)
+    return cells.groupby(list(keep) + ['LATITUDE', 'LONGITUDE'], observed=True)['count'].sum().reset_index()
+
+
+def in_order(cells):
+    cells = cells.astype({column: str for column in cells.columns if cells[column].dtype.kind not in 'if'})
+    return cells.sort_values(list(cells.columns[:-1]), ignore_index=True)
+
+
+@pytest.mark.parametrize('method', ['hexbin', 'grid'])
+@pytest.mark.parametrize('keep, weight', [((), None), (('BOROUGH',), None), (('BOROUGH',), 'TOTAL_INJURED')])
+def test_aggregate(method, keep, weight):
+    frame = make_frame()
+    size = 0.004
+    cells = aggregate(frame, method, size=size, keep=keep, weight=weight)
+    assert list(cells.columns) == list(keep) + ['LATITUDE', 'LONGITUDE', 'count']
+    valid = frame.dropna(subset=['LATITUDE', 'LONGITUDE'])
+    assert cells['count'].sum() == (valid[weight].sum() if weight else len(valid))
+    assert not cells.duplicated(list(keep) + ['LATITUDE', 'LONGITUDE']).any()
+    pd.testing.assert_frame_equal(in_order(cells), in_order(reference(frame, method, size, keep, weight)),
+                                  check_dtype=False)
+
+
+@pytest.mark.parametrize('zoom', [0.5, 1, 4])
+def test_default_size_follows_the_zoom(zoom):
+    frame = make_frame()
+    valid = frame.dropna()
+    size = spatial_bins.cell_size(extent(valid['LATITUDE'], valid['LONGITUDE']), 350, 400, zoom)
+    cells = aggregate(frame, 'grid', zoom=zoom)
+    pd.testing.assert_frame_equal(cells, aggregate(frame, 'grid', size=size))
+    assert cells['count'].sum() == len(valid)
+    # about CELL_PIXELS pixels per cell at zoom 1 on the longest side of the map
+    assert size * zoom == pytest.approx(spatial_bins.CELL_PIXELS * max(
+        (np.ptp(valid['LONGITUDE'])) / 350, np.ptp(mercator_y(valid['LATITUDE'])) / 400))
+
+
+def test_mercator_round_trip():
+    lat = np.linspace(-80, 80, 33)
+    np.testing.assert_allclose(inverse_mercator_y(mercator_y(lat)), lat, atol=1e-10)
+    assert mercator_y(0) == 0
+
+
+def decode(png):
+    image = pytest.importorskip('PIL.Image').open(io.BytesIO(png))
+    assert image.mode == 'RGBA'
+    return np.asarray(image)
+
+
+def test_png_encoder():
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 256, (37, 53, 4), dtype=np.uint8)
+    assert np.array_equal(decode(png_bytes(image)), image)
+    url = spatial_bins.data_url(image)
+    assert url.startswith('data:image/png;base64,')
+    assert np.array_equal(decode(base64.b64decode(url.split(',', 1)[1])), image)
+
+
+def pixels(lat, lon, bounds, width, height):
+    """Row and column of every point, one at a time, for the points in ``bounds`` (edges included)."""
+    x0, y0, x1, y1 = bounds
+    found = []
+    for a, b in zip(lat, lon):
+        y = float(mercator_y(a))
+        if x0 <= b <= x1 and y0 <= y <= y1:
+            found.append((min(int((y1 - y) / (y1 - y0) * height), height - 1),
+                          min(int((b - x0) / (x1 - x0) * width), width - 1)))
+    return found
+
+
+@pytest.mark.parametrize('width, height', [(350, 400), (120, 60)])
+def test_rasterize(width, height):
+    frame = make_frame().dropna()
+    lat, lon = frame['LATITUDE'].to_numpy(), frame['LONGITUDE'].to_numpy()
+    codes = frame['BOROUGH'].cat.codes.to_numpy()
+    image = rasterize(lat, lon, codes, width=width, height=height)
+    assert image.shape == (height, width, 4) and image.dtype == np.uint8
+    decoded = decode(png_bytes(image))
+    assert decoded.shape == (height, width, 4)
+    assert np.array_equal(decoded, image)
+
+    # the pixels with points, every point included (those on the edges of the extent too), are the visible ones
+    expected = np.zeros((height, width), dtype=int)
+    for row, col in pixels(lat, lon, extent(lat, lon), width, height):
+        expected[row, col] += 1
+    assert np.array_equal(decoded[..., 3] > 0, expected > 0)
+    assert expected.sum() == len(frame)
+    # more points, more opaque; the busiest pixel fully so
+    alpha = decoded[..., 3].astype(int)
+    order = np.argsort(expected[expected > 0], kind='stable')
+    assert (np.diff(alpha[expected > 0][order]) >= 0).all()
+    assert alpha.max() == 255
+
+
+def test_rasterize_colors_the_dominant_category():
+    lat, lon = np.full(5, 40.7), np.full(5, -73.9)
+    bounds = (-74.0, float(mercator_y(40.6)), -73.8, float(mercator_y(40.8)))
+    image = rasterize(lat, lon, [2, 2, 1, 2, 1], bounds, width=10, height=10)
+    (row,), (col,) = np.nonzero(image[..., 3])
+    assert '#%02x%02x%02x' % tuple(image[row, col, :3]) == DARK2[2]
+    weighted = rasterize(lat, lon, [2, 2, 1, 2, 1], bounds, width=10, height=10, weights=[1, 1, 5, 1, 5])
+    assert '#%02x%02x%02x' % tuple(weighted[row, col, :3]) == DARK2[1]
+
+
+def test_rasterize_outside_bounds():
+    image = rasterize([40.7], [-73.9], bounds=(-75.0, 50.0, -74.5, 51.0), width=20, height=20)
+    assert not image[..., 3].any()
+
+
+def test_raster_frame():
+    frame = make_frame()
+    table = raster_frame(frame, 'BOROUGH', width=200, height=150)
+    assert len(table) == 1
+    url = table['url'].iloc[0]
+    image = decode(base64.b64decode(url.split(',', 1)[1]))
+    assert image.shape == (150, 200, 4)
+    valid = frame.dropna()
+    bounds = fit_bounds(extent(valid['LATITUDE'], valid['LONGITUDE']), 200, 150)
+    expected = np.zeros((150, 200), dtype=bool)
+    for row, col in pixels(valid['LATITUDE'], valid['LONGITUDE'], bounds, 200, 150):
+        expected[row, col] = True
+    assert np.array_equal(image[..., 3] > 0, expected)
+    assert expected.sum() > 100
@@ -0,0 +1,192 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from nyc_collisions.crossfilter import Crossfilter
+from nyc_collisions.spatial_index import GridIndex, haversine, points_in_polygon
+
+
+def make_points(n=3000, seed=0):
+    """Clustered points over New York, some without coordinates."""
+    rng = np.random.default_rng(seed)
+    centers = rng.uniform([40.55, -74.2], [40.9, -73.75], (8, 2))
+    lat, lon = (centers[rng.integers(0, 8, n)] + rng.normal(0, 0.03, (n, 2))).T
+    lat[rng.random(n) < 0.05] = np.nan
+    lon[rng.random(n) < 0.02] = np.nan
+    return lat, lon
+
+
+def boxes(lat, lon, count, seed):
+    """Random boxes, from empty to larger than the points, with their corners in any order."""
+    rng = np.random.default_rng(seed)
+    for _ in range(count):
+        lat0, lat1 = rng.uniform(np.nanmin(lat) - 0.05, np.nanmax(lat) + 0.05, 2)
+        lon0, lon1 = rng.uniform(np.nanmin(lon) - 0.05, np.nanmax(lon) + 0.05, 2)
+        yield lat0, lon0, lat1, lon1
+
+
+def in_box(lat, lon, lat0, lon0, lat1, lon1):
+    (lat0, lat1), (lon0, lon1) = sorted((lat0, lat1)), sorted((lon0, lon1))
+    return (lat >= lat0) & (lat <= lat1) & (lon >= lon0) & (lon <= lon1)
+
+
+def same_rows(rows, mask):
+    assert len(rows) == len(set(rows.tolist()))
+    assert np.array_equal(np.sort(rows), np.flatnonzero(mask))
+
+
+@pytest.mark.parametrize('seed', range(3))
+@pytest.mark.parametrize('cell_size', [None, 0.004, 0.05])
+def test_bbox(seed, cell_size):
+    lat, lon = make_points(seed=seed)
+    weights = np.random.default_rng(seed).integers(1, 20, len(lat))
+    index = GridIndex(lat, lon, cell_size=cell_size)
+    weighted = GridIndex(lat, lon, cell_size=cell_size, weights=weights)
+    for box in boxes(lat, lon, 40, seed):
+        expected = in_box(lat, lon, *box)
+        same_rows(index.bbox(*box), expected)
+        assert index.bbox_count(*box) == expected.sum()
+        assert weighted.bbox_count(*box) == weights[expected].sum()
+
+
+def test_float_weights():
+    lat, lon = make_points()
+    weights = np.random.default_rng(1).random(len(lat))
+    index = GridIndex(lat, lon, weights=weights)
+    for box in boxes(lat, lon, 20, 1):
+        assert index.bbox_count(*box) == pytest.approx(weights[in_box(lat, lon, *box)].sum())
+
+
+def lattice(cell_size, n=12):
+    """Points on the corners of the grid cells: every one is on the edge of four cells."""
+    lat, lon = np.meshgrid(40.5 + cell_size * np.arange(n), -74.1 + cell_size * np.arange(n), indexing='ij')
+    return lat.ravel(), lon.ravel()
+
+
+@pytest.mark.parametrize('cell_size', [0.25, 0.01])
+def test_points_on_cell_edges(cell_size):
+    lat, lon = lattice(cell_size)
+    index = GridIndex(lat, lon, cell_size=cell_size)
+    values_lat, values_lon = np.unique(lat), np.unique(lon)
+    rng = np.random.default_rng(0)
+    for _ in range(60):
+        # bounds on the points themselves, which the box includes
+        i0, i1 = np.sort(rng.integers(0, 12, 2))
+        j0, j1 = np.sort(rng.integers(0, 12, 2))
+        box = values_lat[i0], values_lon[j0], values_lat[i1], values_lon[j1]
+        expected = in_box(lat, lon, *box)
+        assert expected.sum() == (i1 - i0 + 1) * (j1 - j0 + 1)
+        same_rows(index.bbox(*box), expected)
+        assert index.bbox_count(*box) == expected.sum()
+
+
+def test_bbox_boundary_is_inclusive():
+    lat, lon = make_points()
+    index = GridIndex(lat, lon)
+    row = int(np.flatnonzero(np.isfinite(lat) & np.isfinite(lon))[0])
+    # a degenerate box on one point, and boxes with that point on each side
+    assert index.bbox(lat[row], lon[row], lat[row], lon[row]).tolist() == [row]
+    for box in [(lat[row], lon[row] - 0.1, lat[row] + 0.1, lon[row] + 0.1),
+                (lat[row] - 0.1, lon[row] - 0.1, lat[row], lon[row] + 0.1),
+                (lat[row] - 0.1, lon[row], lat[row] + 0.1, lon[row] + 0.1),
+                (lat[row] - 0.1, lon[row] - 0.1, lat[row] + 0.1, lon[row])]:
+        assert row in index.bbox(*box)
+        same_rows(index.bbox(*box), in_box(lat, lon, *box))
+    # the extreme points of the index are on the boundary of its grid
+    for box in [(np.nanmin(lat), -180, np.nanmin(lat), 180), (np.nanmax(lat), -180, np.nanmax(lat), 180),
+                (-90, np.nanmin(lon), 90, np.nanmin(lon)), (-90, np.nanmax(lon), 90, np.nanmax(lon))]:
+        expected = in_box(lat, lon, *box)
+        assert expected.sum() >= 1
+        same_rows(index.bbox(*box), expected)
+
+
+def test_empty_results():
+    lat, lon = make_points()
+    index = GridIndex(lat, lon)
+    for box in [(41.5, -74, 41.6, -73.9), (40.6, -75, 40.7, -74.9), (40.7, -73.9, 40.7, -73.9)]:
+        assert len(index.bbox(*box)) == 0
+        assert index.bbox_count(*box) == 0
+    assert len(index.radius(41.5, -73.9, 1000)) == 0
+    assert len(index.radius(40.7, -73.9, 0)) == 0
+    assert len(index.polygon([[(-73, 41), (-72, 41), (-72, 42), (-73, 41)]])) == 0
+    assert not index.mask(index.bbox(41.5, -74, 41.6, -73.9)).any()
+
+
+@pytest.mark.parametrize('lat, lon', [([], []), ([np.nan, 40.7], [-73.9, np.nan])])
+def test_empty_index(lat, lon):
+    index = GridIndex(lat, lon)
+    assert len(index) == 0
+    assert len(index.bbox(-90, -180, 90, 180)) == 0
+    assert index.bbox_count(-90, -180, 90, 180) == 0
+    assert len(index.radius(40.7, -73.9, 1e6)) == 0
+    assert len(index.polygon([[(-180, -90), (180, -90), (0, 90)]])) == 0
+    assert index.mask([]).shape == (len(lat),)
+
+
+@pytest.mark.parametrize('seed', range(3))
+@pytest.mark.parametrize('cell_size', [None, 0.003])
+def test_radius(seed, cell_size):
+    lat, lon = make_points(seed=seed)
+    index = GridIndex(lat, lon, cell_size=cell_size)
+    rng = np.random.default_rng(seed)
+    valid = np.flatnonzero(np.isfinite(lat) & np.isfinite(lon))
+    # from within a cell to across many, around points and anywhere
+    for meters in [10, 150, 400, 1500, 6000, 40000]:
+        for center in [(lat[rng.choice(valid)], lon[rng.choice(valid)]), tuple(rng.uniform([40.5, -74.3], [41, -73.7]))]:
+            with np.errstate(invalid='ignore'):
+                expected = haversine(*center, lat, lon) <= meters
+            same_rows(index.radius(*center, meters), expected)
+
+
+def test_radius_on_a_point():
+    lat, lon = lattice(0.01)
+    index = GridIndex(lat, lon, cell_size=0.01)
+    rows = index.radius(lat[30], lon[30], 1)
+    assert rows.tolist() == [30]
+    # the neighbors one cell away are 843 m away in longitude and 1112 m in latitude
+    assert sorted(index.radius(lat[30], lon[30], 900).tolist()) == [29, 30, 31]
+    assert sorted(index.radius(lat[30], lon[30], 1112.5).tolist()) == [18, 29, 30, 31, 42]
+
+
+def test_polygon():
+    lat, lon = make_points()
+    index = GridIndex(lat, lon)
+    exterior = [(-74.1, 40.6), (-73.8, 40.62), (-73.85, 40.85), (-74.05, 40.8), (-74.1, 40.6)]
+    hole = [(-74.0, 40.7), (-73.9, 40.7), (-73.9, 40.75), (-74.0, 40.75), (-74.0, 40.7)]
+    for rings in [[exterior], [exterior, hole]]:
+        with np.errstate(invalid='ignore'):
+            expected = points_in_polygon(lat, lon, rings) & np.isfinite(lat) & np.isfinite(lon)
+        assert expected.sum() > 0
+        same_rows(index.polygon(rings), expected)
+    assert len(np.intersect1d(index.polygon([exterior, hole]), index.polygon([hole]))) == 0
+
+
+def test_mask():
+    lat, lon = make_points()
+    index = GridIndex(lat, lon)
+    box = (40.6, -74.0, 40.8, -73.85)
+    mask = index.mask(index.bbox(*box))
+    assert mask.shape == (len(lat),)
+    assert np.array_equal(mask, in_box(lat, lon, *box))
+
+
+def test_brush_crossfilter():
+    from nyc_collisions.projects import import_charts
+
+    brush_crossfilter = import_charts('project2').brush_crossfilter
+    lat, lon = make_points()
+    frame = pd.DataFrame({'LATITUDE': lat, 'LONGITUDE': lon,
+                          'BOROUGH': np.random.default_rng(0).choice(['BRONX', 'QUEENS'], len(lat))})
+    index = GridIndex(lat, lon)
+    crossfilter = Crossfilter(frame, ['BOROUGH'])
+    brush = {'LONGITUDE': [-74.0, -73.85], 'LATITUDE': [40.6, 40.8]}
+
+    inside = in_box(lat, lon, 40.6, -74.0, 40.8, -73.85)
+    brush_crossfilter(crossfilter, brush, index)
+    assert np.array_equal(crossfilter.selected(), inside)
+    assert crossfilter.group('BOROUGH').tolist() == frame[inside].groupby('BOROUGH').size().tolist()
+
+    brush_crossfilter(crossfilter, {'LONGITUDE': [-70, -69], 'LATITUDE': [40.6, 40.8]}, index)
+    assert crossfilter.total() == 0
+    brush_crossfilter(crossfilter, {}, index)
+    assert crossfilter.total() == len(frame)
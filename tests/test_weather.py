@@ -0,0 +1,160 @@
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pandas.testing as tm
+import pytest
+
+from nyc_collisions.projects import ROOT
+from nyc_collisions.weather import WeatherStore
+
+WEATHER = [os.path.join(ROOT, 'Project 1', 'data', 'weather.csv'),
+           os.path.join(ROOT, 'Project 2', 'data', 'weather2018.csv')]
+COLUMNS = ['conditions', 'icon', 'temp', 'precip', 'uvindex', 'sunrise']
+
+
+@pytest.fixture(scope='module')
+def paths(tmp_path_factory):
+    """Copies of the weather CSVs of the projects, so their parquet caches stay out of the repo."""
+    directory = tmp_path_factory.mktemp('weather')
+    return [shutil.copy(path, directory / f'{i}-{os.path.basename(path)}') for i, path in enumerate(WEATHER)]
+
+
+@pytest.fixture(scope='module')
+def weather(paths):
+    """The days of both files, the later one winning on the days they share."""
+    frame = pd.concat([pd.read_csv(path, parse_dates=['datetime']) for path in paths], ignore_index=True)
+    return frame.drop_duplicates('datetime', keep='last').sort_values('datetime', ignore_index=True)
+
+
+def make_timestamps(n=2000, seed=0):
+    """Timestamps from before the first day of weather to after the last, some missing.
+
+    The weather covers the summers of 2018 to 2020 only, so most days in
+    between have none either.
+    """
+    rng = np.random.default_rng(seed)
+    start, end = pd.Timestamp('2018-05-20'), pd.Timestamp('2020-10-15')
+    timestamps = pd.Series(start + pd.to_timedelta(rng.integers(0, (end - start).total_seconds(), n), unit='s'))
+    timestamps[rng.random(n) < 0.02] = pd.NaT
+    return timestamps
+
+
+def as_values(series):
+    """Categorical and object columns as plain strings, for comparing with ``pd.merge``."""
+    if isinstance(series.dtype, pd.CategoricalDtype) or series.dtype == object:
+        return series.astype(object).where(series.notna(), None)
+    return series
+
+
+def same_columns(result, expected):
+    assert list(result.columns) == list(expected.columns)
+    for column in result.columns:
+        tm.assert_series_equal(as_values(result[column]).reset_index(drop=True),
+                               as_values(expected[column]).reset_index(drop=True), check_dtype=False)
+
+
+def merged(frame, weather, columns, how='left'):
+    """``pd.merge`` on the day, in the order of ``frame`` (an inner merge groups the rows by key)."""
+    days = frame.assign(_day=frame['CRASH_DATETIME'].dt.normalize(), _row=np.arange(len(frame)))
+    right = weather[['datetime'] + columns].rename(columns={'datetime': '_day'})
+    return pd.merge(days, right, on='_day', how=how).sort_values('_row').drop(columns=['_day', '_row'])
+
+
+def test_from_csv(paths, weather):
+    store = WeatherStore.from_csv(paths)
+    assert len(store) == len(weather)
+    assert np.array_equal(store.times, weather['datetime'].to_numpy())
+    assert str(store.times[0])[:10] == '2018-06-01' and str(store.times[-1])[:10] == '2020-10-01'
+    assert list(WeatherStore.from_csv(paths, columns=COLUMNS).columns) == COLUMNS
+
+
+@pytest.mark.parametrize('column', COLUMNS)
+def test_lookup(paths, weather, column):
+    store = WeatherStore.from_csv(paths)
+    timestamps = make_timestamps()
+    frame = pd.DataFrame({'CRASH_DATETIME': timestamps})
+    expected = merged(frame, weather, [column])[column]
+    result = pd.Series(store.lookup(timestamps, column))
+    same_columns(result.to_frame(column), expected.to_frame(column))
+    # days outside the store and days missing in it alike
+    assert result.isna().sum() == expected.isna().sum() > timestamps.isna().sum()
+
+
+@pytest.mark.parametrize('how', ['left', 'inner'])
+def test_join(paths, weather, how):
+    store = WeatherStore.from_csv(paths)
+    frame = pd.DataFrame({'CRASH_DATETIME': make_timestamps(seed=1), 'TOTAL_KILLED': np.arange(2000)})
+    result = store.join(frame, 'CRASH_DATETIME', COLUMNS, how=how)
+    same_columns(result, merged(frame, weather, COLUMNS, how=how))
+    assert list(store.join(frame, 'CRASH_DATETIME', how=how).columns) == list(frame.columns) + list(store.columns)
+    with pytest.raises(ValueError):
+        store.join(frame, 'CRASH_DATETIME', how='outer')
+
+
+def test_join_the_collisions(paths):
+    collisions = pd.read_csv(os.path.join(ROOT, 'Project 1', 'data', 'preprocessed-collisions.csv'), nrows=3000)
+    collisions['CRASH_DATETIME'] = pd.to_datetime(collisions['CRASH_DATE'] + ' ' + collisions['CRASH_TIME'])
+    store = WeatherStore.from_csv(paths[1])
+    result = store.join(collisions, 'CRASH_DATETIME', ['icon'], how='inner')
+    same_columns(result, merged(collisions, pd.read_csv(paths[1], parse_dates=['datetime']), ['icon'], how='inner'))
+    assert len(result) == len(collisions)
+
+
+def hourly(seed=0):
+    """Irregular observations over a week, two of them at the same time."""
+    rng = np.random.default_rng(seed)
+    times = pd.Timestamp('2020-07-01') + pd.to_timedelta(np.sort(rng.integers(0, 7 * 24 * 60, 120)), unit='min')
+    times = times.insert(60, times[60])
+    return pd.DataFrame({'datetime': times,
+                         'temp': rng.normal(25, 4, len(times)).round(1),
+                         'conditions': rng.choice(['Clear', 'Rain', 'Overcast'], len(times))})
+
+
+@pytest.mark.parametrize('tolerance', [None, '30min', '2h', '0s'])
+def test_asof_rows(tolerance):
+    observations = hourly()
+    store = WeatherStore(observations)
+    rng = np.random.default_rng(1)
+    # from before the first observation to days after the last, exactly on some of them
+    timestamps = pd.Series(pd.Timestamp('2020-06-30 20:00') + pd.to_timedelta(rng.integers(0, 10 * 24 * 60, 500), unit='min'))
+    timestamps[:40] = observations['datetime'].sample(40, random_state=0).to_numpy()
+    timestamps[rng.random(500) < 0.02] = pd.NaT
+    frame = pd.DataFrame({'t': timestamps, 'row': np.arange(500)})
+
+    valid = frame.dropna(subset=['t']).sort_values('t', kind='stable')
+    expected = pd.merge_asof(valid, observations.assign(store_row=np.arange(len(observations))),
+                             left_on='t', right_on='datetime',
+                             tolerance=pd.Timedelta(tolerance) if tolerance else None)
+    expected = expected.set_index('row')['store_row'].reindex(frame['row']).fillna(-1).astype(int)
+
+    rows = store.asof_rows(timestamps, pd.Timedelta(tolerance) if tolerance else None)
+    assert rows.tolist() == expected.tolist()
+    assert (rows == -1).any() and (rows >= 0).any()
+
+    joined = store.join(frame, 't', ['temp', 'conditions'], asof=True,
+                        tolerance=pd.Timedelta(tolerance) if tolerance else None)
+    np.testing.assert_array_equal(joined['temp'], np.where(rows >= 0, observations['temp'].to_numpy()[rows], np.nan))
+    assert joined['conditions'].isna().tolist() == (rows < 0).tolist()
+
+
+def test_several_observations_a_day():
+    store = WeatherStore(hourly())
+    # the day of a timestamp has the weather of its last observation
+    day_ends = hourly().groupby(hourly()['datetime'].dt.normalize()).tail(1)
+    assert store.lookup(day_ends['datetime'].dt.normalize() + pd.Timedelta('12h'), 'temp').tolist() == \
+        day_ends['temp'].tolist()
+
+
+def test_empty_store():
+    store = WeatherStore(hourly().iloc[:0])
+    timestamps = pd.Series(pd.to_datetime(['2020-07-01', None]))
+    assert store.rows(timestamps).tolist() == [-1, -1]
+    assert store.asof_rows(timestamps).tolist() == [-1, -1]
+    assert np.isnan(store.lookup(timestamps, 'temp')).all()
+
+
+def test_fingerprint(paths):
+    assert WeatherStore.from_csv(paths).fingerprint() == WeatherStore.from_csv(paths).fingerprint()
+    assert WeatherStore.from_csv(paths).fingerprint() != WeatherStore.from_csv(paths[:1]).fingerprint()